@@ -1,17 +1,66 @@
 import os  # ⬅️ ADD THIS CRITICAL IMPORT
-from flask import Flask, render_template, request, session, jsonify
+from flask import Flask, render_template, request, session, jsonify, g, send_file, has_request_context
 import numpy as np
 import pandas as pd
 import joblib
 
-from tensorflow.keras.models import load_model
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): counter tables stay in process memory
+    fcntl = None
+
+try:
+    from tensorflow.keras.models import load_model
+except ImportError:  # TensorFlow-free image serving through ONNX Runtime
+    load_model = None
 import random
 import re
+import csv
+import io
+import json
+import sqlite3
+import threading
+import queue
+import time
+import hashlib
+import atexit
+import sys
+import uuid
+import heapq
+import string
+import functools
+import itertools
+import math
+import textwrap
+import zipfile
+import shutil
+import contextlib
+import collections
+import hmac
+import gc
+import signal
+import tracemalloc
+from collections import OrderedDict
 from datetime import datetime
 from flask import redirect
 
+_thread_state = threading.local()
+
+def thread_rng():
+    """random.Random private to the calling thread, so request threads never share RNG state
+
+    Seeded from os.urandom on first use in each thread and again after fork().
+    """
+    rng = getattr(_thread_state, 'rng', None)
+    if rng is None or _thread_state.rng_pid != os.getpid():
+        rng = _thread_state.rng = random.Random()
+        _thread_state.rng_pid = os.getpid()
+    return rng
+
 # ==================== STUDENT ADVISOR MODEL ====================
 class StudentAdvisorModel:
+    PERFORMANCE_LEVELS = ['Below Average', 'Average', 'Good', 'Excellent']
+
     def __init__(self):
         self.knowledge_base = self._build_knowledge_base()
         self.templates = self._build_response_templates()
@@ -98,8 +147,13 @@ class StudentAdvisorModel:
             }
         }
     
-    def analyze_student_profile(self, student_data):
-        """Deep NLP-based analysis"""
+    def analyze_student_profile(self, student, trend=None, ranking=None):
+        """Deep NLP-based analysis of a StudentProfile (or any record it can be built from)
+
+        trend is the student's row from student_history.trend(), when they have one;
+        ranking is their cohort_rankings.rank_student() result.
+        """
+        student = StudentProfile.coerce(student)
         analysis = {
             'performance_summary': '',
             'key_strengths': [],
@@ -110,39 +164,105 @@ class StudentAdvisorModel:
         }
         
         # Intelligent CGPA Analysis
-        cgpa_analysis = self._analyze_cgpa(student_data['total_cgpa'])
+        cgpa_analysis = self._analyze_cgpa(student.total_cgpa)
         analysis['performance_summary'] += cgpa_analysis['summary']
         analysis['key_strengths'].extend(cgpa_analysis['strengths'])
         analysis['critical_areas'].extend(cgpa_analysis['concerns'])
         
         # Attendance Analysis
-        attendance_analysis = self._analyze_attendance(student_data['attendance'])
+        attendance_analysis = self._analyze_attendance(student.attendance)
         analysis['performance_summary'] += " " + attendance_analysis['summary']
         analysis['critical_areas'].extend(attendance_analysis['concerns'])
         
         # Study Habits Analysis
-        study_analysis = self._analyze_study_habits(student_data['study_hours'])
+        study_analysis = self._analyze_study_habits(student.study_hours)
         analysis['performance_summary'] += " " + study_analysis['summary']
         analysis['improvement_opportunities'].extend(study_analysis['suggestions'])
         
         # Backlog Analysis
-        if student_data['backlogs'] > 0:
-            backlog_analysis = self._analyze_backlogs(student_data['backlogs'])
+        if student.backlogs > 0:
+            backlog_analysis = self._analyze_backlogs(student.backlogs)
             analysis['critical_areas'].extend(backlog_analysis['concerns'])
             analysis['risk_factors'].append(backlog_analysis['risk'])
         
         # Extracurricular Analysis
         extracurricular_analysis = self._analyze_extracurricular(
-            student_data['competitions'], 
-            student_data['projects_internships']
+            student.competitions, 
+            student.projects_internships
         )
         analysis['improvement_opportunities'].extend(extracurricular_analysis['suggestions'])
         
         # Confidence Analysis
-        confidence_analysis = self._analyze_confidence(student_data['confidence_level'])
+        confidence_analysis = self._analyze_confidence(student.confidence_level)
         analysis['improvement_opportunities'].extend(confidence_analysis['suggestions'])
+
+        # Trajectory across recorded terms
+        if trend and trend['terms'] > 1:
+            trajectory_analysis = self._analyze_trajectory(trend)
+            analysis['trajectory'] = trend['direction']
+            analysis['performance_summary'] += " " + trajectory_analysis['summary']
+            analysis['key_strengths'].extend(trajectory_analysis['strengths'])
+            analysis['critical_areas'].extend(trajectory_analysis['concerns'])
+
+        # Position within the cohort
+        if ranking and ranking['positions']:
+            ranking_analysis = self._analyze_ranking(ranking, student.predicted_class)
+            analysis['relative_position'] = {
+                'cohort': ranking['cohort'],
+                'size': ranking['size'],
+                'percentiles': {metric: position['percentile'] for metric, position in ranking['positions'].items()}
+            }
+            analysis['performance_summary'] += " " + ranking_analysis['summary']
+            analysis['key_strengths'].extend(ranking_analysis['strengths'])
+            analysis['critical_areas'].extend(ranking_analysis['concerns'])
         
         return analysis
+
+    def _analyze_ranking(self, ranking, predicted_class=None):
+        """Where the student's CGPA, attendance and predicted class stand among their peers"""
+        positions = ranking['positions']
+        phrases, strengths, concerns = [], [], []
+        for metric, label in (('total_cgpa', 'CGPA'), ('attendance', 'attendance')):
+            if metric not in positions:
+                continue
+            percentile = positions[metric]['percentile']
+            phrases.append(f"your {label} is in the {ordinal(percentile)} percentile")
+            if percentile >= 75:
+                strengths.append(f"Top-quarter {label} in your cohort")
+            elif percentile < 25:
+                concerns.append(f"{label[0].upper()}{label[1:]} in the bottom quarter of your cohort")
+        summary = f"Among {ranking['size']} students in {ranking['cohort']}, " + " and ".join(phrases) if phrases else ""
+        probability_metric = f"p_{predicted_class.lower().replace(' ', '_')}" if predicted_class else None
+        if probability_metric in positions:
+            beats = f"your predicted {predicted_class} probability beats {positions[probability_metric]['below']:.0f}% of peers"
+            summary = f"{summary}, and {beats}" if summary else f"In {ranking['cohort']}, {beats}"
+        return {
+            'summary': f"{summary}." if summary else "",
+            'strengths': strengths,
+            'concerns': concerns
+        }
+
+    def _analyze_trajectory(self, trend):
+        """Improvement or decline over the student's recorded terms"""
+        span = f"over your last {trend['terms']} terms ({trend['first_term']} to {trend['last_term']})"
+        slope = trend['cgpa_slope'] or 0.0
+        if trend['direction'] == 'improving':
+            return {
+                'summary': f"Your CGPA has risen by about {slope:.2f} points per term {span}.",
+                'strengths': ["Consistent improvement across semesters"],
+                'concerns': []
+            }
+        elif trend['direction'] == 'declining':
+            return {
+                'summary': f"Your CGPA has dropped by about {abs(slope):.2f} points per term {span}.",
+                'strengths': [],
+                'concerns': ["Reverse the CGPA decline of recent semesters before it compounds"]
+            }
+        return {
+            'summary': f"Your CGPA has held steady {span}.",
+            'strengths': [],
+            'concerns': []
+        }
     
     def _analyze_cgpa(self, cgpa):
         """Intelligent CGPA analysis with contextual understanding"""
@@ -258,9 +378,18 @@ class StudentAdvisorModel:
         else:
             return {'suggestions': ["Work on confidence through small wins and preparation"]}
     
-    def generate_advice(self, student_data, predicted_class):
-        """Main method to generate GPT-like intelligent advice"""
-        analysis = self.analyze_student_profile(student_data)
+    def generate_advice(self, student_data, predicted_class, attributions=None, trend=None, ranking=None,
+                        peers=None):
+        """Main method to generate GPT-like intelligent advice
+
+        attributions ({feature: model attribution}) puts the recommendations for the
+        features that moved the DNN prediction most first; trend (student_history.trend())
+        adds their improvement or decline across terms, ranking (cohort_rankings) their
+        percentile among peers, and peers (peer_neighbors.similar()) what the most similar
+        past students changed before they improved.
+        """
+        student = StudentProfile.coerce(student_data)
+        analysis = self.analyze_student_profile(student, trend, ranking)
         
         # Build natural language response
         response_parts = []
@@ -290,8 +419,12 @@ class StudentAdvisorModel:
         response_parts.append(self._random_template('action_plan'))
         
         # Specific recommendations
-        recommendations = self._generate_specific_recommendations(student_data, analysis)
+        recommendations = self._generate_specific_recommendations(student, analysis, attributions)
         response_parts.extend(recommendations)
+
+        # What similar students did
+        if peers and peers['improved']:
+            response_parts.append(self._peer_insight(peers))
         
         # Encouragement
         target = self._get_target_performance(predicted_class)
@@ -300,68 +433,101 @@ class StudentAdvisorModel:
         
         return "\n\n".join(response_parts)
     
+    def _peer_insight(self, peers):
+        """Next-term changes that set the improvers among similar past students apart"""
+        lines = [
+            f"👥 **Students Like You:**\n"
+            f"• {peers['improved']} of the {peers['peers']} past students most similar to you "
+            f"improved the following term"
+            + (f" (CGPA {peers['improved_cgpa_change']:+.2f} on average)" if peers['improved_cgpa_change'] else "")
+        ]
+        differences = []
+        for feature, raised, lowered, unit in PEER_ACTIONS:
+            change = peers['changes'][feature]
+            difference = change['improved'] - (change['others'] or 0.0)
+            if abs(change['improved']) >= 0.1 and difference * change['improved'] > 0:
+                differences.append((abs(difference), feature, raised, lowered, unit, change))
+        for _, feature, raised, lowered, unit, change in sorted(differences, reverse=True)[:3]:
+            verb = raised if change['improved'] > 0 else lowered
+            if unit:
+                others = f" (the rest: {change['others']:+.1f})" if change['others'] is not None else ""
+                lines.append(f"• They {verb} {abs(change['improved']):.1f}{unit} on average{others}")
+            else:  # 0/1 features: the mean change is the net share of students who switched
+                others = f" (the rest: {change['others'] * 100:+.0f}%)" if change['others'] is not None else ""
+                lines.append(f"• A net {abs(change['improved']) * 100:.0f}% of them {verb}{others}")
+        return "\n".join(lines)
+
     def _random_template(self, template_type):
         """Select random template for natural variation"""
-        return random.choice(self.templates[template_type])
+        return thread_rng().choice(self.templates[template_type])
     
-    def _generate_specific_recommendations(self, student_data, analysis):
+    def _generate_specific_recommendations(self, student, analysis, attributions=None):
         """Generate specific, actionable recommendations"""
-        recommendations = []
+        recommendations = []  # (features the advice addresses, text)
         
         # Academic recommendations
-        if student_data['total_cgpa'] < 8.0:
-            recommendations.append(
+        if student.total_cgpa < 8.0:
+            recommendations.append((
+                ('total_cgpa', 'prevsem_cgpa'),
                 f"🎯 **Academic Excellence Plan:**\n"
-                f"• Target CGPA: 8.0+ (Current: {student_data['total_cgpa']}/10)\n"
+                f"• Target CGPA: 8.0+ (Current: {student.total_cgpa}/10)\n"
                 f"• Strategy: Identify 2 weakest subjects for focused improvement\n"
                 f"• Action: Daily 1-hour dedicated study for each weak subject\n"
                 f"• Resources: Faculty guidance + peer study groups"
-            )
+            ))
         
         # Attendance recommendations
-        if student_data['attendance'] < 85:
-            recommendations.append(
+        if student.attendance < 85:
+            recommendations.append((
+                ('attendance',),
                 f"📅 **Attendance Improvement:**\n"
-                f"• Current: {student_data['attendance']}% → Target: 90%+\n"
+                f"• Current: {student.attendance}% → Target: 90%+\n"
                 f"• Benefit: Better concept clarity + faculty rapport\n"
                 f"• Tip: Set morning alarms + prepare notes night before\n"
                 f"• Accountability: Study partner for mutual motivation"
-            )
+            ))
         
         # Study habits recommendations
-        if student_data['study_hours'] < 20:
-            recommendations.append(
+        if student.study_hours < 20:
+            recommendations.append((
+                ('study_hours',),
                 f"⏰ **Study Optimization:**\n"
-                f"• Current: {student_data['study_hours']} hrs/week → Target: 25+ hrs\n"
+                f"• Current: {student.study_hours} hrs/week → Target: 25+ hrs\n"
                 f"• Technique: Pomodoro (25min focus, 5min break)\n"
                 f"• Schedule: 4-5 hours daily with variety in subjects\n"
                 f"• Quality: Active learning over passive reading"
-            )
+            ))
         
         # Backlog recommendations
-        if student_data['backlogs'] > 0:
-            recommendations.append(
+        if student.backlogs > 0:
+            recommendations.append((
+                ('backlogs',),
                 f"🔧 **Backlog Clearance Strategy:**\n"
-                f"• Current: {student_data['backlogs']} backlogs\n"
+                f"• Current: {student.backlogs} backlogs\n"
                 f"• Priority: Clear easiest backlog first for momentum\n"
                 f"• Schedule: 2 hours daily backlog study\n"
                 f"• Goal: Clear 1-2 backlogs per semester"
-            )
+            ))
         
         # Skill development recommendations
-        if student_data['competitions'] == 0 or student_data['projects_internships'] == 0:
+        if student.competitions == 0 or student.projects_internships == 0:
             skill_text = "🚀 **Skill Development Roadmap:**\n"
-            if student_data['competitions'] == 0:
+            if student.competitions == 0:
                 skill_text += "• Start with college-level coding competitions\n• Practice on HackerRank/LeetCode (30min daily)\n• Join programming clubs\n"
-            if student_data['projects_internships'] == 0:
+            if student.projects_internships == 0:
                 skill_text += "• Build 2 mini-projects this semester\n• Learn Git and create GitHub portfolio\n• Apply for summer internships\n"
-            recommendations.append(skill_text)
+            recommendations.append((('competitions', 'projects_internships'), skill_text))
         
-        return recommendations
+        if attributions:
+            # Most influential features first; stable sort keeps the default order for ties
+            recommendations.sort(
+                key=lambda item: -max(abs(attributions.get(feature, 0.0)) for feature in item[0])
+            )
+        return [text for _, text in recommendations]
     
     def _get_target_performance(self, current_class):
         """Get next performance level target"""
-        levels = ['Below Average', 'Average', 'Good', 'Excellent']
+        levels = self.PERFORMANCE_LEVELS
         current_index = levels.index(current_class)
         if current_index < len(levels) - 1:
             return levels[current_index + 1]
@@ -467,12 +633,128 @@ app = Flask(__name__, template_folder='student_performance_dnn/templates')
 app.secret_key = 'your_secret_key_here'
 # KEEP ALL YOUR EXISTING CODE BELOW EXACTLY THE SAME
 
+# ==================== INFERENCE BACKENDS ====================
+# INFERENCE_BACKEND=keras (default) serves the .keras model through TensorFlow,
+# INFERENCE_BACKEND=onnx serves the exported .onnx model (see export_onnx.py)
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'keras').lower()
+ONNX_MODEL_PATH = os.environ.get('ONNX_MODEL_PATH', "student_performance_dnn/production_model/student_performance_model.onnx")
+ONNX_INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', 1))
+ONNX_INTER_OP_THREADS = int(os.environ.get('ONNX_INTER_OP_THREADS', 1))
+
+class OnnxInferenceBackend:
+    """ONNX Runtime CPU session with the same predict() call as the Keras model"""
+    def __init__(self, model_path, intra_op_threads=1, inter_op_threads=1):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        # One session per process, reused by every request (run() is thread-safe)
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=['CPUExecutionProvider']
+        )
+        model_input = self.session.get_inputs()[0]
+        model_output = self.session.get_outputs()[0]
+        self.input_name = model_input.name
+        self.output_name = model_output.name
+        self.input_shape = (None, model_input.shape[1])
+        self.output_shape = (None, model_output.shape[1])
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.includes_scaler = metadata.get('includes_scaler') == 'true'
+
+    def predict(self, input_data, batch_size=None, verbose=0):
+        """Return class probabilities for a (n_rows, n_features) matrix"""
+        input_data = np.ascontiguousarray(input_data, dtype=np.float32)
+        return self.session.run([self.output_name], {self.input_name: input_data})[0]
+
+class KerasInferenceBackend:
+    """Keras model behind one pre-traced tf.function, safe to call from many threads at once
+
+    Model.predict() builds a data adapter and lazily compiles its predict function on
+    every cold start, which races when request threads hit it together and costs tens of
+    milliseconds per call. The forward pass here is traced once at load time for any
+    batch size, and concurrent calls run in parallel inside TensorFlow without a lock.
+    """
+    def __init__(self, keras_model):
+        import tensorflow as tf
+
+        self.model = keras_model
+        self.input_shape = keras_model.input_shape
+        self.output_shape = keras_model.output_shape
+        self._forward = tf.function(
+            lambda features: keras_model(features, training=False),
+            input_signature=[tf.TensorSpec([None, self.input_shape[1]], tf.float32)]
+        )
+        self._forward.get_concrete_function()  # trace before any request thread can
+
+    def memory_info(self):
+        """Trace count (should stay 1: growth means graph caches are accumulating) and device memory"""
+        import tensorflow as tf
+
+        info = {'tf_function_traces': self._forward.experimental_get_tracing_count()}
+        try:
+            info['device_memory'] = tf.config.experimental.get_memory_info('CPU:0')
+        except (ValueError, RuntimeError):
+            pass  # only GPU devices report allocator statistics
+        return info
+
+    def predict(self, input_data, batch_size=None, verbose=0):
+        """Return class probabilities for a (n_rows, n_features) matrix"""
+        input_data = np.ascontiguousarray(input_data, dtype=np.float32)
+        if not batch_size or len(input_data) <= batch_size:
+            return self._forward(input_data).numpy()
+        return np.concatenate([
+            self._forward(input_data[start:start + batch_size]).numpy()
+            for start in range(0, len(input_data), batch_size)
+        ])
+
+KERAS_MODEL_PATH = "student_performance_dnn/production_model/student_performance_model.keras"
+
+def file_digest(path, length=12):
+    """Short sha256 of a file, used to tag which model produced a prediction"""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()[:length]
+    except OSError:
+        return 'unknown'
+
+MODEL_VERSION = os.environ.get('MODEL_VERSION') or file_digest(KERAS_MODEL_PATH)
+
+# Under gunicorn --preload (see gunicorn.conf.py) everything except the model session is
+# built once in the master and shared copy-on-write; TensorFlow and ONNX Runtime thread
+# pools do not survive fork(), so each worker loads the model in init_worker().
+MODEL_LOAD_ON_FORK = os.environ.get('MODEL_LOAD_ON_FORK', 'false').lower() in ('1', 'true', 'yes')
+# Request threads provide the parallelism; one TensorFlow math thread per call keeps
+# N request threads from fanning out into N x cores TensorFlow threads
+TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', 1))
+TF_INTER_OP_THREADS = int(os.environ.get('TF_INTER_OP_THREADS', 1))
+
+def load_inference_backend():
+    """Load the configured model backend for this process"""
+    if INFERENCE_BACKEND == 'onnx':
+        return OnnxInferenceBackend(ONNX_MODEL_PATH, ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS)
+    import tensorflow as tf
+    try:
+        # 0 keeps TensorFlow's default (one thread per core) for that pool
+        tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+    except RuntimeError as e:  # TensorFlow runtime already initialised in this process
+        print(f"⚠️ TensorFlow thread limits not applied: {e}")
+    return KerasInferenceBackend(load_model(KERAS_MODEL_PATH))
+
 # Load models with error handling
 try:
     scaler = joblib.load("student_performance_dnn/production_model/scaler.pkl")
-    dnn_model = load_model("student_performance_dnn/production_model/student_performance_model.keras")
+    dnn_model = None if MODEL_LOAD_ON_FORK else load_inference_backend()
     label_encoder = joblib.load("student_performance_dnn/production_model/label_encoder.pkl")
-    print("✅ Models loaded successfully")
+    if dnn_model is None:
+        print(f"✅ Scaler and encoder loaded, {INFERENCE_BACKEND} model deferred to workers")
+    else:
+        print(f"✅ Models loaded successfully ({INFERENCE_BACKEND} backend)")
 except Exception as e:
     print(f"❌ Error loading models: {e}")
     # You might want to handle this more gracefully in production
@@ -492,109 +774,2797 @@ SCALER_FEATURES = [
 # Get class labels from your label encoder
 CLASS_LABELS = list(label_encoder.classes_) if 'label_encoder' in locals() else ['Below Average', 'Average', 'Good', 'Excellent']
 
+# ==================== FEATURE SCHEMA ====================
+class FeatureValidationError(ValueError):
+    """Raised with every validation problem of a record, not just the first one"""
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(errors))
+
+class StudentFeatureSchema:
+    """Precompiled parse/validate/encode schema for the 8 SCALER_FEATURES"""
+    def __init__(self):
+        self.fields = self._build_fields()
+        self.n_features = len(self.fields)
+        self.integer_features = {name for name, kind, _, _, _ in self.fields if kind != 'range'}
+
+    def _build_fields(self):
+        """(feature, kind, spec, label, error message) compiled once in SCALER_FEATURES order"""
+        yes_no_map = {"Yes": 1, "More than 2": 1, "No": 0}  # "More than 2" treated as "Yes"
+        fields = {
+            'total_cgpa': ('range', (0.0, 10.0), "Total CGPA", "Total CGPA must be between 0 and 10"),
+            'attendance': ('range', (0.0, 100.0), "Attendance", "Attendance must be between 0% and 100%"),
+            'study_hours': ('choice', {
+                "0-10 (Minimal)": 5,
+                "11-20 (Moderate)": 15,
+                "21-30 (Regular)": 25,
+                "31+ (Intensive)": 35
+            }, "Study hours", None),
+            'backlogs': ('choice', {"0": 0, "1": 1, "2": 2, "3": 3, "4": 4, "5+": 6}, "Backlogs", None),
+            'competitions': ('choice', yes_no_map, "Competitions", None),
+            'projects_internships': ('choice', yes_no_map, "Projects/Internships", None),
+            'prevsem_cgpa': ('range', (0.0, 10.0), "Previous Semester CGPA",
+                             "Previous Semester CGPA must be between 0 and 10"),
+            'confidence_level': ('int_range', (1, 10), "Confidence level",
+                                 "Confidence level must be between 1 and 10")
+        }
+
+        compiled = []
+        for name in SCALER_FEATURES:
+            kind, spec, label, message = fields[name]
+            if kind == 'choice':
+                options = list(spec)
+                # JSON/CSV callers may send the already-encoded number instead of the form label
+                lookup = dict(spec)
+                for encoded in spec.values():
+                    lookup.setdefault(encoded, encoded)
+                    lookup.setdefault(str(encoded), encoded)
+                spec = lookup
+                message = f"{label} must be one of {options}"
+            compiled.append((name, kind, spec, label, message))
+        return compiled
+
+    def encode_into(self, record, out):
+        """Parse, validate and encode one record into the float32 row `out`; return all errors"""
+        errors = []
+        by_position = not hasattr(record, 'get')  # CSV/list rows are in SCALER_FEATURES order
+        if by_position and (isinstance(record, (str, bytes)) or not hasattr(record, '__len__')):
+            return [f"Expected an object or a list of {self.n_features} values {SCALER_FEATURES}"]
+        if by_position and len(record) != self.n_features:
+            return [f"Expected {self.n_features} values {SCALER_FEATURES}, got {len(record)}"]
+
+        for i, (name, kind, spec, label, message) in enumerate(self.fields):
+            value = record[i] if by_position else record.get(name)
+            if isinstance(value, str):
+                value = value.strip()
+            if value is None or value == '':
+                errors.append(f"{label} is required")
+                continue
+            if not isinstance(value, (str, int, float, np.number)):
+                # JSON lists/objects: never valid, and unhashable for the choice lookup
+                errors.append(message if kind == 'choice' else f"{label} must be a number")
+                continue
+
+            if kind == 'choice':
+                encoded = spec.get(value)
+                if encoded is None:
+                    errors.append(message)
+                    continue
+            else:
+                try:
+                    encoded = float(value)
+                except (TypeError, ValueError):
+                    errors.append(f"{label} must be a number")
+                    continue
+                low, high = spec
+                if not (low <= encoded <= high):
+                    errors.append(message)
+                    continue
+                if kind == 'int_range' and not encoded.is_integer():
+                    errors.append(f"{label} must be a whole number")
+                    continue
+            out[i] = encoded
+        return errors
+
+    def encode(self, record):
+        """Encode a single form/JSON/CSV record into a (1, 8) float32 matrix"""
+        input_data = np.empty((1, self.n_features), dtype=np.float32)
+        errors = self.encode_into(record, input_data[0])
+        if errors:
+            raise FeatureValidationError(errors)
+        return input_data
+
+    def encode_many(self, records):
+        """Encode records into one preallocated (n, 8) float32 matrix
+
+        Returns (matrix, valid_mask, errors) where errors maps row index -> messages.
+        Invalid rows are left zeroed and flagged False in valid_mask.
+        """
+        records = records if isinstance(records, list) else list(records)
+        input_data = np.zeros((len(records), self.n_features), dtype=np.float32)
+        valid_mask = np.ones(len(records), dtype=bool)
+        errors = {}
+        for row_index, record in enumerate(records):
+            row_errors = self.encode_into(record, input_data[row_index])
+            if row_errors:
+                errors[row_index] = row_errors
+                valid_mask[row_index] = False
+        return input_data, valid_mask, errors
+
+    def encode_csv(self, csv_text):
+        """Encode CSV text with a SCALER_FEATURES header row"""
+        return self.encode_many(csv.DictReader(io.StringIO(csv_text)))
+
+    def encode_frame(self, frame):
+        """Column-at-a-time encode_many for a DataFrame of strings (pd.read_csv(dtype=str))
+
+        Same encodings and error messages as encode_into, for bulk files where a
+        per-row Python loop would dominate the scoring time.
+        """
+        missing_columns = [name for name, _, _, _, _ in self.fields if name not in frame]
+        if missing_columns:
+            raise FeatureValidationError([f"Missing columns: {missing_columns}"])
+
+        def parse(values, kind, spec):
+            if kind == 'choice':
+                return values.map(spec).to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+            return pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64, copy=True)
+
+        input_data = np.zeros((len(frame), self.n_features), dtype=np.float32)
+        problems = []  # (row mask, message) in field order
+        for i, (name, kind, spec, label, message) in enumerate(self.fields):
+            column = frame[name].fillna('').astype(str)
+            encoded = parse(column, kind, spec)
+            # Only values that failed to parse are stripped and retried (padding, blanks, errors)
+            missing = np.zeros(len(frame), dtype=bool)
+            unparsed = np.flatnonzero(np.isnan(encoded))
+            nan_literal = np.zeros(len(frame), dtype=bool)
+            if len(unparsed):
+                stripped = column.iloc[unparsed].str.strip()
+                encoded[unparsed] = parse(stripped, kind, spec)
+                missing[unparsed] = (stripped == '').to_numpy()
+                nan_literal[unparsed] = (stripped.str.lower().str.lstrip('+-') == 'nan').to_numpy()  # float() accepts it
+            problems.append((missing, f"{label} is required"))
+
+            if kind == 'choice':
+                problems.append((~missing & np.isnan(encoded), message))
+            else:
+                not_number = ~missing & np.isnan(encoded) & ~nan_literal
+                low, high = spec
+                with np.errstate(invalid='ignore'):
+                    out_of_range = ~missing & ~not_number & ~((encoded >= low) & (encoded <= high))
+                problems.append((not_number, f"{label} must be a number"))
+                problems.append((out_of_range, message))
+                if kind == 'int_range':
+                    whole = np.isnan(encoded) | (encoded == np.round(encoded))
+                    problems.append((~missing & ~not_number & ~out_of_range & ~whole, f"{label} must be a whole number"))
+            input_data[:, i] = np.nan_to_num(encoded)
+
+        invalid = np.logical_or.reduce([mask for mask, _ in problems])
+        errors = {
+            int(row_index): [text for mask, text in problems if mask[row_index]]
+            for row_index in np.flatnonzero(invalid)
+        }
+        input_data[invalid] = 0
+        return input_data, ~invalid, errors
+
+feature_schema = StudentFeatureSchema()
+
+# ==================== STUDENT PROFILE ====================
+# One student as a __slots__ object (request path) or one record of PROFILE_DTYPE
+# (cohorts): 18 packed bytes per student, predicted class stored as its CLASS_LABELS index
+PROFILE_DTYPE = np.dtype(
+    [(name, np.int8 if name in feature_schema.integer_features else np.float32) for name in SCALER_FEATURES]
+    + [('predicted_class', np.int8)]
+)
+
+class StudentProfile:
+    """A validated student: the 8 SCALER_FEATURES as attributes plus the predicted class label
+
+    Every stage accepts it: get()/[] make it a record for feature_schema.encode, to_row()
+    feeds scaling and prediction, and StudentAdvisorModel reads its attributes directly.
+    """
+    __slots__ = tuple(SCALER_FEATURES) + ('predicted_class',)
+
+    def __init__(self, predicted_class=None, **features):
+        for name in SCALER_FEATURES:
+            setattr(self, name, features[name])
+        self.predicted_class = predicted_class
+
+    @classmethod
+    def from_row(cls, row, predicted_class=None):
+        """Build from one encoded float32 row"""
+        # str() of a float32 is its shortest repr, so 8.6 stays 8.6 instead of 8.600000381
+        integer_features = feature_schema.integer_features
+        return cls(predicted_class, **{
+            name: int(value) if name in integer_features else float(str(value))
+            for name, value in zip(SCALER_FEATURES, row)
+        })
+
+    @classmethod
+    def coerce(cls, record):
+        """Profile from a StudentProfile, form/JSON dict, session list or PROFILE_DTYPE record
+
+        Raises FeatureValidationError for anything that does not pass the schema.
+        """
+        if isinstance(record, cls):
+            return record
+        predicted_class = None
+        if isinstance(record, np.void):
+            index = int(record['predicted_class'])
+            predicted_class = CLASS_LABELS[index] if index >= 0 else None
+            record = [record[name] for name in SCALER_FEATURES]
+        elif hasattr(record, 'get'):
+            predicted_class = record.get('predicted_class')
+        elif len(record) == len(SCALER_FEATURES) + 1:
+            predicted_class, record = record[-1], record[:-1]
+        return cls.from_row(feature_schema.encode(record)[0], predicted_class)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def to_row(self):
+        """(1, 8) float32 matrix for predict_probabilities / correction_stage"""
+        return np.array([[getattr(self, name) for name in SCALER_FEATURES]], dtype=np.float32)
+
+    def to_session(self):
+        """Compact JSON-safe list [8 features..., predicted class] for the Flask session"""
+        return [getattr(self, name) for name in SCALER_FEATURES] + [self.predicted_class]
+
+    def to_dict(self):
+        return dict({name: getattr(self, name) for name in SCALER_FEATURES}, predicted_class=self.predicted_class)
+
+    def __repr__(self):
+        return f"StudentProfile({self.to_dict()})"
+
+def profile_array(input_data, final_classes=None):
+    """Cohort as one contiguous PROFILE_DTYPE array from an (n, 8) feature matrix"""
+    profiles = np.empty(len(input_data), dtype=PROFILE_DTYPE)
+    for i, name in enumerate(SCALER_FEATURES):
+        profiles[name] = input_data[:, i]
+    profiles['predicted_class'] = -1 if final_classes is None else final_classes
+    return profiles
+
+def profile_matrix(profiles):
+    """(n, 8) float32 feature matrix back from a PROFILE_DTYPE array"""
+    input_data = np.empty((len(profiles), len(SCALER_FEATURES)), dtype=np.float32)
+    for i, name in enumerate(SCALER_FEATURES):
+        input_data[:, i] = profiles[name]
+    return input_data
+
+def session_profile():
+    """The analysed student stored in this session, or None"""
+    stored = session.get('student_data')
+    if not stored:
+        return None
+    try:
+        return StudentProfile.coerce(stored)
+    except FeatureValidationError:
+        return None
+
+PREDICT_BATCH_SIZE = int(os.environ.get('PREDICT_BATCH_SIZE', 8192))
+
+def predict_probabilities(input_data):
+    """Scale raw feature rows and score them with the active inference backend"""
+    # Keras defaults to 32-row batches; large matrices go through in big matmuls instead
+    batch_size = max(1, min(len(input_data), PREDICT_BATCH_SIZE))
+    with request_stage('predict'):
+        if getattr(dnn_model, 'includes_scaler', False):
+            # Scaler is folded into the ONNX graph, feed raw features directly
+            return dnn_model.predict(input_data, batch_size=batch_size, verbose=0)
+        return dnn_model.predict(scaler.transform(input_data), batch_size=batch_size, verbose=0)
+
+# ==================== PREDICTION CORRECTION RULES ====================
+# Each rule moves a low-confidence prediction from one class to another when the
+# student's features contradict it. Override with CORRECTION_RULES_PATH=rules.json
+# (a JSON list in the same shape) to change thresholds without a code edit.
+DEFAULT_CORRECTION_RULES = [
+    {
+        # Rule 1: If predicted as Excellent but CGPA < 8.0, likely should be Good
+        'name': 'excellent_low_cgpa',
+        'from_class': 'Excellent',
+        'to_class': 'Good',
+        'max_confidence': 0.85,          # Low confidence Excellent prediction
+        'min_target_probability': 0.15,  # Good probability is reasonable
+        'conditions': [['total_cgpa', '<', 8.0]]
+    },
+    {
+        # Rule 2: If predicted as Good but has Excellent characteristics (CGPA > 8.5, no backlogs)
+        'name': 'good_excellent_profile',
+        'from_class': 'Good',
+        'to_class': 'Excellent',
+        'max_confidence': 0.8,           # Low confidence Good prediction
+        'min_target_probability': 0.2,   # Excellent probability is reasonable
+        'conditions': [['total_cgpa', '>=', 8.5], ['backlogs', '==', 0], ['attendance', '>=', 85]]
+    }
+]
+
+CORRECTION_OPERATORS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal
+}
+
+def load_correction_rules(path=None):
+    """Load correction rules from a JSON file, falling back to DEFAULT_CORRECTION_RULES"""
+    path = path or os.environ.get('CORRECTION_RULES_PATH')
+    if not path:
+        return DEFAULT_CORRECTION_RULES
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+class CorrectionRuleStage:
+    """Vectorized post-processing of (n, classes) probability matrices with data-driven rules"""
+    def __init__(self, rules, class_labels, feature_names):
+        self.rules = rules
+        self.rule_names = [rule['name'] for rule in rules]
+        self.compiled_rules = self._compile_rules(rules, list(class_labels), list(feature_names))
+
+    def _compile_rules(self, rules, class_labels, feature_names):
+        """Resolve class/feature names to column indices and operators to ufuncs once"""
+        compiled = []
+        for rule in rules:
+            try:
+                conditions = [
+                    (feature_names.index(feature), CORRECTION_OPERATORS[op], float(value))
+                    for feature, op, value in rule.get('conditions', [])
+                ]
+                compiled.append((
+                    class_labels.index(rule['from_class']),
+                    class_labels.index(rule['to_class']),
+                    float(rule.get('max_confidence', 1.0)),
+                    float(rule.get('min_target_probability', 0.0)),
+                    conditions
+                ))
+            except (KeyError, ValueError) as e:
+                raise ValueError(f"Invalid correction rule {rule.get('name', rule)}: {e}")
+        return compiled
+
+    def apply(self, probabilities, features, predicted=None, confidence=None):
+        """Return (final class indices, index of the rule applied per row or -1)
+
+        probabilities is (n, classes) on a 0-1 scale, features is (n, 8) in SCALER_FEATURES
+        order. Rules only see the model's own prediction, and the first matching rule wins.
+        """
+        # float64 like the original Python-float comparisons: float32 model output against a
+        # Python threshold would otherwise compare in float32 (0.15f > 0.15 is False)
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        features = np.asarray(features, dtype=np.float64)
+        if predicted is None:
+            predicted = np.argmax(probabilities, axis=1)
+        confidence = np.max(probabilities, axis=1) if confidence is None else np.asarray(confidence, dtype=np.float64)
+
+        final = np.array(predicted, copy=True)
+        applied = np.full(len(final), -1, dtype=np.int8)
+        for rule_index, (from_idx, to_idx, max_confidence, min_target_probability, conditions) in enumerate(self.compiled_rules):
+            mask = (predicted == from_idx) & (applied == -1)
+            mask &= confidence < max_confidence
+            mask &= probabilities[:, to_idx] > min_target_probability
+            for column, op, value in conditions:
+                mask &= op(features[:, column], value)
+            final[mask] = to_idx
+            applied[mask] = rule_index
+        return final, applied
+
+correction_stage = CorrectionRuleStage(load_correction_rules(), CLASS_LABELS, SCALER_FEATURES)
+
 def fix_excellent_good_confusion(predicted_class, confidence, features_dict, probabilities):
     """
-    Fix ONLY Excellent/Good classification issues
+    Fix ONLY Excellent/Good classification issues (single-student wrapper around correction_stage)
     """
-    # Rule 1: If predicted as Excellent but CGPA < 8.0, likely should be Good
-    if (predicted_class == 'Excellent' and 
-        features_dict['total_cgpa'] < 8.0 and
-        confidence < 0.85):  # Low confidence Excellent prediction
-        
-        if probabilities.get('Good', 0) > 0.15:  # Good probability is reasonable
-            return 'Good'
-    
-    # Rule 2: If predicted as Good but has Excellent characteristics (CGPA > 8.5, no backlogs)
-    elif (predicted_class == 'Good' and 
-          features_dict['total_cgpa'] >= 8.5 and 
-          features_dict['backlogs'] == 0 and
-          features_dict['attendance'] >= 85 and
-          confidence < 0.8):  # Low confidence Good prediction
-        
-        if probabilities.get('Excellent', 0) > 0.2:  # Excellent probability is reasonable
-            return 'Excellent'
-    
-    return predicted_class
+    features = np.full((1, len(SCALER_FEATURES)), np.nan)
+    for feature, value in features_dict.items():
+        features[0, SCALER_FEATURES.index(feature)] = value
+    probability_row = np.array([[probabilities.get(label, 0) for label in CLASS_LABELS]])
 
-@app.route('/app', methods=['GET', 'POST'])
-def main_app():   
-    prediction_text = None
-    error_text = None
-    confidence_score = None
-    probabilities = None
+    final, _ = correction_stage.apply(
+        probability_row, features,
+        predicted=np.array([CLASS_LABELS.index(predicted_class)]),
+        confidence=np.array([confidence])
+    )
+    return CLASS_LABELS[final[0]]
+
+# ==================== PREDICTION AUDIT LOG ====================
+PREDICTION_LOG_ENABLED = os.environ.get('PREDICTION_LOG_ENABLED', 'true').lower() == 'true'
+PREDICTION_LOG_PATH = os.environ.get('PREDICTION_LOG_PATH', 'logs/predictions.db')
+PREDICTION_LOG_BATCH_SIZE = int(os.environ.get('PREDICTION_LOG_BATCH_SIZE', 256))
+PREDICTION_LOG_FLUSH_INTERVAL = float(os.environ.get('PREDICTION_LOG_FLUSH_INTERVAL', 1.0))
+PREDICTION_LOG_QUEUE_SIZE = int(os.environ.get('PREDICTION_LOG_QUEUE_SIZE', 10000))
+# off = never fsync, normal = fsync at WAL checkpoints, full = fsync every batch commit
+PREDICTION_LOG_SYNC = os.environ.get('PREDICTION_LOG_SYNC', 'normal').upper()
+
+class PredictionAuditLog:
+    """Append-only SQLite (WAL mode) prediction log written in batches by a background thread
+
+    Requests only enqueue their arrays; when the bounded queue is full the entry is
+    dropped and counted instead of blocking the request.
+    """
+    def __init__(self, path, batch_size=256, flush_interval=1.0, queue_size=10000,
+                 synchronous='NORMAL', enabled=True):
+        if synchronous not in ('OFF', 'NORMAL', 'FULL'):
+            raise ValueError(f"PREDICTION_LOG_SYNC must be off, normal or full, got {synchronous}")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.synchronous = synchronous
+        self.enabled = enabled
+        self.stats = {'logged': 0, 'dropped': 0, 'batches': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._queue = None
+        self._writer = None
+        self._pid = None
+
+    def _connect(self):
+        """Open a connection with WAL journaling and the configured fsync policy"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        feature_columns = ", ".join(f"{name} REAL" for name in SCALER_FEATURES)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS predictions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                source TEXT NOT NULL,
+                model_version TEXT NOT NULL,
+                {feature_columns},
+                model_class TEXT NOT NULL,
+                predicted_class TEXT NOT NULL,
+                confidence REAL NOT NULL,
+                probabilities TEXT NOT NULL,
+                correction TEXT
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_predictions_created_at ON predictions (created_at)')
+        return conn
+
+    def _ensure_writer(self):
+        """Start the writer thread lazily, and again in each forked worker process"""
+        if self._pid == os.getpid() and self._writer.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._writer.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._writer = threading.Thread(target=self._run, name='prediction-log-writer', daemon=True)
+            self._pid = os.getpid()
+            self._writer.start()
+
+    def record(self, input_data, prediction_probs, final_classes, applied_rules, source='app'):
+        """Enqueue one scored batch (raw features, probabilities, final classes, rule per row)"""
+        if not self.enabled:
+            return
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((time.time(), source, input_data, prediction_probs, final_classes, applied_rules))
+        except queue.Full:
+            self.stats['dropped'] += len(input_data)
+
+    def _run(self):
+        """Writer loop: group queued entries into one transaction per batch"""
+        conn = self._connect()
+        pending_queue = self._queue
+        running = True
+        while running:
+            try:
+                item = pending_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch, n_rows = [], 0
+            while item is not None:
+                batch.append(item)
+                n_rows += len(item[2])
+                if n_rows >= self.batch_size:
+                    break
+                try:
+                    item = pending_queue.get_nowait()
+                except queue.Empty:
+                    break
+            if item is None:
+                running = False  # close() sentinel
+            if batch:
+                self._write(conn, batch)
+        conn.close()
+
+    def _write(self, conn, batch):
+        """Insert a batch of queued entries in a single transaction"""
+        # Concatenate every queued entry so the NumPy work runs once per batch, not per row
+        sizes = [len(entry[2]) for entry in batch]
+        created_at = np.repeat([entry[0] for entry in batch], sizes).tolist()
+        sources = np.repeat([entry[1] for entry in batch], sizes).tolist()
+        features = np.round(np.concatenate([entry[2] for entry in batch]).astype(np.float64), 4).tolist()
+        prediction_probs = np.concatenate([entry[3] for entry in batch]).astype(np.float64)
+        model_classes = np.argmax(prediction_probs, axis=1).tolist()
+        confidences = np.max(prediction_probs, axis=1).tolist()
+        final_classes = np.concatenate([entry[4] for entry in batch]).tolist()
+        applied_rules = np.concatenate([entry[5] for entry in batch]).tolist()
+        probability_rows = prediction_probs.tolist()
+
+        rows = [
+            (
+                created_at[i], sources[i], MODEL_VERSION, *features[i],
+                CLASS_LABELS[model_classes[i]],
+                CLASS_LABELS[final_classes[i]],
+                confidences[i],
+                json.dumps(dict(zip(CLASS_LABELS, probability_rows[i]))),
+                correction_stage.rule_names[applied_rules[i]] if applied_rules[i] >= 0 else None
+            )
+            for i in range(len(features))
+        ]
+        placeholders = ", ".join("?" * (len(SCALER_FEATURES) + 8))
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO predictions (created_at, source, model_version, {', '.join(SCALER_FEATURES)}, "
+                    f"model_class, predicted_class, confidence, probabilities, correction) VALUES ({placeholders})",
+                    rows
+                )
+            self.stats['logged'] += len(rows)
+            self.stats['batches'] += 1
+        except sqlite3.Error as e:
+            self.stats['errors'] += 1
+            print(f"❌ Prediction log write failed ({len(rows)} rows): {e}")
+
+    def close(self, timeout=5.0):
+        """Flush everything queued so far and stop the writer"""
+        if self._pid == os.getpid() and self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout)
+
+    def query(self, start=None, end=None, limit=1000):
+        """Read back predictions with start <= created_at < end (datetime, ISO string or epoch)"""
+        def to_epoch(value, default):
+            if value is None:
+                return default
+            if isinstance(value, datetime):
+                return value.timestamp()
+            if isinstance(value, str):
+                try:
+                    return float(value)
+                except ValueError:
+                    return datetime.fromisoformat(value).timestamp()
+            return float(value)
+
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(
+                "SELECT * FROM predictions WHERE created_at >= ? AND created_at < ? "
+                "ORDER BY created_at LIMIT ?",
+                (to_epoch(start, 0.0), to_epoch(end, float('inf')), int(limit))
+            ).fetchall()
+        finally:
+            conn.close()
+        results = []
+        for row in rows:
+            record = dict(row)
+            record['probabilities'] = json.loads(record['probabilities'])
+            results.append(record)
+        return results
+
+prediction_log = PredictionAuditLog(
+    PREDICTION_LOG_PATH,
+    batch_size=PREDICTION_LOG_BATCH_SIZE,
+    flush_interval=PREDICTION_LOG_FLUSH_INTERVAL,
+    queue_size=PREDICTION_LOG_QUEUE_SIZE,
+    synchronous=PREDICTION_LOG_SYNC,
+    enabled=PREDICTION_LOG_ENABLED
+)
+atexit.register(prediction_log.close)
+
+# ==================== ADMISSION CONTROL ====================
+# Token buckets per (client, route) plus a per-process cap on concurrent model work.
+# Overload is answered immediately with 429/503 + Retry-After instead of queueing.
+# Override limits with RATE_LIMITS_PATH=limits.json ({"/route": {"rate": ..., "burst": ...}}).
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', 50000))
+# Only behind a known proxy: X-Forwarded-For is client-controlled except for the hops our proxies append
+RATE_LIMIT_TRUST_PROXY = os.environ.get('RATE_LIMIT_TRUST_PROXY', 'false').lower() in ('1', 'true', 'yes')
+RATE_LIMIT_PROXY_HOPS = max(1, int(os.environ.get('RATE_LIMIT_PROXY_HOPS', 1)))  # trusted proxies in front of the app
+INFERENCE_MAX_CONCURRENCY = int(os.environ.get('INFERENCE_MAX_CONCURRENCY', 4))
+INFERENCE_ADMISSION_TIMEOUT = float(os.environ.get('INFERENCE_ADMISSION_TIMEOUT', 0.05))
+
+# rate = tokens refilled per second, burst = bucket size; 'inference' routes also need
+# a model slot. Routes not listed here (health, static chat options, help categories)
+# are never limited or shed.
+DEFAULT_RATE_LIMITS = {
+    '/app': {'rate': 0.5, 'burst': 10, 'inference': True, 'methods': ['POST']},
+    '/get_suggestions': {'rate': 0.5, 'burst': 10, 'inference': True},
+    '/explain': {'rate': 0.5, 'burst': 5, 'inference': True},
+    '/what_if': {'rate': 0.2, 'burst': 3, 'inference': True},
+    '/predict_batch': {'rate': 0.1, 'burst': 2, 'inference': True},
+    '/generate_pdf_report': {'rate': 0.2, 'burst': 5, 'inference': True},
+    '/reports/bulk': {'rate': 0.05, 'burst': 2, 'inference': True},
+    '/chat/send_message': {'rate': 2.0, 'burst': 20},
+    '/search_help': {'rate': 2.0, 'burst': 20},
+    '/get_quick_suggestions': {'rate': 1.0, 'burst': 10},
+    '/get_topic_suggestions': {'rate': 1.0, 'burst': 10},
+}
+
+def load_rate_limits(path=None):
+    """Load per-route limits from a JSON file, falling back to DEFAULT_RATE_LIMITS"""
+    path = path or os.environ.get('RATE_LIMITS_PATH')
+    if not path:
+        return DEFAULT_RATE_LIMITS
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+class AdmissionController:
+    """Per-process load shedding: token buckets per client/route and an inference slot cap
+
+    Buckets live in a bounded LRU OrderedDict keyed by (client, route), so memory stays
+    flat however many clients arrive. Each gunicorn worker enforces its own limits.
+    """
+    def __init__(self, limits, max_concurrency, admission_timeout, max_clients=50000):
+        self.limits = {
+            route: dict(spec, methods=frozenset(m.upper() for m in spec['methods']) if spec.get('methods') else None)
+            for route, spec in limits.items()
+        }
+        self.max_concurrency = max_concurrency
+        self.admission_timeout = admission_timeout
+        self.max_clients = max_clients
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.counters = {route: {'admitted': 0, 'rate_limited': 0, 'overloaded': 0} for route in self.limits}
+        self.counters['priority'] = {'admitted': 0}
+
+    def _take_token(self, key, rate, burst, now):
+        """Spend one token; returns 0 on success or the seconds until one is available"""
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def admit(self, client, route, method):
+        """(status, retry_after, holds_slot): status 200 admits the request"""
+        spec = self.limits.get(route)
+        if spec is None or (spec['methods'] and method not in spec['methods']):
+            with self._lock:
+                self.counters['priority']['admitted'] += 1
+            return 200, 0, False
+
+        counters = self.counters[route]
+        with self._lock:
+            wait = self._take_token((client, route), spec['rate'], spec['burst'], time.monotonic())
+            if wait:
+                counters['rate_limited'] += 1
+                return 429, int(wait) + 1, False
+
+        holds_slot = False
+        if spec.get('inference'):
+            if not self._slots.acquire(timeout=self.admission_timeout):
+                with self._lock:
+                    counters['overloaded'] += 1
+                return 503, 1, False
+            holds_slot = True
+
+        with self._lock:
+            counters['admitted'] += 1
+            if holds_slot:
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return 200, 0, holds_slot
+
+    def release(self):
+        """Return an inference slot taken by admit()"""
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'enabled': RATE_LIMIT_ENABLED,
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'tracked_buckets': len(self._buckets),
+                'routes': {route: dict(counts) for route, counts in self.counters.items()}
+            }
+
+admission_controller = AdmissionController(
+    load_rate_limits(),
+    INFERENCE_MAX_CONCURRENCY,
+    INFERENCE_ADMISSION_TIMEOUT,
+    RATE_LIMIT_MAX_CLIENTS
+)
+
+def client_address():
+    """Client IP: with RATE_LIMIT_TRUST_PROXY, the X-Forwarded-For entry our outermost proxy appended
+
+    Each of the RATE_LIMIT_PROXY_HOPS trusted proxies appends one entry on the right;
+    anything further left was sent by the client and could be anything.
+    """
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+        if len(forwarded) >= RATE_LIMIT_PROXY_HOPS:
+            return forwarded[-RATE_LIMIT_PROXY_HOPS]
+    return request.remote_addr or 'unknown'
+
+@app.before_request
+def admission_check():
+    if not RATE_LIMIT_ENABLED:
+        return None
+    status, retry_after, holds_slot = admission_controller.admit(client_address(), request.path, request.method)
+    if status != 200:
+        message = ('Too many requests, please slow down.' if status == 429
+                   else 'Server is busy, please try again shortly.')
+        response = jsonify({'success': False, 'status': 'error', 'message': message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+    g.holds_inference_slot = holds_slot
+    return None
+
+@app.teardown_request
+def admission_release(exc=None):
+    if g.pop('holds_inference_slot', False):
+        admission_controller.release()
+
+@app.route('/admission_stats', methods=['GET'])
+def admission_stats():
+    """Admitted / rate-limited / overloaded counts per route and current model concurrency"""
+    return jsonify(dict(success=True, **admission_controller.snapshot()))
+
+# ==================== PROFILING ====================
+# Admin endpoints (/admin/...) need the X-Admin-Token header to match ADMIN_TOKEN; they are
+# disabled entirely while ADMIN_TOKEN is unset.
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', 5))
+PROFILER_MAX_SECONDS = float(os.environ.get('PROFILER_MAX_SECONDS', 300))
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 1000))  # 0 disables capture
+SLOW_REQUEST_SAMPLE_MS = float(os.environ.get('SLOW_REQUEST_SAMPLE_MS', 10))
+SLOW_REQUEST_KEEP = int(os.environ.get('SLOW_REQUEST_KEEP', 20))
+
+def is_admin_request():
+    """Whether the current request carries the configured admin token"""
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def admin_required(view):
+    """Reject the request unless it carries the configured admin token"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin_request():
+            return jsonify({'success': False, 'message': 'Admin token required'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@contextlib.contextmanager
+def request_stage(name):
+    """Time a named stage of the current request (reported with slow-request captures)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            g.setdefault('stage_timings', []).append((name, (time.perf_counter() - start) * 1000))
 
+class SamplingProfiler:
+    """Statistical profiler: one background thread samples Python stacks via sys._current_frames()
+
+    Stacks are folded into flamegraph "collapsed" lines (root;...;leaf count). Two things
+    are sampled: an on-demand window (every thread, or a random fraction of requests, for
+    N seconds) and every in-flight request, whose samples are kept only if the request
+    ends up slower than the slow threshold. The thread sleeps while there is nothing to
+    sample, so the idle cost is zero.
+    """
+    def __init__(self, interval_ms=5, slow_threshold_ms=1000, slow_sample_ms=10, keep=20,
+                 max_depth=64, max_stacks=20000):
+        self.interval = interval_ms / 1000
+        self.slow_threshold = slow_threshold_ms / 1000
+        self.slow_interval = slow_sample_ms / 1000
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.slow_requests = collections.deque(maxlen=keep)
+        self.stats = {'samples': 0, 'sampling_seconds': 0.0, 'slow_captured': 0}
+        self._requests = {}    # thread id -> in-flight request record
+        self._window = None
+        self._labels = {}      # code object -> frame label
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def start_window(self, seconds, fraction=None, interval_ms=None):
+        """Profile all threads (fraction None) or that fraction of requests for `seconds`"""
+        seconds = min(float(seconds), PROFILER_MAX_SECONDS)
+        with self._lock:
+            self._window = {
+                'started_at': time.time(),
+                'until': time.monotonic() + seconds,
+                'seconds': seconds,
+                'fraction': fraction,
+                'interval': (interval_ms / 1000) if interval_ms else self.interval,
+                'samples': 0,
+                'stacks': collections.Counter()
+            }
+        self._ensure_thread()
+        self._active.set()
+        return self.window_info()
+
+    def window_info(self):
+        window = self._window
+        if window is None:
+            return None
+        return {
+            'started_at': window['started_at'],
+            'seconds': window['seconds'],
+            'fraction': window['fraction'],
+            'interval_ms': window['interval'] * 1000,
+            'running': time.monotonic() < window['until'],
+            'samples': window['samples'],
+            'distinct_stacks': len(window['stacks'])
+        }
+
+    def collapsed(self, stacks=None):
+        """Flamegraph collapsed-stack text (for flamegraph.pl, speedscope, inferno)"""
+        if stacks is None:
+            stacks = self._window['stacks'] if self._window else {}
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in sorted(stacks.items())]
+        return '\n'.join(lines) + '\n'
+
+    def begin_request(self, method, path):
+        """Register the calling request thread; returns its record (or None when not sampling)"""
+        window = self._window
+        in_window = (
+            window is not None and window['fraction'] is not None and time.monotonic() < window['until']
+            and thread_rng().random() < window['fraction']
+        )
+        if not self.slow_threshold and not in_window:
+            return None
+        self._ensure_thread()
+        record = {
+            'method': method,
+            'path': path,
+            'started_at': time.time(),
+            'start': time.perf_counter(),
+            'in_window': in_window,
+            'samples': 0,
+            'stacks': collections.Counter()
+        }
+        with self._lock:
+            self._requests[threading.get_ident()] = record
+        self._active.set()
+        return record
+
+    def end_request(self, record, status, stages):
+        """Unregister the request; keep its profile if it was slower than the threshold"""
+        with self._lock:
+            self._requests.pop(threading.get_ident(), None)
+        duration = time.perf_counter() - record['start']
+        if not self.slow_threshold or duration < self.slow_threshold:
+            return
+        self.stats['slow_captured'] += 1
+        self.slow_requests.append({
+            'id': uuid.uuid4().hex[:12],
+            'method': record['method'],
+            'path': record['path'],
+            'status': status,
+            'started_at': record['started_at'],
+            'duration_ms': duration * 1000,
+            'stages': [{'stage': name, 'ms': ms} for name, ms in stages],
+            'samples': record['samples'],
+            'stacks': record['stacks']
+        })
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _fold(self, frame):
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return ';'.join(reversed(labels))
+
+    def _add(self, stacks, stack):
+        if stack in stacks or len(stacks) < self.max_stacks:
+            stacks[stack] += 1
+        else:
+            stacks['[truncated]'] += 1
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            window = self._window
+            window_all = window is not None and window['fraction'] is None and time.monotonic() < window['until']
+            window_live = window is not None and time.monotonic() < window['until']
+            if not window_all and not self._requests:
+                self._active.clear()
+                self._active.wait(1.0)
+                continue
+            interval = window['interval'] if window_live else self.slow_interval
+            time.sleep(interval)
+
+            started = time.perf_counter()
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, record in self._requests.items():
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = self._fold(frame)
+                    record['samples'] += 1
+                    self._add(record['stacks'], stack)
+                    if record['in_window'] and window_live and not window_all:
+                        window['samples'] += 1
+                        self._add(window['stacks'], stack)
+                if window_all:
+                    for thread_id, frame in frames.items():
+                        if thread_id != own_id:
+                            window['samples'] += 1
+                            self._add(window['stacks'], self._fold(frame))
+            del frames
+            self.stats['samples'] += 1
+            self.stats['sampling_seconds'] += time.perf_counter() - started
+
+profiler = SamplingProfiler(
+    PROFILER_INTERVAL_MS,
+    SLOW_REQUEST_THRESHOLD_MS,
+    SLOW_REQUEST_SAMPLE_MS,
+    SLOW_REQUEST_KEEP
+)
+
+@app.before_request
+def profiler_begin():
+    g.profile_record = profiler.begin_request(request.method, request.path)
+
+@app.after_request
+def profiler_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def profiler_end(exc=None):
+    record = g.pop('profile_record', None)
+    if record is not None:
+        profiler.end_request(record, g.pop('response_status', 500), g.pop('stage_timings', []))
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+@admin_required
+def admin_profiler():
+    """POST {seconds, fraction?, interval_ms?} starts a window; GET returns its collapsed stacks"""
     if request.method == 'POST':
+        payload = request.get_json(silent=True) or {}
+        fraction = payload.get('fraction')
+        info = profiler.start_window(
+            payload.get('seconds', 10),
+            float(fraction) if fraction is not None else None,
+            payload.get('interval_ms')
+        )
+        return jsonify({'success': True, 'window': info})
+    if request.args.get('format') == 'json':
+        return jsonify({'success': True, 'window': profiler.window_info(), 'stats': profiler.stats})
+    return app.response_class(profiler.collapsed(), mimetype='text/plain')
+
+@app.route('/admin/slow_requests', methods=['GET'])
+@admin_required
+def admin_slow_requests():
+    """Most recent requests slower than SLOW_REQUEST_THRESHOLD_MS with their stage timings"""
+    return jsonify({
+        'success': True,
+        'threshold_ms': SLOW_REQUEST_THRESHOLD_MS,
+        'requests': [
+            {key: value for key, value in entry.items() if key != 'stacks'}
+            for entry in reversed(profiler.slow_requests)
+        ]
+    })
+
+@app.route('/admin/slow_requests/<capture_id>', methods=['GET'])
+@admin_required
+def admin_slow_request_stacks(capture_id):
+    """Collapsed stacks sampled while one slow request was running"""
+    for entry in profiler.slow_requests:
+        if entry['id'] == capture_id:
+            return app.response_class(profiler.collapsed(entry['stacks']), mimetype='text/plain')
+    return jsonify({'success': False, 'message': 'Unknown capture'}), 404
+
+# ==================== MEMORY DIAGNOSTICS ====================
+MEMORY_SAMPLE_INTERVAL = float(os.environ.get('MEMORY_SAMPLE_INTERVAL', 60))
+MEMORY_SERIES_LENGTH = int(os.environ.get('MEMORY_SERIES_LENGTH', 1440))   # 24h of 1-minute samples
+MEMORY_TRACEMALLOC = os.environ.get('MEMORY_TRACEMALLOC', 'false').lower() in ('1', 'true', 'yes')
+MEMORY_TRACEMALLOC_FRAMES = int(os.environ.get('MEMORY_TRACEMALLOC_FRAMES', 1))
+MEMORY_TOP_N = int(os.environ.get('MEMORY_TOP_N', 20))
+# Gracefully restart a gunicorn worker whose RSS exceeds this many MB (0 = never)
+WORKER_RSS_BUDGET_MB = float(os.environ.get('WORKER_RSS_BUDGET_MB', 0))
+# ...but only after it has served this long, so a budget below the startup RSS cannot restart-loop
+WORKER_RECYCLE_MIN_UPTIME = float(os.environ.get('WORKER_RECYCLE_MIN_UPTIME', 600))
+
+def process_rss_bytes():
+    """Current resident set size (Linux /proc, falling back to peak RSS from getrusage)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+class MemoryDiagnostics:
+    """RSS/tracemalloc time series, allocation-site diffs and per-route allocation deltas
+
+    A background thread samples every MEMORY_SAMPLE_INTERVAL seconds. With tracemalloc on
+    it also snapshots allocation sites and diffs them against the first snapshot, which
+    is where a slow leak shows up as steadily growing lines. Per-route deltas are the
+    traced-memory change across each request; with concurrent requests they include
+    other threads' allocations, so read them as trends rather than exact attribution.
+    """
+    def __init__(self, interval=60, series_length=1440, top_n=20, rss_budget_mb=0, min_uptime=600):
+        self.interval = interval
+        self.top_n = top_n
+        self.rss_budget = rss_budget_mb * 2**20
+        self.min_uptime = min_uptime
+        self.recycle_allowed = False
+        self.series = collections.deque(maxlen=series_length)
+        self.routes = {}   # route rule -> [requests, net bytes, max bytes]
+        self.baseline = None
+        self.latest = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.series.clear()
+            self._thread = threading.Thread(target=self._run, name='memory-diagnostics', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def set_tracing(self, enabled, frames=1):
+        """Start/stop tracemalloc; starting resets the baseline snapshot"""
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self.baseline = self.latest = None
+            self.routes.clear()
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self.baseline = self.latest = None
+
+    def take_snapshot(self):
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+        with self._lock:
+            if self.baseline is None:
+                self.baseline = snapshot
+            self.latest = snapshot
+        return snapshot
+
+    def sample(self):
+        """Append one point to the time series (and snapshot if tracing)"""
+        point = {'time': time.time(), 'rss_mb': process_rss_bytes() / 2**20, 'gc_counts': gc.get_count()}
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            point['traced_mb'] = current / 2**20
+            point['traced_peak_mb'] = peak / 2**20
+            self.take_snapshot()
+        self.series.append(point)
+        return point
+
+    def _run(self):
+        started = time.monotonic()
+        while True:
+            point = self.sample()
+            if self.rss_budget and point['rss_mb'] * 2**20 > self.rss_budget \
+                    and time.monotonic() - started >= self.min_uptime:
+                self._recycle(point['rss_mb'])
+            time.sleep(self.interval)
+
+    def _recycle(self, rss_mb):
+        if not self.recycle_allowed:
+            print(f"⚠️ Worker {os.getpid()} RSS {rss_mb:.0f} MB exceeds budget {self.rss_budget / 2**20:.0f} MB")
+            return
+        print(f"♻️ Worker {os.getpid()} RSS {rss_mb:.0f} MB exceeds budget, restarting gracefully")
+        # gunicorn treats SIGTERM as "finish in-flight requests, then exit" and forks a replacement
+        os.kill(os.getpid(), signal.SIGTERM)
+        self.rss_budget = 0
+
+    def request_started(self):
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+
+    def request_finished(self, route, started_bytes):
+        if started_bytes is None or not tracemalloc.is_tracing():
+            return
+        delta = tracemalloc.get_traced_memory()[0] - started_bytes
+        with self._lock:
+            stats = self.routes.setdefault(route, [0, 0, 0])
+            stats[0] += 1
+            stats[1] += delta
+            stats[2] = max(stats[2], delta)
+
+    def top_allocations(self, key_type='lineno'):
+        """Allocation sites that grew most since the baseline snapshot"""
+        with self._lock:
+            baseline, latest = self.baseline, self.latest
+        if latest is None:
+            return []
+        return [
+            {
+                'site': ' <- '.join(f"{frame.filename}:{frame.lineno}" for frame in stat.traceback),
+                'size_kb': stat.size / 1024,
+                'size_diff_kb': stat.size_diff / 1024,
+                'count': stat.count,
+                'count_diff': stat.count_diff
+            }
+            for stat in latest.compare_to(baseline, key_type)[:self.top_n]
+        ]
+
+    def report(self):
+        with self._lock:
+            routes = {
+                route: {'requests': n, 'mean_delta_kb': total / n / 1024, 'max_delta_kb': worst / 1024}
+                for route, (n, total, worst) in self.routes.items()
+            }
+        return {
+            'pid': os.getpid(),
+            'rss_mb': process_rss_bytes() / 2**20,
+            'rss_budget_mb': self.rss_budget / 2**20,
+            'recycle_allowed': self.recycle_allowed,
+            'tracemalloc': tracemalloc.is_tracing(),
+            'top_allocations': self.top_allocations(),
+            'routes': routes,
+            'model': model_memory_info(),
+            'series': list(self.series)
+        }
+
+def model_memory_info():
+    """What the inference backend can report about its own caches and memory"""
+    info = {'backend': INFERENCE_BACKEND}
+    if hasattr(dnn_model, 'memory_info'):
+        info.update(dnn_model.memory_info())
+    return info
+
+memory_diagnostics = MemoryDiagnostics(
+    MEMORY_SAMPLE_INTERVAL,
+    MEMORY_SERIES_LENGTH,
+    MEMORY_TOP_N,
+    WORKER_RSS_BUDGET_MB,
+    WORKER_RECYCLE_MIN_UPTIME
+)
+if MEMORY_TRACEMALLOC:
+    memory_diagnostics.set_tracing(True, MEMORY_TRACEMALLOC_FRAMES)
+
+@app.before_request
+def memory_begin():
+    memory_diagnostics.ensure_started()
+    g.memory_start = memory_diagnostics.request_started()
+
+@app.teardown_request
+def memory_end(exc=None):
+    started = g.pop('memory_start', None)
+    if started is not None:
+        rule = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        memory_diagnostics.request_finished(rule, started)
+
+@app.route('/admin/memory', methods=['GET', 'POST'])
+@admin_required
+def admin_memory():
+    """GET: RSS/traced time series, top growing allocation sites, per-route deltas, model caches
+
+    POST {tracemalloc: true|false, frames?, snapshot?: true} toggles tracing or snapshots now.
+    """
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or {}
+        if 'tracemalloc' in payload:
+            memory_diagnostics.set_tracing(bool(payload['tracemalloc']), int(payload.get('frames', MEMORY_TRACEMALLOC_FRAMES)))
+        if payload.get('snapshot'):
+            memory_diagnostics.sample()
+    return jsonify(dict(success=True, **memory_diagnostics.report()))
+
+# ==================== SHADOW EVALUATION ====================
+# SHADOW_MODEL_PATH=candidate.keras (or .onnx) copies SHADOW_FRACTION of /app rows onto a
+# bounded queue; a background thread scores them with the candidate and compares. Rows
+# are dropped (and counted) when the queue is full, so the request path never waits.
+SHADOW_MODEL_PATH = os.environ.get('SHADOW_MODEL_PATH', '')
+SHADOW_SCALER_PATH = os.environ.get('SHADOW_SCALER_PATH', 'student_performance_dnn/production_model/scaler.pkl')
+SHADOW_FRACTION = float(os.environ.get('SHADOW_FRACTION', 0.1))
+SHADOW_QUEUE_SIZE = int(os.environ.get('SHADOW_QUEUE_SIZE', 1000))
+SHADOW_BATCH_SIZE = int(os.environ.get('SHADOW_BATCH_SIZE', 64))
+SHADOW_FLUSH_INTERVAL = float(os.environ.get('SHADOW_FLUSH_INTERVAL', 1.0))
+SHADOW_KEEP_DISAGREEMENTS = int(os.environ.get('SHADOW_KEEP_DISAGREEMENTS', 50))
+
+class ShadowEvaluator:
+    """Scores a sampled copy of live traffic with a candidate model, off the request path
+
+    Per process it accumulates agreement with the primary (after correction rules and on
+    the raw argmax), a primary x candidate class transition matrix, probability drift,
+    latency for both models and the most recent disagreeing rows.
+    """
+    def __init__(self, model_path, scaler_path, class_labels, fraction=0.1, queue_size=1000,
+                 batch_size=64, flush_interval=1.0, keep_disagreements=50):
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self.class_labels = list(class_labels)
+        self.enabled = bool(model_path) and fraction > 0
+        self.fraction = fraction
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.keep_disagreements = keep_disagreements
+        self.error = None
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker = None
+        self._pid = None
+        self.reset()
+
+    def reset(self):
+        n_classes = len(self.class_labels)
+        with self._lock:
+            self.counts = {'offered': 0, 'dropped': 0, 'scored': 0, 'batches': 0,
+                           'agree_final': 0, 'agree_model': 0}
+            self.transitions = np.zeros((n_classes, n_classes), dtype=np.int64)
+            self.probability_l1 = 0.0
+            self.primary_ms = collections.deque(maxlen=5000)
+            self.candidate_ms = collections.deque(maxlen=5000)
+            self.disagreements = collections.deque(maxlen=self.keep_disagreements)
+            self.started_at = time.time()
+
+    def _ensure_worker(self):
+        """Start the scoring thread lazily, and again in each forked worker process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._worker = threading.Thread(target=self._run, name='shadow-evaluator', daemon=True)
+            self._pid = os.getpid()
+            self._worker.start()
+
+    def start(self):
+        """Load the candidate now rather than on the first sampled request"""
+        if self.enabled:
+            self._ensure_worker()
+
+    def offer(self, input_data, prediction_probs, final_classes, primary_ms):
+        """Maybe enqueue one scored request; never blocks"""
+        if not self.enabled or thread_rng().random() >= self.fraction:
+            return
+        self._ensure_worker()
+        self.counts['offered'] += 1
         try:
-            # --- Collect ALL 8 features from form ---
-            total_cgpa = float(request.form['total_cgpa'])
-            prevsem_cgpa = float(request.form['prevsem_cgpa'])
-            attendance = float(request.form['attendance'])
-            
-            # Validate ranges
-            if not (0 <= total_cgpa <= 10):
-                raise ValueError("Total CGPA must be between 0 and 10")
-            if not (0 <= prevsem_cgpa <= 10):
-                raise ValueError("Previous Semester CGPA must be between 0 and 10")
-            if not (0 <= attendance <= 100):
-                raise ValueError("Attendance must be between 0% and 100%")
-
-            # Study hours mapping
-            study_hours_map = {
-                "0-10 (Minimal)": 5,
-                "11-20 (Moderate)": 15,
-                "21-30 (Regular)": 25,
-                "31+ (Intensive)": 35
+            self._queue.put_nowait((input_data, prediction_probs, final_classes, primary_ms / len(input_data)))
+        except queue.Full:
+            self.counts['dropped'] += 1
+
+    def _load_candidate(self):
+        if self.model_path.endswith('.onnx'):
+            model = OnnxInferenceBackend(self.model_path, ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS)
+        else:
+            model = KerasInferenceBackend(load_model(self.model_path))
+        if model.output_shape[1] != len(self.class_labels):
+            raise ValueError(f"Candidate predicts {model.output_shape[1]} classes, expected {len(self.class_labels)}")
+        candidate_scaler = None if getattr(model, 'includes_scaler', False) else joblib.load(self.scaler_path)
+        model.predict(np.zeros((1, len(SCALER_FEATURES)), dtype=np.float32))  # warm up before live rows arrive
+        return model, candidate_scaler
+
+    def _run(self):
+        try:
+            model, candidate_scaler = self._load_candidate()
+        except Exception as e:
+            self.error = f"Could not load candidate {self.model_path}: {e}"
+            self.enabled = False
+            print(f"❌ {self.error}")
+            return
+        pending_queue = self._queue
+        while True:
+            item = pending_queue.get()
+            # Wait up to flush_interval for a full batch: one predict call per batch
+            # costs far less CPU than one per sampled request
+            batch, n_rows = [item], len(item[0])
+            deadline = time.monotonic() + self.flush_interval
+            while n_rows < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = pending_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n_rows += len(item[0])
+            try:
+                self._score(model, candidate_scaler, batch)
+            except Exception as e:
+                self.error = f"Shadow scoring failed: {e}"
+
+    def _score(self, model, candidate_scaler, batch):
+        input_data = np.concatenate([entry[0] for entry in batch])
+        primary_probs = np.concatenate([entry[1] for entry in batch])
+        primary_final = np.concatenate([entry[2] for entry in batch])
+        primary_ms = np.repeat([entry[3] for entry in batch], [len(entry[0]) for entry in batch])
+
+        started = time.perf_counter()
+        model_input = input_data if candidate_scaler is None else candidate_scaler.transform(input_data)
+        candidate_probs = model.predict(model_input, batch_size=len(input_data))
+        candidate_ms = (time.perf_counter() - started) * 1000 / len(input_data)
+        candidate_final, _ = correction_stage.apply(candidate_probs, input_data)
+
+        agree_final = primary_final == candidate_final
+        with self._lock:
+            self.counts['scored'] += len(input_data)
+            self.counts['batches'] += 1
+            self.counts['agree_final'] += int(agree_final.sum())
+            self.counts['agree_model'] += int((primary_probs.argmax(axis=1) == candidate_probs.argmax(axis=1)).sum())
+            np.add.at(self.transitions, (primary_final, candidate_final), 1)
+            self.probability_l1 += float(np.abs(primary_probs - candidate_probs).sum())
+            self.primary_ms.extend(primary_ms.tolist())
+            self.candidate_ms.extend([candidate_ms] * len(input_data))
+            for row in np.flatnonzero(~agree_final):
+                self.disagreements.append({
+                    'features': dict(zip(SCALER_FEATURES, input_data[row].tolist())),
+                    'primary': self.class_labels[primary_final[row]],
+                    'candidate': self.class_labels[candidate_final[row]],
+                    'primary_probabilities': primary_probs[row].round(4).tolist(),
+                    'candidate_probabilities': candidate_probs[row].round(4).tolist()
+                })
+
+    def report(self):
+        def percentiles(values):
+            if not values:
+                return None
+            p50, p95, p99 = np.percentile(np.fromiter(values, dtype=np.float64), [50, 95, 99])
+            return {'p50': p50, 'p95': p95, 'p99': p99}
+
+        with self._lock:
+            scored = self.counts['scored']
+            return {
+                'enabled': self.enabled,
+                'candidate': self.model_path or None,
+                'fraction': self.fraction,
+                'error': self.error,
+                'since': self.started_at,
+                'counts': dict(self.counts),
+                'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+                'agreement': self.counts['agree_final'] / scored if scored else None,
+                'model_agreement': self.counts['agree_model'] / scored if scored else None,
+                'mean_probability_l1': self.probability_l1 / scored if scored else None,
+                'labels': self.class_labels,
+                'transitions': {
+                    primary: dict(zip(self.class_labels, row))
+                    for primary, row in zip(self.class_labels, self.transitions.tolist())
+                },
+                'latency_ms_per_row': {
+                    'primary': percentiles(self.primary_ms),
+                    'candidate': percentiles(self.candidate_ms)
+                },
+                'recent_disagreements': list(self.disagreements)
+            }
+
+shadow_evaluator = ShadowEvaluator(
+    SHADOW_MODEL_PATH,
+    SHADOW_SCALER_PATH,
+    CLASS_LABELS,
+    fraction=SHADOW_FRACTION,
+    queue_size=SHADOW_QUEUE_SIZE,
+    batch_size=SHADOW_BATCH_SIZE,
+    flush_interval=SHADOW_FLUSH_INTERVAL,
+    keep_disagreements=SHADOW_KEEP_DISAGREEMENTS
+)
+
+@app.route('/admin/shadow', methods=['GET', 'POST'])
+@admin_required
+def admin_shadow():
+    """Candidate-vs-primary agreement, transition matrix and latency; POST {reset: true} clears"""
+    if request.method == 'POST' and (request.get_json(silent=True) or {}).get('reset'):
+        shadow_evaluator.reset()
+    return jsonify(dict(success=True, **shadow_evaluator.report()))
+
+# ==================== COHORT DASHBOARD STATS ====================
+COHORT_STATS_DIR = os.environ.get('COHORT_STATS_DIR', 'logs/cohort_stats')
+COHORT_STATS_WINDOW_SECONDS = int(os.environ.get('COHORT_STATS_WINDOW_SECONDS', 300))
+COHORT_STATS_WINDOWS = int(os.environ.get('COHORT_STATS_WINDOWS', 288))  # 24h of 5-minute windows
+
+class WindowedCounterTable:
+    """Per-window int64 counter vectors, mergeable across worker processes
+
+    Each process claims one memory-mapped table in stats_dir: a ring of n_windows rows
+    (column 0 holds the window number) plus an all-time row. add() is O(1) and merged()
+    sums the tables, so reads never depend on how much has been counted.
+
+    Tables are slot files (slot-<k>.bin), each held with an exclusive flock for the life
+    of its process and reopened in place: a worker recycled by max_requests or the RSS
+    limit takes over a free slot and keeps its counts, so stats_dir never holds more
+    files than processes that ran at the same time.
+    """
+    MAX_SLOTS = 1024
+
+    def __init__(self, n_counters, stats_dir=None, window_seconds=300, n_windows=288):
+        self.n_counters = n_counters
+        self.stats_dir = stats_dir
+        self.window_seconds = window_seconds
+        self.n_windows = n_windows
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._table = None
+        self._pid = None
+        self._fd = None
+        self.shape = (n_windows + 1, 1 + n_counters)
+        self.nbytes = self.shape[0] * self.shape[1] * 8
+
+    def _own_table(self):
+        """This process's table, claimed on first use (after any fork)"""
+        if self._pid == os.getpid():
+            return self._table
+        if self._fd is not None:
+            os.close(self._fd)  # inherited from the parent, whose lock it keeps
+            self._fd = None
+        table = self._claim_slot() if self.stats_dir and fcntl is not None else None
+        if table is None:
+            table = np.zeros(self.shape, dtype=np.int64)
+            table[:self.n_windows, 0] = -1
+        self._table = table
+        self._pid = os.getpid()
+        return self._table
+
+    def _claim_slot(self):
+        """Lock the first free slot file and map it read-write, keeping any counts it holds"""
+        os.makedirs(self.stats_dir, exist_ok=True)
+        for slot in range(self.MAX_SLOTS):
+            path = os.path.join(self.stats_dir, f"slot-{slot}.bin")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            fresh = os.fstat(fd).st_size != self.nbytes
+            if fresh:  # new slot, or left by a different counter layout
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.nbytes)
+            self._fd = fd
+            self._mmap = np.memmap(path, dtype=np.int64, mode='r+', shape=self.shape)
+            # Plain ndarray view over the mapping: same pages, without memmap's per-slice overhead
+            table = np.frombuffer(self._mmap, dtype=np.int64).reshape(self.shape)
+            if fresh:
+                table[:self.n_windows, 0] = -1
+            return table
+        print(f"⚠️ No free counter slot in {self.stats_dir}; counting in memory for this process")
+        return None
+
+    def add(self, increments):
+        """Add a counter vector to the current window and the all-time row"""
+        window = int(time.time() // self.window_seconds)
+        slot = window % self.n_windows
+        with self._lock:
+            table = self._own_table()
+            if table[slot, 0] != window:
+                table[slot] = 0
+                table[slot, 0] = window
+            table[slot, 1:] += increments
+            table[self.n_windows, 1:] += increments
+
+    def _tables(self):
+        """Every slot's table, live or left by a finished worker (just our own without a stats directory)"""
+        with self._lock:
+            own = self._own_table()
+        if self._fd is None:
+            return [own]
+        tables = []
+        for filename in os.listdir(self.stats_dir):
+            path = os.path.join(self.stats_dir, filename)
+            if filename.startswith('slot-') and filename.endswith('.bin') and os.path.getsize(path) == self.nbytes:
+                tables.append(np.memmap(path, dtype=np.int64, mode='r', shape=self.shape))
+        return tables
+
+    def merged(self, recent_windows):
+        """(all-time counters, (recent_windows, n) per-window counters, oldest window, tables merged)"""
+        current_window = int(time.time() // self.window_seconds)
+        recent_windows = max(1, min(int(recent_windows), self.n_windows))
+        oldest_window = current_window - recent_windows + 1
+
+        tables = self._tables()
+        all_time = np.zeros(self.n_counters, dtype=np.int64)
+        recent = np.zeros((recent_windows, self.n_counters), dtype=np.int64)
+        for table in tables:
+            all_time += table[self.n_windows, 1:]
+            windows = table[:self.n_windows, 0]
+            live = (windows >= oldest_window) & (windows <= current_window)
+            np.add.at(recent, windows[live] - oldest_window, table[:self.n_windows][live, 1:])
+        return all_time, recent, oldest_window, len(tables)
+
+class CohortStats:
+    """Incremental prediction counters per time window, mergeable across worker processes
+
+    Band and class counts go into a WindowedCounterTable in COHORT_STATS_DIR (one
+    memory-mapped ring of COHORT_STATS_WINDOWS windows per worker slot); /stats sums them.
+    """
+    def __init__(self, patterns, class_labels, stats_dir=None, window_seconds=300, n_windows=288):
+        self.window_seconds = window_seconds
+        self.dimensions = self._build_dimensions(patterns, class_labels)
+        self.n_counters = sum(len(labels) for _, labels, _ in self.dimensions.values())
+        self._band_columns = [
+            (name, SCALER_FEATURES.index(feature))
+            for name, feature in (('cgpa_band', 'total_cgpa'), ('attendance_band', 'attendance'), ('backlogs', 'backlogs'))
+        ]
+        self.table = WindowedCounterTable(self.n_counters, stats_dir, window_seconds, n_windows)
+
+    def _build_dimensions(self, patterns, class_labels):
+        """name -> (column offset, band labels, band lower bounds for searchsorted)"""
+        def bands(pattern):
+            ordered = sorted(pattern.items(), key=lambda item: item[1][0])
+            return [label for label, _ in ordered], np.array([low for _, (low, _) in ordered])
+
+        cgpa_labels, cgpa_bounds = bands(patterns['cgpa_patterns'])
+        attendance_labels, attendance_bounds = bands(patterns['attendance_patterns'])
+        specs = [
+            ('predicted_class', list(class_labels), None),
+            ('cgpa_band', cgpa_labels, cgpa_bounds),
+            ('attendance_band', attendance_labels, attendance_bounds),
+            ('backlogs', ['0', '1', '2', '3', '4', '5+'], np.array([0, 1, 2, 3, 4, 5]))
+        ]
+        dimensions, offset = {}, 0
+        for name, labels, bounds in specs:
+            dimensions[name] = (offset, labels, bounds)
+            offset += len(labels)
+        return dimensions
+
+    def update(self, final_classes, input_data):
+        """Count a scored batch (final class indices + raw feature rows)"""
+        input_data = np.asarray(input_data)
+        columns = [self.dimensions['predicted_class'][0] + np.asarray(final_classes)]
+        for name, column in self._band_columns:
+            offset, _, bounds = self.dimensions[name]
+            band = np.searchsorted(bounds, input_data[:, column], side='right') - 1
+            columns.append(offset + np.clip(band, 0, len(bounds) - 1))
+        self.table.add(np.bincount(np.concatenate(columns), minlength=self.n_counters))
+
+    def _label_counts(self, counters):
+        """Flat counter vector -> {dimension: {band: count}}"""
+        return {
+            name: {label: int(counters[offset + i]) for i, label in enumerate(labels)}
+            for name, (offset, labels, _) in self.dimensions.items()
+        }
+
+    def snapshot(self, recent_windows=12):
+        """All-time and per-window distributions merged across workers"""
+        all_time, recent, oldest_window, n_tables = self.table.merged(recent_windows)
+        total_offset, class_labels, _ = self.dimensions['predicted_class']
+        return {
+            'window_seconds': self.window_seconds,
+            'workers': n_tables,
+            'all_time': dict(
+                total=int(all_time[total_offset:total_offset + len(class_labels)].sum()),
+                **self._label_counts(all_time)
+            ),
+            'recent': [
+                dict(
+                    window_start=datetime.fromtimestamp((oldest_window + i) * self.window_seconds).isoformat(),
+                    total=int(counters[total_offset:total_offset + len(class_labels)].sum()),
+                    **self._label_counts(counters)
+                )
+                for i, counters in enumerate(recent)
+            ]
+        }
+
+cohort_stats = CohortStats(
+    advisor_model.patterns, CLASS_LABELS,
+    stats_dir=COHORT_STATS_DIR,
+    window_seconds=COHORT_STATS_WINDOW_SECONDS,
+    n_windows=COHORT_STATS_WINDOWS
+)
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Live cohort distributions (predicted class, CGPA/attendance bands, backlogs) and drift status"""
+    try:
+        drift = drift_monitor.evaluate()
+        return jsonify(dict(
+            success=True,
+            drift={key: drift[key] for key in ('status', 'flagged', 'reference', 'evaluated_at')},
+            **cohort_stats.snapshot(request.args.get('windows', 12))
+        ))
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error reading stats: {str(e)}'
+        })
+
+# ==================== INPUT DRIFT MONITOR ====================
+# Per-feature histograms of live /app inputs (plus the predicted-class mix) in the same
+# windowed, per-worker memory-mapped tables as the cohort stats. The reference profile
+# is the app's own encoded inputs: pinned to DRIFT_REFERENCE_PATH automatically from the
+# first DRIFT_REFERENCE_SAMPLES inputs, or at any time with POST /admin/drift. Nothing is
+# flagged until a reference exists (the scaler's training statistics are in a different
+# encoding from the form, so they are no reference).
+DRIFT_STATS_DIR = os.environ.get('DRIFT_STATS_DIR', 'logs/drift_stats')
+DRIFT_REFERENCE_PATH = os.environ.get('DRIFT_REFERENCE_PATH', 'logs/drift_reference.json')
+DRIFT_RANGE_BINS = int(os.environ.get('DRIFT_RANGE_BINS', 50))      # bins for continuous features
+DRIFT_EVAL_WINDOWS = int(os.environ.get('DRIFT_EVAL_WINDOWS', 12))  # recent windows compared to the reference
+DRIFT_EVAL_INTERVAL = float(os.environ.get('DRIFT_EVAL_INTERVAL', 60))
+DRIFT_MIN_SAMPLES = int(os.environ.get('DRIFT_MIN_SAMPLES', 200))
+DRIFT_REFERENCE_SAMPLES = int(os.environ.get('DRIFT_REFERENCE_SAMPLES', 1000))  # auto-pin after this many inputs; 0 = by hand only
+DRIFT_PSI_THRESHOLD = float(os.environ.get('DRIFT_PSI_THRESHOLD', 0.25))
+DRIFT_KS_THRESHOLD = float(os.environ.get('DRIFT_KS_THRESHOLD', 0.1))
+DRIFT_PSI_GROUPS = 10  # continuous features are compared in reference deciles
+
+class DriftMonitor:
+    """Streaming input-drift check: fixed-bin histograms compared with PSI and KS
+
+    Bins come from the feature schema (DRIFT_RANGE_BINS equal-width bins over a range
+    feature, one bin per value for choice/integer features), so every worker's counts
+    line up and merge by addition. One update is a single searchsorted + bincount over a
+    shared edge array; evaluation reads the last DRIFT_EVAL_WINDOWS windows and is cached
+    for DRIFT_EVAL_INTERVAL seconds.
+    """
+    FEATURE_SPAN = 1e4  # each feature's values are shifted into their own span of the edge array
+
+    def __init__(self, schema, class_labels, reference_path=None, stats_dir=None, window_seconds=300,
+                 n_windows=288, range_bins=50, eval_windows=12, eval_interval=60, reference_samples=1000):
+        self.class_labels = list(class_labels)
+        self.reference_path = reference_path
+        self.reference_samples = reference_samples
+        self.eval_windows = eval_windows
+        self.eval_interval = eval_interval
+        self.features = self._build_bins(schema, range_bins)
+        self.class_offset = self._edges.size
+        self.table = WindowedCounterTable(self.class_offset + len(self.class_labels),
+                                          stats_dir, window_seconds, n_windows)
+        self.reference, self.reference_source = self._load_reference()
+        self.flagged = set()
+        self._cached = None
+        self._cached_at = 0.0
+        self._lock = threading.Lock()
+
+    def _build_bins(self, schema, range_bins):
+        """Per feature: name, kind, bin offset, bin lower/upper bounds; plus the shared edge array"""
+        features, edges = [], []
+        for i, (name, kind, spec, _, _) in enumerate(schema.fields):
+            if kind == 'range':
+                bounds = np.linspace(spec[0], spec[1], range_bins + 1)
+                lows, highs = bounds[:-1], bounds[1:]
+            else:
+                values = (np.arange(spec[0], spec[1] + 1) if kind == 'int_range'
+                          else np.array(sorted({value for value in spec.values() if not isinstance(value, str)})))
+                lows = highs = values.astype(np.float64)
+            shift = i * self.FEATURE_SPAN
+            interior = (lows[1:] + highs[:-1]) / 2  # bin boundaries: range edges or value midpoints
+            features.append({'name': name, 'kind': kind, 'offset': len(edges), 'lows': lows, 'highs': highs})
+            edges.extend([shift - self.FEATURE_SPAN / 2, *(interior + shift)])
+        self._edges = np.array(edges)
+        self._shifts = np.arange(len(features)) * self.FEATURE_SPAN
+        return features
+
+    def _load_reference(self):
+        """(reference, source) from reference_path, or (None, None) while none has been pinned"""
+        if not (self.reference_path and os.path.exists(self.reference_path)):
+            return None, None
+        try:
+            with open(self.reference_path, 'r', encoding='utf-8') as f:
+                pinned = json.load(f)
+            reference = {}
+            for feature in self.features:
+                probabilities = np.asarray(pinned['features'][feature['name']], dtype=np.float64)
+                if len(probabilities) != len(feature['lows']):
+                    raise ValueError(f"{feature['name']} has {len(probabilities)} bins, expected {len(feature['lows'])}")
+                reference[feature['name']] = probabilities
+            return reference, f"pinned {pinned.get('pinned_at', '')}".strip()
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            print(f"❌ Ignoring drift reference {self.reference_path}: {e}")
+        return None, None
+
+    def update(self, final_classes, input_data):
+        """Count a scored batch (final class indices + raw feature rows)"""
+        shifted = np.asarray(input_data, dtype=np.float64) + self._shifts
+        bins = np.searchsorted(self._edges, shifted.ravel(), side='right') - 1
+        classes = self.class_offset + np.asarray(final_classes)
+        self.table.add(np.bincount(np.concatenate([bins, classes]), minlength=self.table.n_counters))
+
+    def _feature_report(self, feature, counts, reference):
+        n = int(counts.sum())
+        lows, highs = feature['lows'], feature['highs']
+        report = {'samples': n}
+        if not n:
+            return report
+        observed = counts / n
+        cumulative = np.cumsum(observed)
+
+        def quantile(q):
+            i = min(int(np.searchsorted(cumulative, q)), len(cumulative) - 1)
+            before = cumulative[i - 1] if i else 0.0
+            fraction = (q - before) / observed[i] if observed[i] else 0.0
+            return float(lows[i] + (highs[i] - lows[i]) * fraction)
+
+        # PSI in reference deciles for fine continuous bins, per value otherwise
+        if len(reference) > DRIFT_PSI_GROUPS:
+            groups = np.minimum((np.cumsum(reference) - reference / 2) * DRIFT_PSI_GROUPS, DRIFT_PSI_GROUPS - 1).astype(int)
+            observed_groups = np.bincount(groups, observed, DRIFT_PSI_GROUPS)
+            reference_groups = np.bincount(groups, reference, DRIFT_PSI_GROUPS)
+        else:
+            observed_groups, reference_groups = observed, reference
+        observed_groups = np.maximum(observed_groups, 1e-4)
+        reference_groups = np.maximum(reference_groups, 1e-4)
+        psi = float(np.sum((observed_groups - reference_groups) * np.log(observed_groups / reference_groups)))
+        ks = float(np.max(np.abs(cumulative - np.cumsum(reference))))
+        ks_critical = 1.36 / math.sqrt(n)  # one-sample KS at alpha = 0.05
+
+        report.update(
+            mean=float(observed @ ((lows + highs) / 2)),
+            p05=quantile(0.05), p50=quantile(0.5), p95=quantile(0.95),
+            psi=psi, ks=ks, ks_critical=ks_critical,
+            drift=n >= DRIFT_MIN_SAMPLES and (psi >= DRIFT_PSI_THRESHOLD or ks > max(ks_critical, DRIFT_KS_THRESHOLD))
+        )
+        return report
+
+    def evaluate(self, force=False, include_histograms=False):
+        """PSI/KS of the recent windows against the reference, cached for eval_interval seconds"""
+        with self._lock:
+            if not force and not include_histograms and self._cached is not None \
+                    and time.monotonic() - self._cached_at < self.eval_interval:
+                return self._cached
+            all_time, recent, _, n_tables = self.table.merged(self.eval_windows)
+            observed = recent.sum(axis=0)
+            if self.reference is None:
+                self._adopt_reference(all_time)
+
+            features = {}
+            for feature in self.features:
+                bins = slice(feature['offset'], feature['offset'] + len(feature['lows']))
+                if self.reference is None:
+                    report = {'samples': int(observed[bins].sum())}
+                else:
+                    report = self._feature_report(feature, observed[bins], self.reference[feature['name']])
+                if include_histograms:
+                    report['bins'] = feature['lows'].tolist()
+                    report['observed'] = observed[bins].tolist()
+                    if self.reference is not None:
+                        report['reference'] = self.reference[feature['name']].round(6).tolist()
+                features[feature['name']] = report
+
+            # No training class mix is stored with the model: compare recent predictions to all-time
+            recent_classes = observed[self.class_offset:]
+            all_time_classes = all_time[self.class_offset:]
+            class_report = {'recent': dict(zip(self.class_labels, recent_classes.tolist())),
+                            'all_time': dict(zip(self.class_labels, all_time_classes.tolist()))}
+            if recent_classes.sum() and all_time_classes.sum():
+                recent_share = np.maximum(recent_classes / recent_classes.sum(), 1e-4)
+                all_time_share = np.maximum(all_time_classes / all_time_classes.sum(), 1e-4)
+                class_report['psi_vs_all_time'] = float(np.sum((recent_share - all_time_share) * np.log(recent_share / all_time_share)))
+
+            flagged = sorted(name for name, report in features.items() if report.get('drift'))
+            newly_flagged = set(flagged) - self.flagged
+            if newly_flagged:
+                print(f"⚠️ Input drift on {sorted(newly_flagged)} (reference: {self.reference_source})")
+            self.flagged = set(flagged)
+
+            if not observed[:self.class_offset].sum():
+                status = 'no_data'
+            elif self.reference is None:
+                status = 'no_reference'
+            else:
+                status = 'drift' if flagged else 'ok'
+            result = {
+                'status': status,
+                'flagged': flagged,
+                'reference': self.reference_source or self._pending_reference(all_time),
+                'evaluated_at': datetime.now().isoformat(),
+                'windows': self.eval_windows,
+                'window_seconds': self.table.window_seconds,
+                'workers': n_tables,
+                'features': features,
+                'predicted_class': class_report
+            }
+            if not include_histograms:
+                self._cached, self._cached_at = result, time.monotonic()
+            return result
+
+    def _reference_counts(self, all_time, min_samples):
+        """feature -> all-time bin probabilities, or ValueError if a feature has too few samples"""
+        pinned = {}
+        for feature in self.features:
+            counts = all_time[feature['offset']:feature['offset'] + len(feature['lows'])]
+            if counts.sum() < min_samples:
+                raise ValueError(f"Need at least {min_samples} samples of {feature['name']} to pin a reference")
+            pinned[feature['name']] = counts / counts.sum()
+        return pinned
+
+    def _pending_reference(self, all_time):
+        if not self.reference_samples:
+            return 'none (pin with POST /admin/drift)'
+        seen = int(all_time[self.features[0]['offset']:self.features[0]['offset'] + len(self.features[0]['lows'])].sum())
+        return f"none yet ({min(seen, self.reference_samples)}/{self.reference_samples} inputs before auto-pinning)"
+
+    def _adopt_reference(self, all_time):
+        """Pick up a reference another worker pinned, or auto-pin the first reference_samples inputs"""
+        self.reference, self.reference_source = self._load_reference()
+        if self.reference is not None or not self.reference_samples:
+            return
+        try:
+            pinned = self._reference_counts(all_time, max(self.reference_samples, DRIFT_MIN_SAMPLES))
+        except ValueError:
+            return
+        # Exclusive create: the first worker to get here pins, the rest load its file next time
+        if self._write_reference(pinned, exclusive=True):
+            self.reference, self.reference_source = self._load_reference()
+            if self.reference is not None:
+                print(f"📌 Drift reference auto-pinned from the first {self.reference_samples} inputs")
+
+    def _write_reference(self, pinned, exclusive=False):
+        """Persist a reference; with exclusive=True only if none exists yet. Returns the pin time"""
+        pinned_at = datetime.now().isoformat()
+        if not self.reference_path:
+            return pinned_at
+        os.makedirs(os.path.dirname(self.reference_path) or '.', exist_ok=True)
+        temporary = f"{self.reference_path}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'pinned_at': pinned_at,
+                       'features': {name: p.tolist() for name, p in pinned.items()}}, f)
+        if not exclusive:
+            os.replace(temporary, self.reference_path)
+            return pinned_at
+        try:
+            os.link(temporary, self.reference_path)  # fails if another worker already pinned
+        except FileExistsError:
+            return None
+        finally:
+            os.remove(temporary)
+        return pinned_at
+
+    def pin_reference(self):
+        """Use the all-time observed histograms as the reference from now on (and persist them)"""
+        all_time, _, _, _ = self.table.merged(1)
+        pinned = self._reference_counts(all_time, DRIFT_MIN_SAMPLES)
+        pinned_at = self._write_reference(pinned)
+        with self._lock:
+            self.reference, self.reference_source = pinned, f"pinned {pinned_at}"
+            self._cached = None
+
+drift_monitor = DriftMonitor(
+    feature_schema, CLASS_LABELS,
+    reference_path=DRIFT_REFERENCE_PATH,
+    stats_dir=DRIFT_STATS_DIR,
+    window_seconds=COHORT_STATS_WINDOW_SECONDS,
+    n_windows=COHORT_STATS_WINDOWS,
+    range_bins=DRIFT_RANGE_BINS,
+    eval_windows=DRIFT_EVAL_WINDOWS,
+    eval_interval=DRIFT_EVAL_INTERVAL,
+    reference_samples=DRIFT_REFERENCE_SAMPLES
+)
+
+@app.route('/stats/drift', methods=['GET'])
+def drift_stats():
+    """Per-feature PSI/KS against the reference, with the observed and reference histograms"""
+    try:
+        return jsonify(dict(success=True, **drift_monitor.evaluate(include_histograms=True)))
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error evaluating drift: {str(e)}'
+        })
+
+@app.route('/admin/drift', methods=['POST'])
+@admin_required
+def admin_drift():
+    """{"pin_reference": true} makes the traffic seen so far the drift reference"""
+    if not (request.get_json(silent=True) or {}).get('pin_reference'):
+        return jsonify({'success': False, 'message': 'Nothing to do'}), 400
+    try:
+        drift_monitor.pin_reference()
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    return jsonify({'success': True, 'message': f'Drift reference is now {drift_monitor.reference_source}'})
+
+# ==================== STUDENT HISTORY ====================
+# Optional student_id + term on /app (and on /predict_batch row objects) keep one row per
+# student and term in SQLite, so trajectories survive across semesters. Terms are
+# "2025-1" style (year and term number) or a plain semester number. Students do not
+# log in, so this is an admin-only bulk feature: ids are only accepted from callers
+# with the admin token, and anonymous form posts or batch rows that carry one are rejected.
+HISTORY_ENABLED = os.environ.get('HISTORY_ENABLED', 'true').lower() == 'true'
+HISTORY_DB_PATH = os.environ.get('HISTORY_DB_PATH', 'logs/student_history.db')
+HISTORY_QUEUE_SIZE = int(os.environ.get('HISTORY_QUEUE_SIZE', 10000))
+HISTORY_BATCH_SIZE = int(os.environ.get('HISTORY_BATCH_SIZE', 1000))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', 1.0))
+HISTORY_TREND_EPSILON = float(os.environ.get('HISTORY_TREND_EPSILON', 0.05))  # CGPA points per term
+STUDENT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.\-]{1,64}$')
+TERM_PATTERN = re.compile(r'^(?:(\d{4})\s*[-/ ]\s*(?:S|SEM|T|TERM)?\s*(\d{1,2})|(\d{1,2}))$', re.IGNORECASE)
+HISTORY_ADMIN_ONLY_MESSAGE = "Student ID and term are only recorded for admin-authenticated callers (X-Admin-Token)"
+
+def parse_student_term(student_id, term):
+    """Validate a (student_id, term) pair; return (student_id, term label, sortable term number)"""
+    student_id = str(student_id or '').strip()
+    term = str(term or '').strip()
+    errors = []
+    if not STUDENT_ID_PATTERN.match(student_id):
+        errors.append("Student ID must be 1-64 letters, digits, '.', '_' or '-'")
+    match = TERM_PATTERN.match(term)
+    if not match:
+        errors.append("Term must look like 2025-1 (year-term) or be a semester number")
+    if errors:
+        raise FeatureValidationError(errors)
+    year, part, semester = match.groups()
+    term_order = int(year) * 100 + int(part) if year else int(semester)
+    return student_id, term, term_order
+
+def compute_trends(student_ids, cgpa, levels):
+    """Per-student trends over rows sorted by (student, term), all groups at once
+
+    Returns (group start indices, dict of per-student arrays): terms, CGPA slope per term
+    (least squares over term position), last CGPA change, level change first -> last and
+    number of class changes. Slopes/changes are NaN for students with a single term.
+    """
+    n_rows = len(student_ids)
+    starts = np.flatnonzero(np.r_[True, student_ids[1:] != student_ids[:-1]]) if n_rows else np.array([], dtype=np.int64)
+    counts = np.diff(np.r_[starts, n_rows])
+    ends = starts + counts - 1
+    position = np.arange(n_rows) - np.repeat(starts, counts)
+
+    def group_sum(values):
+        return np.add.reduceat(values, starts) if n_rows else np.zeros(0)
+
+    sum_x, sum_y = group_sum(position.astype(np.float64)), group_sum(cgpa)
+    sum_xx, sum_xy = group_sum(position ** 2.0), group_sum(position * cgpa)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (counts * sum_xy - sum_x * sum_y) / (counts * sum_xx - sum_x ** 2)
+    multi = counts > 1
+    last_change = np.where(multi, cgpa[ends] - cgpa[np.maximum(ends - 1, 0)], np.nan)
+    changed = np.r_[False, levels[1:] != levels[:-1]].astype(np.int64)
+    changed[starts] = 0  # a new student is not a class change
+    return starts, {
+        'terms': counts,
+        'cgpa_slope': np.where(multi, slope, np.nan),
+        'last_cgpa_change': last_change,
+        'level_change': levels[ends] - levels[starts],
+        'class_changes': group_sum(changed).astype(np.int64)
+    }
+
+def trend_direction(slope, level_change):
+    if np.isnan(slope):
+        return 'new'
+    if slope > HISTORY_TREND_EPSILON or (abs(slope) <= HISTORY_TREND_EPSILON and level_change > 0):
+        return 'improving'
+    if slope < -HISTORY_TREND_EPSILON or (abs(slope) <= HISTORY_TREND_EPSILON and level_change < 0):
+        return 'declining'
+    return 'steady'
+
+class StudentHistoryStore:
+    """Per-student, per-term prediction history (SQLite, WAL) with precomputed trends
+
+    student_history is keyed (student_id, term_order) WITHOUT ROWID, so one student's
+    history is a contiguous primary-key range. Requests only enqueue rows; a background
+    thread upserts them in batches and then recomputes student_trends for just the
+    students it touched, so trend lookups are a single primary-key read.
+    """
+    def __init__(self, path, class_labels, performance_levels, queue_size=10000, batch_size=1000,
+                 flush_interval=1.0, enabled=True):
+        self.path = path
+        self.class_labels = list(class_labels)
+        self.performance_levels = list(performance_levels)
+        self.level_of_class = np.array([self.performance_levels.index(label) for label in self.class_labels])
+        self.probability_columns = [f"p_{label.lower().replace(' ', '_')}" for label in self.class_labels]
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.stats = {'recorded': 0, 'dropped': 0, 'batches': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._queue = None
+        self._writer = None
+        self._pid = None
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        feature_columns = ", ".join(f"{name} REAL NOT NULL" for name in SCALER_FEATURES)
+        probability_columns = ", ".join(f"{name} REAL" for name in self.probability_columns)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS student_history (
+                student_id TEXT NOT NULL,
+                term_order INTEGER NOT NULL,
+                term TEXT NOT NULL,
+                recorded_at REAL NOT NULL,
+                model_version TEXT NOT NULL,
+                {feature_columns},
+                predicted_class TEXT NOT NULL,
+                performance_level INTEGER NOT NULL,
+                confidence REAL NOT NULL,
+                {probability_columns},
+                PRIMARY KEY (student_id, term_order)
+            ) WITHOUT ROWID
+        """)
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(student_history)')}
+        for name in self.probability_columns:
+            if name not in existing:  # databases created before class probabilities were kept
+                conn.execute(f"ALTER TABLE student_history ADD COLUMN {name} REAL")
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_student_history_term ON student_history (term_order)')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS student_trends (
+                student_id TEXT PRIMARY KEY,
+                terms INTEGER NOT NULL,
+                first_term TEXT NOT NULL,
+                last_term TEXT NOT NULL,
+                last_cgpa REAL NOT NULL,
+                cgpa_slope REAL,
+                last_cgpa_change REAL,
+                level_change INTEGER NOT NULL,
+                class_changes INTEGER NOT NULL,
+                direction TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_student_trends_direction ON student_trends (direction, cgpa_slope)')
+        return conn
+
+    def _ensure_writer(self):
+        """Start the writer thread lazily, and again in each forked worker process"""
+        if self._pid == os.getpid() and self._writer.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._writer.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._writer = threading.Thread(target=self._run, name='student-history-writer', daemon=True)
+            self._pid = os.getpid()
+            self._writer.start()
+
+    def record(self, keys, input_data, prediction_probs, final_classes):
+        """Enqueue scored rows; keys is a list of (student_id, term, term_order) per row"""
+        if not self.enabled or not keys:
+            return
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((time.time(), keys, input_data, prediction_probs, final_classes))
+        except queue.Full:
+            self.stats['dropped'] += len(keys)
+
+    def _run(self):
+        """Writer loop: upsert queued rows in one transaction, then refresh touched trends"""
+        conn = self._connect()
+        if conn.execute('SELECT COUNT(*) FROM student_trends').fetchone()[0] == 0:
+            self.rebuild_trends(conn)
+        pending_queue = self._queue
+        running = True
+        while running:
+            try:
+                item = pending_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch, n_rows = [], 0
+            while item is not None:
+                batch.append(item)
+                n_rows += len(item[1])
+                if n_rows >= self.batch_size:
+                    break
+                try:
+                    item = pending_queue.get_nowait()
+                except queue.Empty:
+                    break
+            if item is None:
+                running = False  # close() sentinel
+            if batch:
+                self._write(conn, batch)
+        conn.close()
+
+    def _write(self, conn, batch):
+        rows, touched = [], set()
+        for recorded_at, keys, input_data, prediction_probs, final_classes in batch:
+            features = np.round(np.asarray(input_data, dtype=np.float64), 4).tolist()
+            probabilities = np.asarray(prediction_probs, dtype=np.float64)
+            confidences = np.max(probabilities, axis=1).tolist()
+            probabilities = np.round(probabilities, 6).tolist()
+            levels = self.level_of_class[final_classes].tolist()
+            for i, (student_id, term, term_order) in enumerate(keys):
+                rows.append((student_id, term_order, term, recorded_at, MODEL_VERSION, *features[i],
+                             self.class_labels[final_classes[i]], levels[i], confidences[i], *probabilities[i]))
+                touched.add(student_id)
+        columns = ['student_id', 'term_order', 'term', 'recorded_at', 'model_version', *SCALER_FEATURES,
+                   'predicted_class', 'performance_level', 'confidence', *self.probability_columns]
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[2:])
+        try:
+            with conn:
+                # Re-scoring a student in the same term replaces that term's row
+                conn.executemany(
+                    f"INSERT INTO student_history ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                    f"ON CONFLICT (student_id, term_order) DO UPDATE SET {updates}",
+                    rows
+                )
+                self._refresh_trends(conn, sorted(touched))
+            self.stats['recorded'] += len(rows)
+            self.stats['batches'] += 1
+        except sqlite3.Error as e:
+            self.stats['errors'] += 1
+            print(f"❌ Student history write failed ({len(rows)} rows): {e}")
+
+    def _refresh_trends(self, conn, student_ids=None):
+        """Recompute student_trends for the given students (None = the whole cohort)"""
+        query = "SELECT student_id, term, total_cgpa, performance_level FROM student_history"
+        if student_ids is None:
+            records = conn.execute(f"{query} ORDER BY student_id, term_order").fetchall()
+        else:
+            records = []
+            for start in range(0, len(student_ids), 500):  # stay under SQLite's bound-parameter limit
+                chunk = student_ids[start:start + 500]
+                records.extend(conn.execute(
+                    f"{query} WHERE student_id IN ({', '.join('?' * len(chunk))}) ORDER BY student_id, term_order",
+                    chunk
+                ).fetchall())
+        if not records:
+            return 0
+        ids, terms, cgpa, levels = zip(*records)
+        ids = np.array(ids, dtype=object)
+        starts, trends = compute_trends(ids, np.array(cgpa, dtype=np.float64), np.array(levels, dtype=np.int64))
+        ends = np.r_[starts[1:], len(ids)] - 1
+        now = time.time()
+        slopes = trends['cgpa_slope']
+        rows = [
+            (ids[start], int(trends['terms'][i]), terms[start], terms[end], cgpa[end],
+             None if np.isnan(slopes[i]) else round(float(slopes[i]), 4),
+             None if np.isnan(trends['last_cgpa_change'][i]) else round(float(trends['last_cgpa_change'][i]), 4),
+             int(trends['level_change'][i]), int(trends['class_changes'][i]),
+             trend_direction(slopes[i], trends['level_change'][i]), now)
+            for i, (start, end) in enumerate(zip(starts, ends))
+        ]
+        conn.executemany(f"INSERT OR REPLACE INTO student_trends VALUES ({', '.join('?' * 11)})", rows)
+        return len(rows)
+
+    def rebuild_trends(self, conn=None):
+        """Recompute every student's trend in one pass (e.g. after importing history)"""
+        own_connection = conn is None
+        conn = conn or self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM student_trends')
+                return self._refresh_trends(conn)
+        finally:
+            if own_connection:
+                conn.close()
+
+    def close(self, timeout=5.0):
+        """Flush everything queued so far and stop the writer"""
+        if self._pid == os.getpid() and self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout)
+
+    def _read(self, sql, params):
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    def history(self, student_id, from_term=None, to_term=None):
+        """One student's rows between two terms (inclusive), oldest first"""
+        low = parse_student_term(student_id, from_term)[2] if from_term else -1
+        high = parse_student_term(student_id, to_term)[2] if to_term else 1 << 62
+        return self._read(
+            "SELECT * FROM student_history WHERE student_id = ? AND term_order BETWEEN ? AND ? ORDER BY term_order",
+            (student_id, low, high)
+        )
+
+    def trend(self, student_id):
+        """Precomputed trend for one student, or None before their first recorded term"""
+        rows = self._read("SELECT * FROM student_trends WHERE student_id = ?", (student_id,))
+        return rows[0] if rows else None
+
+    def cohort_trends(self, direction=None, limit=100):
+        """Students by trend (steepest decline first), and the count per direction"""
+        counts = {row['direction']: row['students'] for row in self._read(
+            "SELECT direction, COUNT(*) AS students FROM student_trends GROUP BY direction", ())}
+        if direction:
+            students = self._read(
+                "SELECT * FROM student_trends WHERE direction = ? ORDER BY cgpa_slope LIMIT ?", (direction, int(limit)))
+        else:
+            students = self._read("SELECT * FROM student_trends ORDER BY cgpa_slope LIMIT ?", (int(limit),))
+        return counts, students
+
+student_history = StudentHistoryStore(
+    HISTORY_DB_PATH, CLASS_LABELS, StudentAdvisorModel.PERFORMANCE_LEVELS,
+    queue_size=HISTORY_QUEUE_SIZE,
+    batch_size=HISTORY_BATCH_SIZE,
+    flush_interval=HISTORY_FLUSH_INTERVAL,
+    enabled=HISTORY_ENABLED
+)
+atexit.register(student_history.close)
+
+@app.route('/admin/history/<student_id>', methods=['GET'])
+@admin_required
+def admin_student_history(student_id):
+    """Any student's history between ?from=2024-1&to=2025-2, with their trend"""
+    try:
+        history = student_history.history(student_id, request.args.get('from'), request.args.get('to'))
+    except FeatureValidationError as e:
+        return jsonify({'success': False, 'message': str(e), 'errors': e.errors}), 400
+    return jsonify({'success': True, 'history': history, 'trend': student_history.trend(student_id)})
+
+@app.route('/admin/history_trends', methods=['GET'])
+@admin_required
+def admin_history_trends():
+    """Per-direction counts and students with the steepest CGPA decline (?direction=declining)"""
+    counts, students = student_history.cohort_trends(request.args.get('direction'), request.args.get('limit', 100))
+    return jsonify({'success': True, 'directions': counts, 'students': students})
+
+# ==================== COHORT RANKINGS ====================
+# "Your attendance is in the 30th percentile of your batch": each cohort (a term of
+# student history, all students' latest terms, or a bulk-scored file) is one sorted column
+# per feature and per class probability, so a percentile is two binary searches. Cohorts
+# are rebuilt in bulk (POST /admin/rankings, score_cohort.py --rankings), not per request.
+RANKINGS_DIR = os.environ.get('RANKINGS_DIR', 'logs/rankings')
+RANKINGS_MIN_COHORT = int(os.environ.get('RANKINGS_MIN_COHORT', 20))  # smaller cohorts are not ranked
+RANKINGS_DEFAULT_COHORT = os.environ.get('RANKINGS_DEFAULT_COHORT', 'all')
+
+def cohort_key(name):
+    """File-safe cohort name: anything outside [A-Za-z0-9_.-] becomes '_'"""
+    return re.sub(r'[^A-Za-z0-9_.\-]+', '_', str(name).strip())[:64] or '_'
+
+def term_cohort_name(term_order):
+    """Cohort name for a history term, however the term was typed (2025-1, 2025 S1, ...)"""
+    if term_order >= 100:
+        return f"{term_order // 100}-{term_order % 100}"
+    return f"semester-{term_order}"
+
+def ordinal(n):
+    n = int(n)
+    suffix = 'th' if 10 <= n % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
+    return f"{n}{suffix}"
+
+class CohortRankings:
+    """Per-cohort sorted metric columns on disk, memory-mapped for O(log n) percentiles
+
+    A cohort is <name>-<build>.npy, a (metrics, rows) float32 array with every row sorted
+    ascending and missing values (NaN) last, plus <name>.json naming the metrics and the
+    non-missing count of each. The JSON is replaced after the array is complete, so a
+    reader always sees a whole build; the previous array is unlinked, which leaves it
+    readable for any process that still has it mapped.
+    """
+    def __init__(self, directory, feature_names, class_labels, min_cohort=20):
+        self.directory = directory
+        self.feature_names = list(feature_names)
+        self.probability_names = [f"p_{label.lower().replace(' ', '_')}" for label in class_labels]
+        self.class_labels = list(class_labels)
+        self.metrics = self.feature_names + self.probability_names
+        self.min_cohort = min_cohort
+        self._cache = {}  # key -> (json mtime_ns, meta, mapped columns)
+
+    def _write_atomic(self, path, write):
+        with open(f"{path}.tmp", 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+
+    def build(self, name, features, probabilities=None, source=None):
+        """Replace cohort `name` with these (n, 8) features and (n, classes) probabilities"""
+        key = cohort_key(name)
+        features = np.asarray(features, dtype=np.float32).reshape(-1, len(self.feature_names))
+        if probabilities is None:
+            probabilities = np.full((len(features), len(self.probability_names)), np.nan, dtype=np.float32)
+        probabilities = np.asarray(probabilities, dtype=np.float32).reshape(len(features), len(self.probability_names))
+        columns = np.sort(np.concatenate([features, probabilities], axis=1).T, axis=1)  # NaN sorts last
+        counts = np.count_nonzero(~np.isnan(columns), axis=1)
+
+        os.makedirs(self.directory, exist_ok=True)
+        previous = self._read_meta(key)
+        meta = {
+            'name': str(name),
+            'file': f"{key}-{time.time_ns()}.npy",
+            'rows': int(len(features)),
+            'metrics': self.metrics,
+            'counts': counts.tolist(),
+            'source': source,
+            'model_version': MODEL_VERSION,
+            'built_at': datetime.now().isoformat()
+        }
+        self._write_atomic(os.path.join(self.directory, meta['file']), lambda f: np.save(f, columns))
+        self._write_atomic(os.path.join(self.directory, f"{key}.json"),
+                           lambda f: f.write(json.dumps(meta, indent=1).encode('utf-8')))
+        if previous and previous['file'] != meta['file']:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(self.directory, previous['file']))
+        return meta
+
+    def _read_meta(self, key):
+        try:
+            with open(os.path.join(self.directory, f"{key}.json"), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load(self, name):
+        """(meta, mapped columns) for a cohort, or None; re-mapped only after a rebuild"""
+        key = cohort_key(name)
+        for _ in range(2):  # a rebuild can remove the array between reading the JSON and mapping it
+            try:
+                mtime = os.stat(os.path.join(self.directory, f"{key}.json")).st_mtime_ns
+            except OSError:
+                return None
+            cached = self._cache.get(key)
+            if cached and cached[0] == mtime:
+                return cached[1], cached[2]
+            meta = self._read_meta(key)
+            if meta is None:
+                return None
+            try:
+                columns = np.load(os.path.join(self.directory, meta['file']), mmap_mode='r')
+            except OSError:
+                continue
+            self._cache[key] = (mtime, meta, columns)
+            return meta, columns
+        return None
+
+    @staticmethod
+    def _percent(count, n):
+        percent = np.asarray(count) * 100.0 / n
+        return round(float(percent), 1) if percent.ndim == 0 else np.round(percent, 1).tolist()
+
+    def rank(self, name, values):
+        """Positions of {metric: value or array} within cohort `name`, or None if it does not exist
+
+        Each ranked metric maps to {'percentile': mid-rank percentile, 'below': % of the
+        cohort strictly below}; metrics with fewer than min_cohort values are left out.
+        """
+        loaded = self._load(name)
+        if loaded is None:
+            return None
+        meta, columns = loaded
+        positions = {}
+        for metric, value in values.items():
+            if value is None or metric not in meta['metrics']:
+                continue
+            index = meta['metrics'].index(metric)
+            n = meta['counts'][index]
+            if n < self.min_cohort:
+                continue
+            column = columns[index, :n]
+            value = np.asarray(value, dtype=np.float32)  # compare at the stored precision so ties match
+            below = column.searchsorted(value, side='left')
+            not_above = column.searchsorted(value, side='right')
+            positions[metric] = {
+                'percentile': self._percent((below + not_above) / 2.0, n),
+                'below': self._percent(below, n)
             }
-            study_hours = study_hours_map[request.form['study_hours']]
-
-            # Backlogs mapping
-            backlogs_map = {
-                "0": 0,
-                "1": 1,
-                "2": 2,
-                "3": 3,
-                "4": 4,
-                "5+": 6
+        return {'cohort': meta['name'], 'size': meta['rows'], 'built_at': meta['built_at'], 'positions': positions}
+
+    def rank_student(self, name, features, probabilities=None):
+        """rank() for one student's 8 features (and class probabilities, if known)"""
+        values = dict(zip(self.feature_names, np.asarray(features, dtype=np.float64).ravel().tolist()))
+        if probabilities is not None:
+            values.update(zip(self.probability_names, np.asarray(probabilities, dtype=np.float64).ravel().tolist()))
+        return self.rank(name, values)
+
+    def cohorts(self):
+        """Metadata of every built cohort"""
+        if not os.path.isdir(self.directory):
+            return []
+        metas = (self._read_meta(filename[:-5]) for filename in sorted(os.listdir(self.directory))
+                 if filename.endswith('.json'))
+        return [meta for meta in metas if meta]
+
+    def rebuild_from_history(self, store):
+        """One cohort per recorded term plus 'all' (every student's latest term); returns {name: rows}"""
+        conn = store._connect()
+        try:
+            records = conn.execute(
+                f"SELECT student_id, term_order, {', '.join(self.feature_names + store.probability_columns)} "
+                f"FROM student_history ORDER BY student_id, term_order"
+            ).fetchall()
+        finally:
+            conn.close()
+        if not records:
+            return {}
+        ids = np.array([record[0] for record in records], dtype=object)
+        term_orders = np.array([record[1] for record in records], dtype=np.int64)
+        values = np.array([record[2:] for record in records], dtype=np.float64)  # NULL -> NaN
+        n_features = len(self.feature_names)
+
+        built = {}
+        latest = np.flatnonzero(np.r_[ids[1:] != ids[:-1], True])
+        for name, rows in [('all', latest)] + [(term_cohort_name(term_order), np.flatnonzero(term_orders == term_order))
+                                               for term_order in np.unique(term_orders)]:
+            self.build(name, values[rows, :n_features], values[rows, n_features:], source='history')
+            built[name] = int(len(rows))
+        return built
+
+cohort_rankings = CohortRankings(RANKINGS_DIR, SCALER_FEATURES, CLASS_LABELS, min_cohort=RANKINGS_MIN_COHORT)
+
+def session_ranking(student, cohort=None):
+    """Positions of the session's student in `cohort`, else their term's cohort, else the default"""
+    if cohort:
+        names = [cohort]
+    else:
+        term_order = session.get('student_term')
+        names = ([term_cohort_name(term_order)] if term_order is not None else []) + [RANKINGS_DEFAULT_COHORT]
+    for name in names:
+        ranking = cohort_rankings.rank_student(name, student.to_row(), session.get('class_probabilities'))
+        if ranking and ranking['positions']:
+            return ranking
+    return None
+
+@app.route('/rankings', methods=['GET'])
+def rankings_index():
+    """Cohorts available for percentile lookups"""
+    return jsonify({
+        'success': True,
+        'cohorts': [{key: meta[key] for key in ('name', 'rows', 'source', 'built_at')}
+                    for meta in cohort_rankings.cohorts()]
+    })
+
+@app.route('/rankings/percentile', methods=['POST'])
+def rankings_percentile():
+    """Percentiles of {"values": {metric: value}} in {"cohort": name}
+
+    Without values, ranks the student analyzed in this session (in their term's cohort
+    unless a cohort is given).
+    """
+    data = request.get_json(silent=True) or {}
+    cohort = data.get('cohort')
+    values = data.get('values')
+    if values is None:
+        student = session_profile()
+        if student is None:
+            return jsonify({'success': False, 'message': 'Analyze your performance first, or send "values".'})
+        ranking = session_ranking(student, cohort)
+    else:
+        if not isinstance(values, dict):
+            return jsonify({'success': False, 'message': '"values" must map metric names to numbers'}), 400
+        try:
+            values = {metric: float(value) for metric, value in values.items() if metric in cohort_rankings.metrics}
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': '"values" must map metric names to numbers'}), 400
+        ranking = cohort_rankings.rank(cohort or RANKINGS_DEFAULT_COHORT, values)
+    if not ranking:
+        return jsonify({'success': False, 'message': 'No ranking cohort is available yet.'})
+    return jsonify({'success': True, 'ranking': ranking})
+
+@app.route('/admin/rankings', methods=['POST'])
+@admin_required
+def admin_rankings():
+    """Rebuild the history cohorts ({"rebuild": "history"}); bulk files use score_cohort.py --rankings"""
+    data = request.get_json(silent=True) or {}
+    if data.get('rebuild') != 'history':
+        return jsonify({'success': False, 'message': 'Send {"rebuild": "history"}'}), 400
+    started = time.perf_counter()
+    built = cohort_rankings.rebuild_from_history(student_history)
+    return jsonify({
+        'success': True,
+        'cohorts': built,
+        'seconds': round(time.perf_counter() - started, 3)
+    })
+
+# ==================== PEER NEIGHBORS ====================
+# "Students with a profile like yours who improved did X": an exact k-nearest-neighbour
+# index over scaled profiles from student history terms that have a following term, so
+# every indexed peer comes with what they changed next and whether it paid off.
+PEER_INDEX_DIR = os.environ.get('PEER_INDEX_DIR', 'logs/peer_index')
+PEER_LEAF_SIZE = int(os.environ.get('PEER_LEAF_SIZE', 512))
+PEER_NEIGHBORS = int(os.environ.get('PEER_NEIGHBORS', 50))
+PEER_MIN_NEIGHBORS = int(os.environ.get('PEER_MIN_NEIGHBORS', 10))  # fewer peers than this give no advice
+PEER_ACTIONS = [  # (feature, phrase for a positive change, phrase for a negative change, unit)
+    ('attendance', 'raised attendance by', 'let attendance slip by', ' points'),
+    ('study_hours', 'added', 'cut', ' study hours a week'),
+    ('backlogs', 'took on', 'cleared', ' backlogs'),
+    ('competitions', 'started competing', 'stopped competing', ''),
+    ('projects_internships', 'took on projects/internships', 'dropped projects/internships', ''),
+    ('confidence_level', 'gained', 'lost', ' confidence points'),
+]
+
+class PeerIndex:
+    """Exact k-NN over scaled 8-feature profiles, stored as flat arrays in kd-tree leaf order
+
+    A build splits rows on their widest scaled dimension at the median until every leaf
+    has at most leaf_size rows, then writes the reordered points (n, 8 float32), a per-row
+    payload (raw features, class level, next-term changes), each leaf's row range and its
+    bounding box. A query measures the distance from the query to all leaf boxes at once,
+    scans leaves nearest-box-first a block at a time and stops as soon as the next box is
+    farther than the current k-th neighbour, so results are exact but only a handful of
+    leaves are read. The arrays are np.load(mmap_mode='r'): workers share the page cache.
+    """
+    PAYLOAD = (list(SCALER_FEATURES) + ['performance_level', 'next_level_change']
+               + [f"delta_{name}" for name in SCALER_FEATURES])
+    ARRAYS = ('points', 'payload', 'leaf_bounds', 'leaf_lower', 'leaf_upper')
+
+    def __init__(self, path, meta, arrays):
+        self.path = path
+        self.meta = meta
+        self.mean = np.asarray(meta['scaler_mean'], dtype=np.float32)
+        self.scale = np.asarray(meta['scaler_scale'], dtype=np.float32)
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.column = {name: i for i, name in enumerate(meta['payload'])}
+
+    def __len__(self):
+        return len(self.points)
+
+    @staticmethod
+    def leaf_order(points, leaf_size):
+        """Row permutation and [start, end) leaf bounds of a median-split kd-tree"""
+        order = np.arange(len(points))
+        stack, leaves = [(0, len(points))], []
+        while stack:
+            start, end = stack.pop()
+            if end == start:
+                continue
+            block = points[order[start:end]]
+            spread = block.max(axis=0) - block.min(axis=0)
+            if end - start <= leaf_size or spread.max() == 0:
+                leaves.append((start, end))  # small enough, or all rows identical
+                continue
+            middle = (end - start) // 2
+            split = np.argpartition(block[:, np.argmax(spread)], middle)
+            order[start:end] = order[start:end][split]
+            stack.append((start + middle, end))
+            stack.append((start, start + middle))
+        return order, np.array(sorted(leaves), dtype=np.int64).reshape(-1, 2)
+
+    @classmethod
+    def build(cls, directory, features, payload, mean, scale, leaf_size=512, source=None):
+        """Write a new build under directory, point current.json at it and return it loaded"""
+        features = np.asarray(features, dtype=np.float32)
+        points = (features - np.asarray(mean, dtype=np.float32)) / np.asarray(scale, dtype=np.float32)
+        order, leaf_bounds = cls.leaf_order(points, leaf_size)
+        points = np.ascontiguousarray(points[order])
+        starts = leaf_bounds[:, 0]
+        arrays = {
+            'points': points,
+            'payload': np.ascontiguousarray(np.asarray(payload, dtype=np.float32)[order]),
+            'leaf_bounds': leaf_bounds,
+            'leaf_lower': np.minimum.reduceat(points, starts, axis=0) if len(points) else points,
+            'leaf_upper': np.maximum.reduceat(points, starts, axis=0) if len(points) else points
+        }
+        build_name = f"build-{time.time_ns()}"
+        build_path = os.path.join(directory, build_name)
+        os.makedirs(build_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(build_path, f"{name}.npy"), array)
+        meta = {
+            'build': build_name,
+            'rows': int(len(points)),
+            'leaves': int(len(leaf_bounds)),
+            'leaf_size': leaf_size,
+            'payload': cls.PAYLOAD,
+            'scaler_mean': np.asarray(mean, dtype=np.float64).tolist(),
+            'scaler_scale': np.asarray(scale, dtype=np.float64).tolist(),
+            'source': source,
+            'built_at': datetime.now().isoformat()
+        }
+        previous = cls.read_meta(directory)
+        current_path = os.path.join(directory, 'current.json')
+        with open(f"{current_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{current_path}.tmp", current_path)
+        if previous and previous['build'] != build_name:
+            # Workers that still map the old arrays keep reading them until they reload
+            shutil.rmtree(os.path.join(directory, previous['build']), ignore_errors=True)
+        return cls(build_path, meta, arrays)
+
+    @staticmethod
+    def read_meta(directory):
+        try:
+            with open(os.path.join(directory, 'current.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def load(cls, directory):
+        """Memory-map the current build, or None if there is none (or it was just replaced)"""
+        meta = cls.read_meta(directory)
+        if meta is None:
+            return None
+        build_path = os.path.join(directory, meta['build'])
+        try:
+            arrays = {name: np.load(os.path.join(build_path, f"{name}.npy"), mmap_mode='r') for name in cls.ARRAYS}
+        except OSError:
+            return None
+        return cls(build_path, meta, arrays)
+
+    def query(self, features, k=50, leaves_per_block=8):
+        """(row numbers, Euclidean distances in scaled space) of the k nearest profiles, nearest first"""
+        query = (np.asarray(features, dtype=np.float32).ravel() - self.mean) / self.scale
+        gap = np.maximum(self.leaf_lower - query, 0) + np.maximum(query - self.leaf_upper, 0)
+        box_distances = np.einsum('ij,ij->i', gap, gap)
+        visit = np.argsort(box_distances, kind='stable')
+        best_rows = np.empty(0, dtype=np.int64)
+        best_distances = np.empty(0, dtype=np.float32)
+        k = min(k, len(self.points))
+        for position in range(0, len(visit), leaves_per_block):
+            leaves = visit[position:position + leaves_per_block]
+            if len(best_rows) == k:
+                leaves = leaves[box_distances[leaves] <= best_distances[-1]]
+                if not len(leaves):
+                    break  # boxes are visited nearest-first, so no later leaf can do better
+            rows = np.concatenate([np.arange(start, end) for start, end in self.leaf_bounds[leaves]])
+            difference = self.points[rows] - query
+            distances = np.einsum('ij,ij->i', difference, difference)
+            rows = np.concatenate([best_rows, rows])
+            distances = np.concatenate([best_distances, distances])
+            if len(rows) > k:
+                keep = np.argpartition(distances, k - 1)[:k]
+                rows, distances = rows[keep], distances[keep]
+            ordered = np.argsort(distances, kind='stable')
+            best_rows, best_distances = rows[ordered], distances[ordered]
+        return best_rows, np.sqrt(best_distances)
+
+    def outcomes(self, rows, epsilon=0.05):
+        """What the given peers changed in their next term, split by whether they improved
+
+        A peer improved when their CGPA rose by more than epsilon or their class level went
+        up. Returns counts and, per PEER_ACTIONS feature, the mean change of improvers and
+        of the rest.
+        """
+        payload = np.asarray(self.payload[np.sort(rows)], dtype=np.float64)
+        improved = ((payload[:, self.column['delta_total_cgpa']] > epsilon)
+                    | (payload[:, self.column['next_level_change']] > 0))
+        summary = {
+            'peers': int(len(rows)),
+            'improved': int(improved.sum()),
+            'improved_cgpa_change': (round(float(payload[improved, self.column['delta_total_cgpa']].mean()), 2)
+                                     if improved.any() else None),
+            'changes': {}
+        }
+        for feature, *_ in PEER_ACTIONS:
+            delta = payload[:, self.column[f"delta_{feature}"]]
+            summary['changes'][feature] = {
+                'improved': round(float(delta[improved].mean()), 2) if improved.any() else None,
+                'others': round(float(delta[~improved].mean()), 2) if (~improved).any() else None
             }
-            backlogs = backlogs_map[request.form['backlogs']]
+        return summary
+
+def history_peer_rows(store):
+    """(features, payload) for every history row that has a later term of the same student"""
+    conn = store._connect()
+    try:
+        records = conn.execute(
+            f"SELECT student_id, {', '.join(SCALER_FEATURES)}, performance_level "
+            f"FROM student_history ORDER BY student_id, term_order"
+        ).fetchall()
+    finally:
+        conn.close()
+    if not records:
+        return np.zeros((0, len(SCALER_FEATURES))), np.zeros((0, len(PeerIndex.PAYLOAD)))
+    ids = np.array([record[0] for record in records], dtype=object)
+    values = np.array([record[1:] for record in records], dtype=np.float64)
+    features, levels = values[:, :-1], values[:, -1:]
+    has_next = np.flatnonzero(ids[:-1] == ids[1:])
+    payload = np.hstack([
+        features[has_next], levels[has_next],
+        levels[has_next + 1] - levels[has_next],
+        features[has_next + 1] - features[has_next]
+    ])
+    return features[has_next], payload
+
+class PeerNeighbors:
+    """The current PeerIndex of a directory, re-mapped when a rebuild replaces current.json"""
+    def __init__(self, directory, leaf_size=512):
+        self.directory = directory
+        self.leaf_size = leaf_size
+        self._index = None
+        self._mtime = None
+
+    def index(self):
+        try:
+            mtime = os.stat(os.path.join(self.directory, 'current.json')).st_mtime_ns
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            index = PeerIndex.load(self.directory)
+            if index is not None:
+                self._index, self._mtime = index, mtime
+        return self._index
+
+    def rebuild_from_history(self, store):
+        features, payload = history_peer_rows(store)
+        os.makedirs(self.directory, exist_ok=True)
+        index = PeerIndex.build(self.directory, features, payload, scaler.mean_, scaler.scale_,
+                                leaf_size=self.leaf_size, source='history')
+        self._index, self._mtime = index, os.stat(os.path.join(self.directory, 'current.json')).st_mtime_ns
+        return index
+
+    def similar(self, features, k=None):
+        """Next-term outcomes of the k students most like this raw feature row, or None"""
+        index = self.index()
+        if index is None or len(index) < PEER_MIN_NEIGHBORS:
+            return None
+        rows, distances = index.query(features, k or PEER_NEIGHBORS)
+        summary = index.outcomes(rows, HISTORY_TREND_EPSILON)
+        summary['max_distance'] = round(float(distances[-1]), 3)
+        return summary
+
+peer_neighbors = PeerNeighbors(PEER_INDEX_DIR, leaf_size=PEER_LEAF_SIZE)
+peer_neighbors.index()  # map an existing build at startup
+
+@app.route('/peers', methods=['GET'])
+def my_peers():
+    """What the students most similar to the session's student changed, and how it went"""
+    student = session_profile()
+    if student is None:
+        return jsonify({'success': False, 'message': 'Analyze your performance first.'})
+    peers = peer_neighbors.similar(student.to_row())
+    if peers is None:
+        return jsonify({'success': False, 'message': 'No peer index is available yet.'})
+    return jsonify({'success': True, 'peers': peers})
+
+@app.route('/admin/peers', methods=['GET', 'POST'])
+@admin_required
+def admin_peers():
+    """GET: current build; POST {"rebuild": "history"}: rebuild from student history"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if data.get('rebuild') != 'history':
+            return jsonify({'success': False, 'message': 'Send {"rebuild": "history"}'}), 400
+        started = time.perf_counter()
+        index = peer_neighbors.rebuild_from_history(student_history)
+        return jsonify({'success': True, 'rows': len(index), 'seconds': round(time.perf_counter() - started, 3)})
+    index = peer_neighbors.index()
+    meta = {key: value for key, value in index.meta.items() if not key.startswith('scaler_')} if index else None
+    return jsonify({'success': True, 'index': meta})
+
+@app.route('/app', methods=['GET', 'POST'])
+def main_app():   
+    prediction_text = None
+    error_text = None
+    confidence_score = None
+    probabilities = None
 
-            # Competitions / Projects - "More than 2" treated as "Yes"
-            competitions_value = request.form['competitions']
-            competitions = 1 if competitions_value in ["Yes", "More than 2"] else 0
-            
-            projects_value = request.form['projects_internships']
-            projects_internships = 1 if projects_value in ["Yes", "More than 2"] else 0
-
-            # Confidence level (NOW INCLUDED in scaling)
-            confidence_level = int(request.form['confidence_level'])
-            if not (1 <= confidence_level <= 10):
-                raise ValueError("Confidence level must be between 1 and 10")
-
-            # --- FIX: Prepare input with ALL 8 features for NEW scaler ---
-            input_data = np.array([[
-                total_cgpa,          # Feature 1
-                attendance,          # Feature 2  
-                study_hours,         # Feature 3
-                backlogs,            # Feature 4
-                competitions,        # Feature 5
-                projects_internships, # Feature 6
-                prevsem_cgpa,        # Feature 7
-                confidence_level     # Feature 8 (NOW INCLUDED)
-            ]])
+    if request.method == 'POST':
+        try:
+            # --- Parse, validate and encode ALL 8 features in one pass ---
+            with request_stage('encode'):
+                input_data = feature_schema.encode(request.form)
+                profile = StudentProfile.from_row(input_data[0])
+                history_key = None
+                if request.form.get('student_id', '').strip():
+                    if not is_admin_request():
+                        raise FeatureValidationError([HISTORY_ADMIN_ONLY_MESSAGE])
+                    history_key = parse_student_term(request.form.get('student_id'), request.form.get('term'))
             
             print(f"DEBUG: Input shape: {input_data.shape}")
             print(f"DEBUG: Features: {SCALER_FEATURES}")
             print(f"DEBUG: Input values: {input_data[0]}")
             
-            # --- Scale ALL 8 features ---
-            scaled_features = scaler.transform(input_data)
-            print(f"DEBUG: Scaled shape: {scaled_features.shape}")
-            print(f"DEBUG: Scaled values: {scaled_features[0]}")
-            
-            # --- Make prediction ---
-            prediction_probs = dnn_model.predict(scaled_features)
-            pred_class_idx = np.argmax(prediction_probs, axis=1)[0]
-            predicted_class = label_encoder.inverse_transform([pred_class_idx])[0]
+            # --- Scale ALL 8 features and make prediction ---
+            predict_started = time.perf_counter()
+            prediction_probs = predict_probabilities(input_data)
+            predict_ms = (time.perf_counter() - predict_started) * 1000
             confidence = np.max(prediction_probs)
             
             # Get all probabilities
@@ -603,33 +3573,31 @@ def main_app():
                 for i in range(len(CLASS_LABELS))
             }
             
-            # --- Apply Excellent/Good fix ---
-            features_dict = {
-                'total_cgpa': total_cgpa,
-                'attendance': attendance,
-                'backlogs': backlogs
-            }
-            
-            final_prediction = fix_excellent_good_confusion(
-                predicted_class, confidence, features_dict, 
-                {k: v/100 for k, v in probabilities.items()}  # Convert back to 0-1 scale
-            )
+            # --- Apply Excellent/Good correction rules ---
+            with request_stage('correct'):
+                final_classes, applied_rules = correction_stage.apply(prediction_probs, input_data)
+            final_prediction = CLASS_LABELS[final_classes[0]]
+            with request_stage('record'):
+                prediction_log.record(input_data, prediction_probs, final_classes, applied_rules, source='app')
+                cohort_stats.update(final_classes, input_data)
+                drift_monitor.update(final_classes, input_data)
+                if history_key:
+                    student_history.record([history_key], input_data, prediction_probs, final_classes)
+                shadow_evaluator.offer(input_data, prediction_probs, final_classes, predict_ms)
             
             confidence_score = confidence * 100
             prediction_text = f"Predicted Performance: {final_prediction}"
 
             # Store student data
-            session['student_data'] = {
-                'total_cgpa': total_cgpa,
-                'attendance': attendance,
-                'study_hours': study_hours,
-                'backlogs': backlogs,
-                'competitions': competitions,
-                'projects_internships': projects_internships,
-                'prevsem_cgpa': prevsem_cgpa,
-                'confidence_level': confidence_level,
-                'predicted_class': final_prediction
-            }
+            profile.predicted_class = final_prediction
+            session['student_data'] = profile.to_session()
+            session['class_probabilities'] = np.round(prediction_probs[0].astype(np.float64), 6).tolist()
+            if history_key:
+                session['student_id'] = history_key[0]
+                session['student_term'] = history_key[2]
+            else:
+                session.pop('student_id', None)
+                session.pop('student_term', None)
 
         except Exception as e:
             error_text = f"❌ Error: {str(e)}"
@@ -643,6 +3611,302 @@ def main_app():
         probabilities=probabilities
     )
 
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """Score many students in a single forward pass (JSON rows/objects or CSV text)"""
+    try:
+        payload = request.json or {}
+        if payload.get('csv'):
+            records = list(csv.DictReader(io.StringIO(payload['csv'])))
+        else:
+            records = payload.get('rows', [])
+        input_data, valid_mask, errors = feature_schema.encode_many(records)
+
+        # Rows with student_id + term also go into the student history (admin callers only)
+        history_keys, admin = {}, is_admin_request()
+        for row_index, record in enumerate(records):
+            if isinstance(record, dict) and str(record.get('student_id') or '').strip():
+                try:
+                    if not admin:
+                        raise FeatureValidationError([HISTORY_ADMIN_ONLY_MESSAGE])
+                    history_keys[row_index] = parse_student_term(record.get('student_id'), record.get('term'))
+                except FeatureValidationError as e:
+                    errors.setdefault(row_index, []).extend(e.errors)
+                    valid_mask[row_index] = False
+
+        if not len(input_data):
+            return jsonify({
+                'success': False,
+                'message': f'Please provide rows (lists or objects) or csv with features: {SCALER_FEATURES}'
+            })
+
+        valid_rows = np.flatnonzero(valid_mask)
+        predictions = []
+        if len(valid_rows):
+            valid_data = input_data[valid_rows]
+            prediction_probs = predict_probabilities(valid_data)
+            final_classes, applied_rules = correction_stage.apply(prediction_probs, valid_data)
+            prediction_log.record(valid_data, prediction_probs, final_classes, applied_rules, source='batch')
+            keyed = [position for position, row_index in enumerate(valid_rows) if row_index in history_keys]
+            if keyed:
+                student_history.record(
+                    [history_keys[valid_rows[position]] for position in keyed],
+                    valid_data[keyed], prediction_probs[keyed], final_classes[keyed]
+                )
+            confidences = np.max(prediction_probs, axis=1)
+
+            for row_index, probs, final_idx, confidence in zip(valid_rows, prediction_probs, final_classes, confidences):
+                predictions.append({
+                    'row': int(row_index),
+                    'predicted_class': CLASS_LABELS[final_idx],
+                    'confidence': float(confidence) * 100,
+                    'probabilities': {CLASS_LABELS[i]: float(probs[i]) * 100 for i in range(len(CLASS_LABELS))}
+                })
+
+        return jsonify({
+            'success': True,
+            'backend': INFERENCE_BACKEND,
+            'predictions': predictions,
+            'errors': {str(row_index): row_errors for row_index, row_errors in errors.items()}
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error scoring batch: {str(e)}'
+        })
+
+# ==================== FEATURE ATTRIBUTION ====================
+class FeatureAttributionExplainer:
+    """Batched occlusion attributions for the DNN output over the 8 SCALER_FEATURES
+
+    Each feature is replaced in turn by the baseline (the scaler's training mean); its
+    attribution is how much the explained class probability drops without it. A student
+    costs 9 rows, and a whole cohort goes through the model in a single predict call.
+    """
+    def __init__(self, baseline):
+        self.baseline = np.asarray(baseline, dtype=np.float32)
+        self.n_features = len(self.baseline)
+
+    def build_occlusion_batch(self, input_data):
+        """(n, 8) rows -> (n * 9, 8): each original row followed by its 8 occluded copies"""
+        n_rows = len(input_data)
+        batch = np.repeat(input_data[:, None, :], self.n_features + 1, axis=1)
+        features = np.arange(self.n_features)
+        batch[:, features + 1, features] = self.baseline
+        return batch.reshape(n_rows * (self.n_features + 1), self.n_features)
+
+    def explain(self, input_data, target_classes=None):
+        """Return (attributions (n, 8), probabilities (n, classes), explained class indices)"""
+        input_data = np.asarray(input_data, dtype=np.float32)
+        n_rows = len(input_data)
+        prediction_probs = predict_probabilities(self.build_occlusion_batch(input_data))
+        prediction_probs = prediction_probs.reshape(n_rows, self.n_features + 1, -1)
+
+        if target_classes is None:
+            target_classes = np.argmax(prediction_probs[:, 0], axis=1)
+        target_probs = prediction_probs[np.arange(n_rows), :, target_classes]  # (n, 9)
+        attributions = target_probs[:, :1] - target_probs[:, 1:]
+        return attributions, prediction_probs[:, 0], target_classes
+
+    def explain_one(self, input_data):
+        """{feature: attribution} for a single (1, 8) row, most influential first"""
+        attributions, _, _ = self.explain(input_data)
+        order = np.argsort(-np.abs(attributions[0]))
+        return {SCALER_FEATURES[i]: float(attributions[0, i]) for i in order}
+
+ADVICE_USE_ATTRIBUTIONS = os.environ.get('ADVICE_USE_ATTRIBUTIONS', 'true').lower() == 'true'
+attribution_explainer = FeatureAttributionExplainer(scaler.mean_)
+
+@app.route('/explain', methods=['POST'])
+def explain():
+    """Per-feature attributions: {profile} (defaults to the analysed student) or {profiles: [...]}"""
+    try:
+        payload = request.json or {}
+        if payload.get('profiles'):
+            input_data, valid_mask, errors = feature_schema.encode_many(payload['profiles'])
+            valid_rows = np.flatnonzero(valid_mask)
+            explanations = []
+            if len(valid_rows):
+                attributions, _, target_classes = attribution_explainer.explain(input_data[valid_rows])
+                for row_index, row_attributions, target_class in zip(valid_rows, attributions, target_classes):
+                    explanations.append({
+                        'row': int(row_index),
+                        'explained_class': CLASS_LABELS[target_class],
+                        'attributions': dict(zip(SCALER_FEATURES, row_attributions.tolist()))
+                    })
+            return jsonify({
+                'success': True,
+                'explanations': explanations,
+                'errors': {str(row_index): row_errors for row_index, row_errors in errors.items()}
+            })
+
+        profile = payload.get('profile') or session_profile()
+        if not profile:
+            return jsonify({
+                'success': False,
+                'message': 'Please analyze your performance first or send a profile.'
+            })
+        attributions, prediction_probs, target_classes = attribution_explainer.explain(feature_schema.encode(profile))
+        order = np.argsort(-np.abs(attributions[0]))
+        return jsonify({
+            'success': True,
+            'explained_class': CLASS_LABELS[target_classes[0]],
+            'probability': float(prediction_probs[0, target_classes[0]]) * 100,
+            'attributions': [
+                {'feature': SCALER_FEATURES[i], 'attribution': float(attributions[0, i]) * 100}
+                for i in order
+            ]
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error explaining prediction: {str(e)}'
+        })
+
+# ==================== WHAT-IF SIMULATION ====================
+WHATIF_MAX_GRID = int(os.environ.get('WHATIF_MAX_GRID', 100000))
+
+class WhatIfSimulator:
+    """Score a whole grid of feature changes in one forward pass and rank the smallest wins"""
+    def __init__(self, schema, advisor):
+        self.schema = schema
+        self.advisor = advisor
+        self.fields = {field[0]: field for field in schema.fields}
+
+    def _default_ranges(self, base_row):
+        """Attendance up to 100%, every study-hours bucket, backlogs down to 0"""
+        attendance = base_row[SCALER_FEATURES.index('attendance')]
+        backlogs = base_row[SCALER_FEATURES.index('backlogs')]
+        return {
+            'attendance': {'min': float(attendance), 'max': 100, 'step': 5},
+            'study_hours': [5, 15, 25, 35],
+            'backlogs': [b for b in (0, 1, 2, 3, 4, 6) if b <= backlogs]
+        }
+
+    def _candidate_values(self, feature, spec):
+        """Validate and encode one feature's range ({min, max, step} or a list of values)"""
+        if feature not in self.fields:
+            raise ValueError(f"Unknown feature '{feature}', expected one of {SCALER_FEATURES}")
+        _, kind, field_spec, label, message = self.fields[feature]
+
+        if isinstance(spec, dict):
+            if kind == 'choice':
+                raise ValueError(f"{label} takes a list of options, not a min/max range")
+            low, high = float(spec['min']), float(spec['max'])
+            step = float(spec.get('step', 1))
+            if step <= 0 or high < low:
+                raise ValueError(f"{label} range needs min <= max and a positive step")
+            if kind == 'int_range' and not step.is_integer():
+                raise ValueError(f"{label} range needs a whole-number step")
+            # max is always tried, even when (max - min) is not a multiple of step
+            values = np.arange(low, high, step)
+            values = np.append(values[values < high - step * 1e-9], high)
+        else:
+            values = spec if isinstance(spec, list) else [spec]
+
+        encoded = []
+        for value in values:
+            if kind == 'choice':
+                value = field_spec.get(value.strip() if isinstance(value, str) else value)
+                if value is None:
+                    raise ValueError(message)
+            else:
+                value = float(value)
+                if not (field_spec[0] <= value <= field_spec[1]):
+                    raise ValueError(message)
+                if kind == 'int_range' and not value.is_integer():
+                    raise ValueError(f"{label} must be a whole number")
+            encoded.append(value)
+        return np.unique(np.asarray(encoded, dtype=np.float32))
+
+    def build_grid(self, base_row, ranges):
+        """Cartesian product of all ranges over the base profile, base profile as row 0"""
+        columns = [SCALER_FEATURES.index(feature) for feature in ranges]
+        axes = [self._candidate_values(feature, spec) for feature, spec in ranges.items()]
+        grid_size = int(np.prod([len(axis) for axis in axes])) if axes else 0
+        if grid_size > WHATIF_MAX_GRID:
+            raise ValueError(f"Scenario grid has {grid_size} rows, the limit is {WHATIF_MAX_GRID}")
+
+        grid = np.empty((grid_size + 1, len(SCALER_FEATURES)), dtype=np.float32)
+        grid[:] = base_row
+        if axes:
+            mesh = np.meshgrid(*axes, indexing='ij')
+            for column, values in zip(columns, mesh):
+                grid[1:, column] = values.ravel()
+        return grid
+
+    def simulate(self, profile, ranges=None, top_k=5):
+        """Find the smallest feature changes that move the student up one performance level"""
+        if isinstance(top_k, bool) or not isinstance(top_k, (int, str)) or not str(top_k).strip().isdigit() \
+                or int(top_k) < 1:
+            raise ValueError("top_k must be a positive integer")
+        top_k = int(top_k)
+        base_row = self.schema.encode(profile)[0]
+        grid = self.build_grid(base_row, ranges or self._default_ranges(base_row))
+
+        prediction_probs = predict_probabilities(grid)
+        final_classes, _ = correction_stage.apply(prediction_probs, grid)
+
+        current_class = CLASS_LABELS[final_classes[0]]
+        target_class = self.advisor._get_target_performance(current_class)
+        result = {
+            'current_class': current_class,
+            'target_class': target_class,
+            'grid_size': len(grid) - 1,
+            'scenarios': []
+        }
+        if target_class not in self.advisor.PERFORMANCE_LEVELS:
+            return result  # already Excellent
+
+        # Rank by how far each scenario is from the base profile in scaler standard deviations
+        level_of_class = np.array([self.advisor.PERFORMANCE_LEVELS.index(label) for label in CLASS_LABELS])
+        reached = level_of_class[final_classes] >= self.advisor.PERFORMANCE_LEVELS.index(target_class)
+        reached[0] = False
+        deltas = grid - base_row
+        n_changed = np.count_nonzero(deltas, axis=1)
+        distance = np.abs(deltas / scaler.scale_).sum(axis=1)
+
+        candidates = np.flatnonzero(reached)
+        order = candidates[np.lexsort((distance[candidates], n_changed[candidates]))][:top_k]
+        target_column = CLASS_LABELS.index(target_class)
+        for row in order:
+            changed = np.flatnonzero(deltas[row])
+            result['scenarios'].append({
+                'changes': {
+                    SCALER_FEATURES[c]: {'from': base_row[c].item(), 'to': grid[row, c].item()}
+                    for c in changed
+                },
+                'predicted_class': CLASS_LABELS[final_classes[row]],
+                'target_probability': float(prediction_probs[row, target_column]) * 100,
+                'distance': float(distance[row])
+            })
+        return result
+
+what_if_simulator = WhatIfSimulator(feature_schema, advisor_model)
+
+@app.route('/what_if', methods=['POST'])
+def what_if():
+    """What-if scenarios: {profile (defaults to the analysed student), ranges, top_k}"""
+    try:
+        payload = request.json or {}
+        profile = payload.get('profile') or session_profile()
+        if not profile:
+            return jsonify({
+                'success': False,
+                'message': 'Please analyze your performance first or send a profile.'
+            })
+
+        result = what_if_simulator.simulate(profile, payload.get('ranges'), payload.get('top_k', 5))
+        return jsonify(dict(success=True, **result))
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error running what-if scenarios: {str(e)}'
+        })
+
 @app.route('/')
 def home():
     return render_template('home.html')  # Show landing page first
@@ -653,7 +3917,7 @@ def home():
 def get_suggestions():
     """Get personalized suggestions - SIMPLE VERSION"""
     try:
-        student_data = session.get('student_data')
+        student_data = session_profile()
         
         # ========== ADD DEBUG LOGGING HERE ==========
         print(f"🔍 DEBUG: Session keys: {list(session.keys())}")
@@ -668,13 +3932,23 @@ def get_suggestions():
             })
         
         # Generate personalized advice using the advisor model
-        predicted_class = student_data.get('predicted_class', 'Average')
+        predicted_class = student_data.predicted_class or 'Average'
         print(f"🔍 DEBUG: Generating advice for class: {predicted_class}")
         print(f"🔍 DEBUG: Student data details:")
-        for key, value in student_data.items():
+        for key, value in student_data.to_dict().items():
             print(f"  - {key}: {value}")
         
-        advice = advisor_model.generate_advice(student_data, predicted_class)
+        attributions = None
+        if ADVICE_USE_ATTRIBUTIONS:
+            with request_stage('attributions'):
+                attributions = attribution_explainer.explain_one(student_data.to_row())
+
+        trend = student_history.trend(session['student_id']) if session.get('student_id') else None
+        ranking = session_ranking(student_data)
+        with request_stage('peers'):
+            peers = peer_neighbors.similar(student_data.to_row())
+        with request_stage('advice'):
+            advice = advisor_model.generate_advice(student_data, predicted_class, attributions, trend, ranking, peers)
         print(f"🔍 DEBUG: Advice generated successfully, length: {len(advice)}")
         
         return jsonify({
@@ -879,7 +4153,7 @@ def get_help_categories():
 
 @app.route('/search_help', methods=['POST'])
 def search_help():
-    """Search the knowledge base for help topics"""
+    """Search the knowledge base for help topics (mode: keyword or semantic)"""
     try:
         query = request.json.get('query', '')
         if not query:
@@ -888,7 +4162,10 @@ def search_help():
                 'message': 'Please provide a search query'
             })
         
-        results = help_system.search_knowledge(query)
+        if request.json.get('mode', 'keyword') == 'semantic':
+            results = semantic_index.search(query, k=int(request.json.get('k', 5)), source='help')
+        else:
+            results = help_system.search_knowledge(query)
         return jsonify({
             'success': True,
             'results': results
@@ -900,12 +4177,236 @@ def search_help():
             'message': f'Error searching help: {str(e)}'
         })
 
+# ==================== MESSAGE NORMALIZATION ====================
+# ASCII punctuation separates tokens; apostrophes are dropped so "what's" -> "whats"
+CHAT_PUNCTUATION_TABLE = str.maketrans({
+    **dict.fromkeys(string.punctuation.replace("'", ''), ' '),
+    "'": None, '’': None, '‘': None
+})
+UNKNOWN_TOKEN_ID = -1
+
+class NormalizedMessage:
+    """A chat message tokenized once: canonical tokens, their vocabulary ids and the joined text"""
+    __slots__ = ('tokens', 'ids', 'text')
+
+    def __init__(self, tokens, ids):
+        self.tokens = tokens
+        self.ids = ids
+        self.text = ' '.join(tokens)
+
+class MessageNormalizer:
+    """Case-folds, strips punctuation/emoji and maps each token to an interned vocabulary id
+
+    The vocabulary is every token of the bot's keywords. A token outside it is retried
+    with elongations collapsed ("helloooo" -> "hello") and common suffixes removed
+    ("exams" -> "exam", "motivated" -> "motivate") before it is given UNKNOWN_TOKEN_ID.
+    """
+    SUFFIXES = ('ing', 'ers', 'ed', 'es', 'er', 'ly', 's')
+
+    def __init__(self, phrases, cache_size=8192):
+        self.token_ids = {}
+        for phrase in phrases:
+            for token in self.tokenize(phrase):
+                self.token_ids.setdefault(sys.intern(token), len(self.token_ids))
+        self._resolve = functools.lru_cache(maxsize=cache_size)(self._resolve_token)
+
+    @staticmethod
+    def tokenize(text):
+        """Case-folded word tokens without punctuation, symbols or emoji"""
+        text = text.casefold().translate(CHAT_PUNCTUATION_TABLE)
+        if not text.isascii():
+            text = ''.join(ch if ch.isalnum() else ' ' for ch in text)
+        return text.split()
+
+    @staticmethod
+    def _collapse_runs(token, keep):
+        """Shorten letter runs of 3+ ("oooo") to `keep` characters"""
+        return ''.join(
+            ch * (keep if run >= 3 and ch.isalpha() else run)
+            for ch, run in ((ch, len(list(group))) for ch, group in itertools.groupby(token))
+        )
+
+    def _resolve_token(self, token):
+        """(canonical token, id) for one raw token"""
+        if token in self.token_ids:
+            return token, self.token_ids[token]
+        candidates = [token]
+        if any(token[i] == token[i + 1] == token[i + 2] for i in range(len(token) - 2)):
+            candidates = [self._collapse_runs(token, 1), self._collapse_runs(token, 2)]
+        for candidate in candidates:
+            for form in self._stem_forms(candidate):
+                if form in self.token_ids:
+                    return form, self.token_ids[form]
+        return sys.intern(candidates[-1]), UNKNOWN_TOKEN_ID
+
+    def _stem_forms(self, token):
+        yield token
+        for suffix in self.SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+                stem = token[:-len(suffix)]
+                yield stem
+                yield stem + 'e'
+                if stem[-1] == stem[-2]:
+                    yield stem[:-1]  # "planning" -> "plan"
+
+    def normalize(self, message):
+        """Tokenize a raw message once for every matcher"""
+        resolved = [self._resolve(token) for token in self.tokenize(message)]
+        return NormalizedMessage([token for token, _ in resolved], tuple(token_id for _, token_id in resolved))
+
+class PhraseMatcher:
+    """Finds the first-listed label with a phrase occurring as a run of token ids in a message"""
+    def __init__(self, labelled_phrases, normalizer):
+        self.labels = []
+        self.by_first_id = {}   # first token id -> [(phrase ids, label rank)]
+        for rank, (label, phrases) in enumerate(labelled_phrases):
+            self.labels.append(label)
+            for phrase in phrases:
+                ids = tuple(normalizer.token_ids[token] for token in normalizer.tokenize(phrase))
+                if ids:
+                    self.by_first_id.setdefault(ids[0], []).append((ids, rank))
+
+    def match(self, ids):
+        """Label of the lowest-ranked phrase found in ids, or None"""
+        best = len(self.labels)
+        for start, token_id in enumerate(ids):
+            for phrase, rank in self.by_first_id.get(token_id, ()):
+                if rank < best and ids[start:start + len(phrase)] == phrase:
+                    best = rank
+        return self.labels[best] if best < len(self.labels) else None
+
+# ==================== FUZZY KEYWORD INDEX ====================
+CHAT_FUZZY_THRESHOLD = float(os.environ.get('CHAT_FUZZY_THRESHOLD', 0.75))
+
+def restricted_edit_distance(a, b, max_distance):
+    """Optimal string alignment distance (insert, delete, substitute, adjacent transpose)
+
+    Gives up early and returns max_distance + 1 once every alignment exceeds max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[len(b)]
+
+class FuzzyKeywordIndex:
+    """Padded character-bigram index resolving misspelled/partial keywords to intents
+
+    Built once at startup. A query window only looks at keywords with the same word
+    count that share bigrams with it, scores the few best by Dice overlap or edit
+    similarity (whichever is higher) and accepts the best score >= threshold.
+    """
+    def __init__(self, keywords_by_intent, threshold=0.75, min_length=3, max_candidates=8):
+        self.threshold = threshold
+        self.min_length = min_length
+        self.max_candidates = max_candidates
+        self.terms = []       # (keyword, intent, bigram count)
+        self.postings = {}    # word count -> {bigram: [term ids]}
+        for intent, keywords in keywords_by_intent.items():
+            for keyword in keywords:
+                keyword = ' '.join(MessageNormalizer.tokenize(keyword))
+                if len(keyword) < min_length:
+                    continue  # "hi", "r u": exact matching only
+                grams = self._bigrams(keyword)
+                term_id = len(self.terms)
+                self.terms.append((keyword, intent, len(grams)))
+                postings = self.postings.setdefault(keyword.count(' ') + 1, {})
+                for gram in grams:
+                    postings.setdefault(gram, []).append(term_id)
+
+    @staticmethod
+    def _bigrams(text):
+        padded = f"^{text}$"
+        return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+    def lookup(self, text, word_count=1):
+        """Best (score, term id) for one word/phrase, or (0.0, None)"""
+        postings = self.postings.get(word_count)
+        if not postings or len(text) < self.min_length:
+            return 0.0, None
+        grams = self._bigrams(text)
+        shared = {}
+        for gram in grams:
+            for term_id in postings.get(gram, ()):
+                shared[term_id] = shared.get(term_id, 0) + 1
+
+        best_score, best_term = 0.0, None
+        candidates = heapq.nsmallest(self.max_candidates, shared.items(), key=lambda item: (-item[1], item[0]))
+        for term_id, n_shared in candidates:
+            keyword, _, n_grams = self.terms[term_id]
+            score = 2.0 * n_shared / (len(grams) + n_grams)
+            if score < self.threshold:
+                # Only edits that could still reach the threshold are worth computing; each
+                # edit disturbs at most 3 bigrams, which rules most candidates out cheaply
+                longest = max(len(text), len(keyword))
+                max_distance = int((1.0 - self.threshold) * longest + 1e-9)
+                if max_distance and n_shared >= max(len(grams), n_grams) - 3 * max_distance:
+                    distance = restricted_edit_distance(text, keyword, max_distance)
+                    if distance <= max_distance:
+                        score = max(score, 1.0 - distance / longest)
+            if score > best_score:
+                best_score, best_term = score, term_id
+        return best_score, best_term
+
+    def match(self, tokens):
+        """(intent, keyword, score) for the best-matching window of a token list, or None"""
+        best_score, best_term = 0.0, None
+        for word_count in self.postings:
+            for start in range(len(tokens) - word_count + 1):
+                score, term_id = self.lookup(' '.join(tokens[start:start + word_count]), word_count)
+                if score > best_score or (score == best_score and term_id is not None and term_id < best_term):
+                    best_score, best_term = score, term_id
+        if best_term is None or best_score < self.threshold:
+            return None
+        keyword, intent, _ = self.terms[best_term]
+        return intent, keyword, best_score
+
 # ==================== GENERAL ACADEMIC ADVISOR BOT ====================
 class AcademicAdvisorBot:
+    FOLLOW_UP_PHRASES = frozenset([
+        'more', 'tell me more', 'more please', 'more info', 'elaborate', 'explain more',
+        'go on', 'continue', 'what else', 'anything else', 'and', 'ok more', 'details', 'more details'
+    ])
+    # "tell me more about career guidance" names its topic: route what follows the lead-in,
+    # not the "about" that would otherwise match about_app
+    TOPIC_LEAD_INS = ('tell me more about', 'tell me about', 'explain more about', 'more about')
+    # Checked in order before the knowledge base; matched on whole tokens, so "hi" no
+    # longer fires inside "this" and "end" inside "attendance"
+    ROUTE_INTENTS = [
+        ('greeting', ['hello', 'hi', 'hey', 'start']),
+        ('help', ['help', 'what can you do', 'features']),
+        ('about_app', ['about', 'application', 'system', 'what is this']),
+        ('how_to_use', ['how to use', 'how does it work', 'steps', 'guide']),
+        ('input_help', ['how to fill', 'input', 'fields', 'form']),
+        ('about_developer', ['developer', 'created', 'who made', 'about us']),
+        ('farewell', ['bye', 'goodbye', 'exit', 'quit', 'end'])
+    ]
+
     def __init__(self):
         self.web_options = self._build_web_options()
         self.general_responses = self._build_general_responses()
         self.knowledge_base = self._build_knowledge_base()
+        self.follow_ups = self._build_follow_ups()
+        keywords = [(category, data['keywords']) for category, data in self.knowledge_base.items()]
+        self.normalizer = MessageNormalizer(
+            [phrase for _, phrases in self.ROUTE_INTENTS + keywords for phrase in phrases]
+            + list(self.FOLLOW_UP_PHRASES)
+        )
+        self.route_matcher = PhraseMatcher(self.ROUTE_INTENTS, self.normalizer)
+        self.keyword_matcher = PhraseMatcher(keywords, self.normalizer)
+        self.fuzzy_index = FuzzyKeywordIndex(
+            {category: data['keywords'] for category, data in self.knowledge_base.items()},
+            threshold=CHAT_FUZZY_THRESHOLD
+        )
     
     def _build_knowledge_base(self):
         """Comprehensive knowledge base for academic, career, and general student queries"""
@@ -1040,16 +4541,77 @@ class AcademicAdvisorBot:
 
     def _search_knowledge_base(self, query):
         """Search knowledge base for matching academic or general topics"""
-        query_lower = query.lower()
+        return self._match_knowledge_base(query)[1]
+
+    def _match_knowledge_base(self, query):
+        """Return (category, content) of the first knowledge base entry matching the query
+
+        query is raw text or an already NormalizedMessage.
+        """
+        normalized = query if isinstance(query, NormalizedMessage) else self.normalizer.normalize(query)
         
         # Search through all knowledge base categories
-        for category, data in self.knowledge_base.items():
-            for keyword in data['keywords']:
-                if keyword in query_lower:
-                    return data['content']
+        category = self.keyword_matcher.match(normalized.ids)
+        if category:
+            return category, self.knowledge_base[category]['content']
+        
+        # Typo-tolerant second pass ("studdy", "exma", "helo") over the precomputed index
+        fuzzy_match = self.fuzzy_index.match(normalized.tokens)
+        if fuzzy_match:
+            category = fuzzy_match[0]
+            return category, self.knowledge_base[category]['content']
+        
+        # Paraphrases ("I can't focus") through the embedding index when enabled
+        if CHAT_RETRIEVAL_MODE == 'semantic' and normalized.text:
+            semantic_results = semantic_index.search(normalized.text, k=1, source='chat', min_score=CHAT_SEMANTIC_MIN_SCORE)
+            if semantic_results:
+                category = semantic_results[0]['category_key']
+                return category, self.knowledge_base[category]['content']
         
         # Default fallback for anything else
-        return "🤖 I'm here to help with academic topics like study techniques, exam preparation, career guidance, and time management. Try asking about these or use the quick options below!"
+        return 'fallback', "🤖 I'm here to help with academic topics like study techniques, exam preparation, career guidance, and time management. Try asking about these or use the quick options below!"
+
+    def _build_follow_ups(self):
+        """Deeper StudentHelpSystem entries served, one per "tell me more", for each topic"""
+        related_help = {
+            'study_techniques': 'study_techniques',
+            'time_management': 'time_management',
+            'exam_preparation': 'exam_preparation',
+            'career_guidance': 'career_guidance',
+            'mental_health': 'mental_health',
+            'stress': 'mental_health',
+            'motivation': 'mental_health',
+            'subject_help': 'subject_specific',
+            'general_academic': 'campus_life'
+        }
+        return {
+            category: list(help_system.knowledge_base[help_category].values())
+            for category, help_category in related_help.items()
+        }
+
+    def _is_follow_up(self, normalized):
+        """True for bare continuation requests like "tell me more" or "what else?"
+
+        "tell me more about career guidance" names its own topic, so it is routed normally.
+        """
+        return normalized.text in self.FOLLOW_UP_PHRASES
+
+    def _follow_up_response(self, state):
+        """Next detail for the conversation's last topic, or None if the topic has no details
+
+        The topic comes back from the session cookie, so one renamed since it was stored
+        falls through to normal routing.
+        """
+        details = self.follow_ups.get(state.last_topic)
+        if details is None:
+            return None
+        if state.follow_up_index >= len(details):
+            state.remember('follow_up', None)
+            return "That's everything I have on this topic! 🎓 Ask me about another area or use the quick options below."
+        detail = details[state.follow_up_index]
+        state.follow_up_index += 1
+        state.remember('follow_up', state.last_topic)
+        return detail
         
     def _build_web_options(self):
         """Web options for quick selection"""
@@ -1153,9 +4715,30 @@ This AI Student Performance Predictor is designed to help students achieve acade
         ]
         return options
     
-    def get_response(self, message):
-        """Get response for user message - with knowledge base search for ANY academic questions"""
-        message_lower = message.lower().strip()
+    def get_response(self, message, state=None):
+        """Get response for user message - with knowledge base search for ANY academic questions
+
+        state (a ConversationState) lets follow-ups like "tell me more" continue the last topic.
+        """
+        normalized = self.normalizer.normalize(message)
+        if state is not None and state.last_topic and self._is_follow_up(normalized):
+            detail = self._follow_up_response(state)
+            if detail is not None:
+                return detail, self.get_web_options_buttons()
+        for lead_in in self.TOPIC_LEAD_INS:
+            if normalized.text.startswith(lead_in + ' '):
+                message = normalized.text[len(lead_in) + 1:]
+                normalized = self.normalizer.normalize(message)
+                break
+
+        intent, response, quick_actions = self._route(message, normalized)
+        if state is not None:
+            state.remember(intent, intent if intent in self.follow_ups else None)
+        return response, quick_actions
+
+    def _route(self, message, normalized):
+        """Match a message to (intent, response, quick actions)"""
+        intent = self.route_matcher.match(normalized.ids)
         
         # Handle quick action values
         if message == 'about_us':
@@ -1168,16 +4751,16 @@ Computer Science student specializing in AI & ML at RGMCET. Developed this AI Ac
 
 **Our Mission:** To provide personalized, data-driven academic guidance that empowers students to excel in their educational journey.
 """
-            return f"**👥 About Us**\n\n{content}", self.get_web_options_buttons()
+            return 'about_us', f"**👥 About Us**\n\n{content}", self.get_web_options_buttons()
         elif message == 'about_app':
             content = self.web_options['about_application']['content']
-            return f"**{self.web_options['about_application']['title']}**\n\n{content}", self.get_web_options_buttons()
+            return 'about_app', f"**{self.web_options['about_application']['title']}**\n\n{content}", self.get_web_options_buttons()
         elif message == 'how_to_use':
             content = self.web_options['how_to_use']['content']
-            return f"**{self.web_options['how_to_use']['title']}**\n\n{content}", self.get_web_options_buttons()
+            return 'how_to_use', f"**{self.web_options['how_to_use']['title']}**\n\n{content}", self.get_web_options_buttons()
         elif message == 'input_help':
             content = self.web_options['input_guidance']['content']
-            return f"**{self.web_options['input_guidance']['title']}**\n\n{content}", self.get_web_options_buttons()
+            return 'input_help', f"**{self.web_options['input_guidance']['title']}**\n\n{content}", self.get_web_options_buttons()
         elif message == 'get_suggestions':
             content = """
 **💡 Get Personalized Suggestions**
@@ -1192,7 +4775,7 @@ After you receive your performance prediction, click the **"GET PERSONALIZED ADV
 
 **How it works:** Our AI Model analyzes your input data and provides actionable suggestions to help you improve your academic performance and achieve your goals.
 """
-            return f"**💡 Get Suggestions**\n\n{content}", self.get_web_options_buttons()
+            return 'get_suggestions', f"**💡 Get Suggestions**\n\n{content}", self.get_web_options_buttons()
         elif message == 'model_predictions':
             content = """
 **🤖 About Model Predictions**
@@ -1210,7 +4793,7 @@ Our AI prediction system uses advanced **Deep Neural Networks (DNN)** to analyze
 **How Predictions Work:**
 The DNN model considers multiple factors including CGPA, attendance, study habits, backlogs, and extracurricular activities to provide accurate performance assessments.
 """
-            return f"**🤖 Model Predictions**\n\n{content}", self.get_web_options_buttons()
+            return 'model_predictions', f"**🤖 Model Predictions**\n\n{content}", self.get_web_options_buttons()
         elif message == 'contact_us':
             content = """
 **📞 Contact Us**
@@ -1230,52 +4813,145 @@ We're here to help you with any questions or support you may need:
 
 Feel free to reach out for any assistance with the AI Academic Advisor system!
 """
-            return f"**📞 Contact Us**\n\n{content}", self.get_web_options_buttons()
+            return 'contact_us', f"**📞 Contact Us**\n\n{content}", self.get_web_options_buttons()
         elif message == 'end_chat':
-            return self.general_responses['farewell'], []
+            return 'end_chat', self.general_responses['farewell'], []
         
         # Greetings
-        if any(word in message_lower for word in ['hello', 'hi', 'hey', 'start']):
-            return self.general_responses['greeting'], self.get_web_options_buttons()
+        if intent == 'greeting':
+            return 'greeting', self.general_responses['greeting'], self.get_web_options_buttons()
         
         # Help request
-        elif any(word in message_lower for word in ['help', 'what can you do', 'features']):
-            return self.general_responses['help'], self.get_web_options_buttons()
+        elif intent == 'help':
+            return 'help', self.general_responses['help'], self.get_web_options_buttons()
         
         # About application
-        elif any(word in message_lower for word in ['about', 'application', 'system', 'what is this']):
+        elif intent == 'about_app':
             content = self.web_options['about_application']['content']
-            return f"**{self.web_options['about_application']['title']}**\n\n{content}", self.get_web_options_buttons()
+            return 'about_app', f"**{self.web_options['about_application']['title']}**\n\n{content}", self.get_web_options_buttons()
         
         # How to use
-        elif any(word in message_lower for word in ['how to use', 'how does it work', 'steps', 'guide']):
+        elif intent == 'how_to_use':
             content = self.web_options['how_to_use']['content']
-            return f"**{self.web_options['how_to_use']['title']}**\n\n{content}", self.get_web_options_buttons()
+            return 'how_to_use', f"**{self.web_options['how_to_use']['title']}**\n\n{content}", self.get_web_options_buttons()
         
         # Input guidance
-        elif any(word in message_lower for word in ['how to fill', 'input', 'fields', 'form']):
+        elif intent == 'input_help':
             content = self.web_options['input_guidance']['content']
-            return f"**{self.web_options['input_guidance']['title']}**\n\n{content}", self.get_web_options_buttons()
+            return 'input_help', f"**{self.web_options['input_guidance']['title']}**\n\n{content}", self.get_web_options_buttons()
         
         # About developer
-        elif any(word in message_lower for word in ['developer', 'created', 'who made', 'about us']):
+        elif intent == 'about_developer':
             content = self.web_options['about_developer']['content']
-            return f"**{self.web_options['about_developer']['title']}**\n\n{content}", self.get_web_options_buttons()
+            return 'about_developer', f"**{self.web_options['about_developer']['title']}**\n\n{content}", self.get_web_options_buttons()
         
         # Farewell
-        elif any(word in message_lower for word in ['bye', 'goodbye', 'exit', 'quit', 'end']):
-            return self.general_responses['farewell'], []
+        elif intent == 'farewell':
+            return 'farewell', self.general_responses['farewell'], []
         
         # SEARCH KNOWLEDGE BASE FOR ANY OTHER ACADEMIC QUESTIONS
-        knowledge_result = self._search_knowledge_base(message_lower)
+        category, knowledge_result = self._match_knowledge_base(normalized)
         if knowledge_result:
-            return knowledge_result, self.get_web_options_buttons()
+            return category, knowledge_result, self.get_web_options_buttons()
         
         # Default response if nothing found
-        return self.general_responses['knowledge_not_found'], self.get_web_options_buttons()
+        return 'knowledge_not_found', self.general_responses['knowledge_not_found'], self.get_web_options_buttons()
 
 # Initialize the bot
 academic_bot = AcademicAdvisorBot()
+
+# ==================== CONVERSATION STATE ====================
+# Kept in the signed Flask session cookie (a few intents and a topic), so a follow-up
+# continues the conversation whichever worker serves it, and the conversation is tied to
+# the server-issued session rather than an id the client sends.
+CHAT_HISTORY_SIZE = int(os.environ.get('CHAT_HISTORY_SIZE', 8))
+CHAT_SESSION_TTL = float(os.environ.get('CHAT_SESSION_TTL', 1800))
+
+class ConversationState:
+    """Per-session chat context: a fixed-size ring of recent intents plus the current topic"""
+    __slots__ = ('intents', 'head', 'count', 'last_topic', 'follow_up_index', 'last_seen')
+
+    def __init__(self, history_size):
+        self.intents = [None] * history_size
+        self.head = 0
+        self.count = 0
+        self.last_topic = None
+        self.follow_up_index = 0
+        self.last_seen = time.time()
+
+    def remember(self, intent, topic=None):
+        """Push an intent into the ring; a new topic restarts its follow-up details"""
+        self.intents[self.head] = sys.intern(intent)
+        self.head = (self.head + 1) % len(self.intents)
+        self.count += 1
+        if intent == 'follow_up':
+            return
+        if topic != self.last_topic:
+            self.follow_up_index = 0
+        self.last_topic = topic
+
+    def recent_intents(self):
+        """Intents oldest to newest"""
+        size = len(self.intents)
+        if self.count < size:
+            return self.intents[:self.count]
+        return self.intents[self.head:] + self.intents[:self.head]
+
+    def to_dict(self):
+        """Compact form for the session cookie"""
+        return {'intents': self.recent_intents(), 'topic': self.last_topic,
+                'follow_up': self.follow_up_index, 'seen': self.last_seen}
+
+    @classmethod
+    def from_dict(cls, data, history_size):
+        state = cls(history_size)
+        for intent in data.get('intents', [])[-history_size:]:
+            state.intents[state.head] = sys.intern(str(intent))
+            state.head = (state.head + 1) % history_size
+            state.count += 1
+        state.last_topic = data.get('topic')
+        state.follow_up_index = int(data.get('follow_up', 0))
+        state.last_seen = float(data.get('seen', state.last_seen))
+        return state
+
+class ConversationStateStore:
+    """Conversation state in the signed Flask session, dropped after ttl seconds idle"""
+    SESSION_KEY = 'chat_state'
+
+    def __init__(self, history_size=8, ttl=1800):
+        self.history_size = history_size
+        self.ttl = ttl
+
+    def load(self):
+        """This session's state (a fresh one when there is none or it has gone idle)"""
+        data = session.get(self.SESSION_KEY)
+        if isinstance(data, dict) and time.time() - data.get('seen', 0) < self.ttl:
+            try:
+                return ConversationState.from_dict(data, self.history_size)
+            except (TypeError, ValueError):
+                pass
+        return ConversationState(self.history_size)
+
+    def save(self, state):
+        state.last_seen = time.time()
+        session[self.SESSION_KEY] = state.to_dict()
+
+    def reset(self):
+        """Forget this session's conversation; True if it had one"""
+        return session.pop(self.SESSION_KEY, None) is not None
+
+    def report(self):
+        """Settings and the size of this session's stored state"""
+        data = session.get(self.SESSION_KEY)
+        return {
+            'storage': 'signed session cookie',
+            'history_size': self.history_size,
+            'ttl_seconds': self.ttl,
+            'state_bytes': len(json.dumps(data, separators=(',', ':'))) if data else 0
+        }
+
+conversation_store = ConversationStateStore(CHAT_HISTORY_SIZE, CHAT_SESSION_TTL)
+
 # ==================== ADD THESE NEW CHAT ROUTES ====================
 @app.route('/chat/send_message', methods=['POST'])
 def chat_send_message():
@@ -1291,7 +4967,10 @@ def chat_send_message():
             })
         
         # Get response from academic bot
-        bot_response, quick_actions = academic_bot.get_response(user_message)
+        state = conversation_store.load()
+        with request_stage('chat_response'):
+            bot_response, quick_actions = academic_bot.get_response(user_message, state)
+        conversation_store.save(state)
         
         return jsonify({
             'response': bot_response,
@@ -1315,6 +4994,205 @@ def chat_start():
         'quick_actions': quick_actions,
         'status': 'success'
     })
+# ==================== SEMANTIC KNOWLEDGE RETRIEVAL ====================
+# Built offline by build_knowledge_embeddings.py; rebuilt in memory (TF-IDF + SVD, no
+# network) when the saved files are missing or the knowledge base text has changed.
+KNOWLEDGE_EMBEDDINGS_PATH = os.environ.get(
+    'KNOWLEDGE_EMBEDDINGS_PATH', "student_performance_dnn/production_model/knowledge_embeddings"
+)
+CHAT_RETRIEVAL_MODE = os.environ.get('CHAT_RETRIEVAL_MODE', 'keyword').lower()
+CHAT_SEMANTIC_MIN_SCORE = float(os.environ.get('CHAT_SEMANTIC_MIN_SCORE', 0.35))
+SEMANTIC_ANN_MIN_ENTRIES = int(os.environ.get('SEMANTIC_ANN_MIN_ENTRIES', 20000))
+SEMANTIC_ANN_PROBES = int(os.environ.get('SEMANTIC_ANN_PROBES', 8))
+
+def collect_knowledge_entries():
+    """Every help-system and chatbot knowledge base entry with the text to embed"""
+    entries = []
+    for category, topics in help_system.knowledge_base.items():
+        for topic, content in topics.items():
+            entries.append({
+                'source': 'help',
+                'category': category.replace('_', ' ').title(),
+                'topic': topic.replace('_', ' ').title(),
+                'content': content,
+                'text': f"{topic.replace('_', ' ')} {category.replace('_', ' ')} {content}"
+            })
+    for category, data in academic_bot.knowledge_base.items():
+        entries.append({
+            'source': 'chat',
+            'category_key': category,
+            'category': category.replace('_', ' ').title(),
+            'topic': category.replace('_', ' ').title(),
+            'content': data['content'],
+            'text': f"{category.replace('_', ' ')} {' '.join(data['keywords'])} {data['content']}"
+        })
+    return entries
+
+def knowledge_corpus_digest(entries):
+    """Hash of the embedded text, so stale .npy files are detected at startup"""
+    return hashlib.sha256("\n".join(entry['text'] for entry in entries).encode('utf-8')).hexdigest()[:16]
+
+class TfidfSvdEncoder:
+    """Local sentence encoder: TF-IDF over words and bigrams reduced by truncated SVD (LSA)"""
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    @classmethod
+    def fit(cls, texts, n_components=128):
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.pipeline import make_pipeline, make_union
+        from sklearn.preprocessing import Normalizer
+
+        # Word n-grams for topical overlap, character n-grams for word forms ("focus"/"focused")
+        vectorizer = make_union(
+            TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, stop_words='english'),
+            TfidfVectorizer(analyzer='char_wb', ngram_range=(3, 5), sublinear_tf=True)
+        )
+        n_terms = vectorizer.fit_transform(texts).shape[1]
+        n_components = max(1, min(n_components, len(texts) - 1, n_terms - 1))
+        pipeline = make_pipeline(vectorizer, TruncatedSVD(n_components, random_state=0), Normalizer())
+        pipeline.fit(texts)
+        return cls(pipeline)
+
+    def encode(self, texts):
+        """L2-normalised float32 embeddings, one row per text"""
+        return np.ascontiguousarray(self.pipeline.transform(texts), dtype=np.float32)
+
+class SentenceTransformerEncoder:
+    """Optional small local embedding model (pip install sentence-transformers)"""
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device='cpu')
+
+    def encode(self, texts):
+        """L2-normalised float32 embeddings, one row per text"""
+        embeddings = self.model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+class SemanticKnowledgeIndex:
+    """Vectorized cosine top-k over a contiguous float32 embedding matrix
+
+    Above SEMANTIC_ANN_MIN_ENTRIES rows an inverted-file index (k-means lists,
+    SEMANTIC_ANN_PROBES lists scanned per query) replaces the exhaustive scan.
+    """
+    def __init__(self, encoder, embeddings, entries, ann_min_entries=20000, n_probe=8):
+        self.encoder = encoder
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.entries = entries
+        sources = np.array([entry['source'] for entry in entries])
+        self.source_masks = {source: sources == source for source in set(sources.tolist())}
+        self.n_probe = n_probe
+        self.centroids = None
+        self.lists = None
+        if len(entries) >= ann_min_entries:
+            self._build_ivf()
+
+    def _build_ivf(self):
+        """Coarse k-means quantizer with about sqrt(n) lists"""
+        from sklearn.cluster import MiniBatchKMeans
+
+        n_lists = max(1, int(np.sqrt(len(self.embeddings))))
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=0, n_init=3, batch_size=4096)
+        assignments = kmeans.fit_predict(self.embeddings)
+        centroids = kmeans.cluster_centers_.astype(np.float32)
+        self.centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(n_lists)]
+
+    def search_vector(self, query_vector, k=5, source=None):
+        """(row ids, cosine scores) of the k nearest entries, best first"""
+        if self.centroids is not None:
+            probes = np.argpartition(-(self.centroids @ query_vector), min(self.n_probe, len(self.lists)) - 1)
+            candidates = np.concatenate([self.lists[i] for i in probes[:self.n_probe]])
+        else:
+            candidates = None
+        if source is not None:
+            mask = self.source_masks.get(source)
+            if mask is None:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            candidates = np.flatnonzero(mask) if candidates is None else candidates[mask[candidates]]
+
+        if candidates is None:
+            scores = self.embeddings @ query_vector
+            row_ids = None
+        else:
+            scores = self.embeddings[candidates] @ query_vector
+            row_ids = candidates
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return (top if row_ids is None else row_ids[top]), scores[top]
+
+    def search(self, query, k=5, source=None, min_score=0.0):
+        """Knowledge entries most similar to the query text, as search_help-style results"""
+        query_vector = self.encoder.encode([query])[0]
+        row_ids, scores = self.search_vector(query_vector, k, source)
+        results = []
+        for row_id, score in zip(row_ids, scores):
+            if score < min_score:
+                break
+            entry = self.entries[row_id]
+            result = {key: value for key, value in entry.items() if key not in ('text', 'source')}
+            result['score'] = float(score)
+            results.append(result)
+        return results
+
+def save_knowledge_embeddings(base_path, encoder, embeddings, entries):
+    """Write <base>.npy (float32 matrix), <base>.json (entries, digest, encoder) and the encoder"""
+    np.save(f"{base_path}.npy", np.ascontiguousarray(embeddings, dtype=np.float32))
+    if isinstance(encoder, SentenceTransformerEncoder):
+        encoder_spec = {'type': 'sentence_transformers', 'model': encoder.model_name}
+    else:
+        encoder_spec = {'type': 'tfidf_svd'}
+        joblib.dump(encoder, f"{base_path}.encoder.pkl")
+    with open(f"{base_path}.json", 'w', encoding='utf-8') as f:
+        json.dump({
+            'digest': knowledge_corpus_digest(entries),
+            'encoder': encoder_spec,
+            'entries': [{key: value for key, value in entry.items() if key != 'text'} for entry in entries]
+        }, f, ensure_ascii=False, indent=1)
+
+def load_semantic_index(base_path):
+    """Memory-map the saved embeddings when they match the current knowledge base"""
+    entries = collect_knowledge_entries()
+    try:
+        with open(f"{base_path}.json", encoding='utf-8') as f:
+            metadata = json.load(f)
+        if metadata['digest'] != knowledge_corpus_digest(entries):
+            raise ValueError("knowledge base changed since the embeddings were built")
+        if metadata['encoder']['type'] == 'sentence_transformers':
+            encoder = SentenceTransformerEncoder(metadata['encoder']['model'])
+        else:
+            encoder = joblib.load(f"{base_path}.encoder.pkl")
+        embeddings = np.load(f"{base_path}.npy", mmap_mode='r')
+    except (OSError, ValueError, KeyError, ImportError) as e:
+        print(f"⚠️ Rebuilding knowledge embeddings in memory ({e})")
+        encoder = TfidfSvdEncoder.fit([entry['text'] for entry in entries])
+        embeddings = encoder.encode([entry['text'] for entry in entries])
+    return SemanticKnowledgeIndex(
+        encoder, embeddings, entries,
+        ann_min_entries=SEMANTIC_ANN_MIN_ENTRIES, n_probe=SEMANTIC_ANN_PROBES
+    )
+
+semantic_index = load_semantic_index(KNOWLEDGE_EMBEDDINGS_PATH)
+
+@app.route('/reset_chat', methods=['POST'])
+def reset_chat():
+    """Forget the chatbot conversation context for this session"""
+    conversation_store.reset()
+    return jsonify({'status': 'success'})
+
+@app.route('/chat/stats', methods=['GET'])
+def chat_stats():
+    """Conversation state settings and this session's stored state size"""
+    return jsonify(dict(status='success', **conversation_store.report()))
+
 # ==================== CLEAR SESSION ROUTE ====================
 @app.route('/clear_session', methods=['POST'])
 def clear_session():
@@ -1343,20 +5221,504 @@ def scaler_info():
         """
     except Exception as e:
         return f"Error: {e}"
+# ==================== PDF REPORT JOBS ====================
+# Reports are rendered by background threads from a SQLite job table, so requests only
+# score the student and enqueue. Identical inputs (same features, prediction and model
+# version) reuse the PDF already on disk.
+REPORT_JOBS_DIR = os.environ.get('REPORT_JOBS_DIR', 'logs/reports')
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+REPORT_POLL_INTERVAL = float(os.environ.get('REPORT_POLL_INTERVAL', 1.0))
+REPORT_JOB_TIMEOUT = float(os.environ.get('REPORT_JOB_TIMEOUT', 300))   # requeue "running" jobs after this
+REPORT_MAX_ATTEMPTS = int(os.environ.get('REPORT_MAX_ATTEMPTS', 3))
+REPORT_RETENTION_SECONDS = float(os.environ.get('REPORT_RETENTION_SECONDS', 7 * 86400))
+REPORT_MAX_BULK = int(os.environ.get('REPORT_MAX_BULK', 5000))
+REPORT_FORMAT_VERSION = 1
+
+class SimplePdfDocument:
+    """Minimal dependency-free PDF writer: wrapped Helvetica text on A4 pages"""
+    PAGE_WIDTH, PAGE_HEIGHT, MARGIN = 595, 842, 50
+
+    def __init__(self):
+        self.pages = []
+        self._new_page()
+
+    def _new_page(self):
+        self.pages.append([])
+        self.y = self.PAGE_HEIGHT - self.MARGIN
+
+    @staticmethod
+    def _clean(text):
+        """Drop markdown markers and anything (emoji) outside the WinAnsi font encoding"""
+        text = text.replace('**', '').replace('\t', '    ')
+        return text.encode('cp1252', errors='ignore').decode('cp1252').strip()
+
+    def text(self, text, size=10, bold=False, indent=0):
+        """Add text wrapped to the page width, starting new pages as needed"""
+        width = int((self.PAGE_WIDTH - 2 * self.MARGIN - indent) / (size * 0.5))
+        for line in textwrap.wrap(self._clean(text), width) or ['']:
+            if self.y < self.MARGIN + size:
+                self._new_page()
+            self.y -= size * 1.4
+            self.pages[-1].append((self.MARGIN + indent, self.y, size, bold, line))
+
+    def spacer(self, height=8):
+        self.y -= height
+
+    def to_bytes(self):
+        def escape(line):
+            return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+        n_pages = len(self.pages)
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            ("<< /Type /Pages /Kids [%s] /Count %d >>" % (
+                ' '.join(f"{5 + 2 * i} 0 R" for i in range(n_pages)), n_pages)).encode(),
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+        ]
+        for i, lines in enumerate(self.pages):
+            stream = ''.join(
+                f"BT /{'F2' if bold else 'F1'} {size} Tf {x:.1f} {y:.1f} Td ({escape(line)}) Tj ET\n"
+                for x, y, size, bold, line in lines
+            ).encode('cp1252')
+            objects.append((
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.PAGE_WIDTH} {self.PAGE_HEIGHT}] "
+                f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {6 + 2 * i} 0 R >>"
+            ).encode())
+            objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+
+        out = io.BytesIO()
+        out.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(out.tell())
+            out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = out.tell()
+        out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        out.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+        out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+        return out.getvalue()
+
+def build_report_payload(input_data, prediction_probs, final_classes, rows=None):
+    """Job payloads (one per row) holding everything a report needs except the advice text"""
+    payloads = []
+    for i, (features, probs, final_idx) in enumerate(zip(input_data, prediction_probs, final_classes)):
+        payloads.append({
+            'row': int(rows[i]) if rows is not None else None,
+            'features': [float(str(value)) for value in features],
+            'predicted_class': CLASS_LABELS[final_idx],
+            'confidence': float(np.max(probs)) * 100,
+            'probabilities': {CLASS_LABELS[j]: float(probs[j]) * 100 for j in range(len(CLASS_LABELS))}
+        })
+    return payloads
+
+def report_input_hash(payload):
+    """Cache key: inputs and prediction, plus the model and report format that produced them"""
+    key = json.dumps([payload['features'], payload['predicted_class'], MODEL_VERSION, REPORT_FORMAT_VERSION])
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+def render_student_report(payload):
+    """PDF bytes with the prediction, class probabilities, profile and generate_advice() text"""
+    input_data = np.asarray([payload['features']], dtype=np.float32)
+    profile = StudentProfile.from_row(input_data[0], payload['predicted_class'])
+    attributions = attribution_explainer.explain_one(input_data) if ADVICE_USE_ATTRIBUTIONS else None
+    advice = advisor_model.generate_advice(profile, profile.predicted_class, attributions)
+
+    doc = SimplePdfDocument()
+    doc.text("Student Performance Report", size=18, bold=True)
+    doc.text(f"Generated {datetime.now().strftime('%Y-%m-%d %H:%M')} - model {MODEL_VERSION}", size=8)
+    doc.spacer(12)
+    doc.text(f"Predicted Performance: {payload['predicted_class']}", size=13, bold=True)
+    doc.text(f"Confidence: {payload['confidence']:.1f}%")
+    for label, probability in sorted(payload['probabilities'].items(), key=lambda item: -item[1]):
+        doc.text(f"{label}: {probability:.1f}%", indent=15)
+    doc.spacer()
+    doc.text("Student Profile", size=13, bold=True)
+    for name, _, _, label, _ in feature_schema.fields:
+        doc.text(f"{label}: {getattr(profile, name)}", indent=15)
+    doc.spacer()
+    doc.text("Personalized Advice", size=13, bold=True)
+    for paragraph in advice.split('\n'):
+        if paragraph.strip():
+            doc.text(paragraph)
+        else:
+            doc.spacer(4)
+    return doc.to_bytes()
+
+class ReportJobQueue:
+    """Persistent report job queue (SQLite, WAL) drained by a pool of worker threads
+
+    Jobs survive restarts: queued jobs are picked up by any process, and jobs left
+    "running" by a crashed worker are requeued after REPORT_JOB_TIMEOUT. PDFs are stored
+    once per input hash under jobs_dir/files and shared by every job with that hash.
+    """
+    def __init__(self, jobs_dir, renderer, n_workers=2, poll_interval=1.0, job_timeout=300,
+                 max_attempts=3, retention_seconds=7 * 86400):
+        self.jobs_dir = jobs_dir
+        self.files_dir = os.path.join(jobs_dir, 'files')
+        self.db_path = os.path.join(jobs_dir, 'jobs.db')
+        self.renderer = renderer
+        self.n_workers = n_workers
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.stats = {'rendered': 0, 'cache_hits': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+        self._pid = None
+        self._last_prune = 0.0
+
+    def _connect(self):
+        """Autocommit connection so claims can take an explicit write lock"""
+        os.makedirs(self.files_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS report_jobs (
+                id TEXT PRIMARY KEY,
+                batch_id TEXT,
+                row_index INTEGER,
+                input_hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                cache_hit INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_report_jobs_status ON report_jobs (status, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_report_jobs_batch ON report_jobs (batch_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_report_jobs_hash ON report_jobs (input_hash)')
+        return conn
+
+    def file_path(self, input_hash):
+        return os.path.join(self.files_dir, f"{input_hash}.pdf")
+
+    def _ensure_workers(self):
+        """Start the worker threads lazily, and again in each forked worker process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._workers = [
+                threading.Thread(target=self._run, name=f'report-worker-{i}', daemon=True)
+                for i in range(self.n_workers)
+            ]
+            self._pid = os.getpid()
+            for worker in self._workers:
+                worker.start()
+
+    def submit(self, payloads, batch_id=None):
+        """Enqueue one job per payload; returns [(job id, status)] in payload order
+
+        A payload whose PDF already exists is recorded as done immediately.
+        """
+        self._ensure_workers()
+        now = time.time()
+        rows, results = [], []
+        for payload in payloads:
+            job_id = uuid.uuid4().hex
+            input_hash = report_input_hash(payload)
+            cached = os.path.exists(self.file_path(input_hash))
+            status = 'done' if cached else 'queued'
+            rows.append((job_id, batch_id, payload.get('row'), input_hash, status, json.dumps(payload),
+                         now, now if cached else None, int(cached)))
+            results.append((job_id, status))
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany("""
+                INSERT INTO report_jobs (id, batch_id, row_index, input_hash, status, payload, created_at, finished_at, cache_hit)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        self.stats['cache_hits'] += sum(row[-1] for row in rows)
+        self._wake.set()
+        return results
+
+    def status(self, job_id):
+        """Job record without its payload, or None"""
+        conn = self._connect()
+        try:
+            row = conn.execute("""
+                SELECT id, batch_id, row_index, status, created_at, started_at, finished_at, attempts, cache_hit, error, input_hash
+                FROM report_jobs WHERE id = ?
+            """, (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job['cache_hit'] = bool(job['cache_hit'])
+        job['file'] = self.file_path(job.pop('input_hash')) if job['status'] == 'done' else None
+        return job
+
+    def batch_jobs(self, batch_id):
+        """[(row, job id, status, pdf path or None)] for a bulk submission"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT row_index, id, status, input_hash FROM report_jobs WHERE batch_id = ? ORDER BY row_index",
+                (batch_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            (row['row_index'], row['id'], row['status'],
+             self.file_path(row['input_hash']) if row['status'] == 'done' else None)
+            for row in rows
+        ]
+
+    def _claim(self, conn):
+        """Atomically move the oldest queued job to running (requeueing stale ones first)"""
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute("""
+                UPDATE report_jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                       error = CASE WHEN attempts >= ? THEN 'worker timed out' ELSE error END
+                WHERE status = 'running' AND started_at < ?
+            """, (self.max_attempts, self.max_attempts, now - self.job_timeout))
+            row = conn.execute(
+                "SELECT id, input_hash, payload FROM report_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE report_jobs SET status = 'running', started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (now, row['id'])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return row
+
+    def _finish(self, conn, job_id, status, error=None, cache_hit=False):
+        conn.execute(
+            "UPDATE report_jobs SET status = ?, finished_at = ?, error = ?, cache_hit = ? WHERE id = ?",
+            (status, time.time(), error, int(cache_hit), job_id)
+        )
+
+    def _run(self):
+        """Worker loop: claim, render (or reuse the cached PDF), write atomically, repeat"""
+        conn = self._connect()
+        while not self._stop.is_set():
+            try:
+                job = self._claim(conn)
+            except sqlite3.OperationalError:
+                job = None  # database busy; try again after the poll interval
+            if job is None:
+                self._prune(conn)
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            path = self.file_path(job['input_hash'])
+            if os.path.exists(path):
+                self._finish(conn, job['id'], 'done', cache_hit=True)
+                self.stats['cache_hits'] += 1
+                continue
+            try:
+                pdf = self.renderer(json.loads(job['payload']))
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(pdf)
+                os.replace(temp_path, path)
+                self._finish(conn, job['id'], 'done')
+                self.stats['rendered'] += 1
+            except Exception as e:
+                print(f"❌ Report job {job['id']} failed: {e}")
+                self._finish(conn, job['id'], 'failed', error=str(e))
+                self.stats['failed'] += 1
+        conn.close()
+
+    def _prune(self, conn, every=3600):
+        """Delete expired jobs and PDFs no remaining job refers to (at most once an hour)"""
+        now = time.time()
+        if not self.retention_seconds or now - self._last_prune < every:
+            return
+        self._last_prune = now
+        cutoff = now - self.retention_seconds
+        expired = {row[0] for row in conn.execute(
+            "SELECT DISTINCT input_hash FROM report_jobs WHERE finished_at < ?", (cutoff,))}
+        if not expired:
+            return
+        conn.execute("DELETE FROM report_jobs WHERE finished_at < ?", (cutoff,))
+        still_used = {row[0] for row in conn.execute("SELECT DISTINCT input_hash FROM report_jobs")}
+        for input_hash in expired - still_used:
+            try:
+                os.remove(self.file_path(input_hash))
+            except OSError:
+                pass
+
+    def close(self, timeout=5.0):
+        """Stop this process's workers after their current job"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._wake.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._pid = None
+
+report_jobs = ReportJobQueue(
+    REPORT_JOBS_DIR,
+    render_student_report,
+    n_workers=REPORT_WORKERS,
+    poll_interval=REPORT_POLL_INTERVAL,
+    job_timeout=REPORT_JOB_TIMEOUT,
+    max_attempts=REPORT_MAX_ATTEMPTS,
+    retention_seconds=REPORT_RETENTION_SECONDS
+)
+atexit.register(report_jobs.close)
+
+def report_job_response(job_id, status):
+    return {
+        'job_id': job_id,
+        'status': status,
+        'status_url': f'/reports/{job_id}',
+        'download_url': f'/reports/{job_id}/download'
+    }
+
 @app.route('/generate_pdf_report', methods=['POST'])
 def generate_pdf_report():
+    """Queue a PDF report for a posted profile or the student analysed in this session"""
     try:
-        student_data = session.get('student_data')
-        # Your PDF generation logic here
-        return jsonify({'success': True, 'message': 'PDF generated'})
+        profile = (request.get_json(silent=True) or {}).get('profile') or session_profile()
+        if not profile:
+            return jsonify({
+                'success': False,
+                'message': 'Please fill out the form and analyze your performance first.'
+            })
+        input_data = feature_schema.encode(profile)
+        prediction_probs = predict_probabilities(input_data)
+        final_classes, _ = correction_stage.apply(prediction_probs, input_data)
+        [(job_id, status)] = report_jobs.submit(build_report_payload(input_data, prediction_probs, final_classes))
+        response = jsonify(dict(
+            success=True,
+            message='PDF report ready' if status == 'done' else 'PDF report queued',
+            **report_job_response(job_id, status)
+        ))
+        response.status_code = 200 if status == 'done' else 202
+        return response
+    except FeatureValidationError as e:
+        return jsonify({'success': False, 'message': 'Invalid profile', 'errors': e.errors})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/reports/<job_id>', methods=['GET'])
+def report_status(job_id):
+    job = report_jobs.status(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown report job'}), 404
+    job.pop('file')
+    return jsonify(dict(success=True, download_url=f'/reports/{job_id}/download', **job))
+
+@app.route('/reports/<job_id>/download', methods=['GET'])
+def report_download(job_id):
+    job = report_jobs.status(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown report job'}), 404
+    if job['status'] != 'done':
+        return jsonify({'success': False, 'status': job['status'], 'message': 'Report is not ready yet'}), 409
+    return send_file(job['file'], mimetype='application/pdf', as_attachment=True,
+                     download_name=f"Student_Report_{job_id[:8]}.pdf")
+
+@app.route('/reports/bulk', methods=['POST'])
+def report_bulk():
+    """Queue one report per student for a cohort (JSON rows/objects or CSV text, as /predict_batch)"""
+    try:
+        payload = request.json or {}
+        if payload.get('csv'):
+            input_data, valid_mask, errors = feature_schema.encode_csv(payload['csv'])
+        else:
+            input_data, valid_mask, errors = feature_schema.encode_many(payload.get('rows', []))
+        if not len(input_data):
+            return jsonify({
+                'success': False,
+                'message': f'Please provide rows (lists or objects) or csv with features: {SCALER_FEATURES}'
+            })
+        if len(input_data) > REPORT_MAX_BULK:
+            return jsonify({'success': False, 'message': f'At most {REPORT_MAX_BULK} students per bulk request'})
+
+        valid_rows = np.flatnonzero(valid_mask)
+        batch_id = uuid.uuid4().hex
+        jobs = []
+        if len(valid_rows):
+            valid_data = input_data[valid_rows]
+            prediction_probs = predict_probabilities(valid_data)
+            final_classes, _ = correction_stage.apply(prediction_probs, valid_data)
+            jobs = report_jobs.submit(
+                build_report_payload(valid_data, prediction_probs, final_classes, rows=valid_rows), batch_id
+            )
+        return jsonify({
+            'success': True,
+            'batch_id': batch_id,
+            'status_url': f'/reports/batch/{batch_id}',
+            'download_url': f'/reports/batch/{batch_id}/download',
+            'jobs': [dict(row=int(row), **report_job_response(job_id, status))
+                     for row, (job_id, status) in zip(valid_rows, jobs)],
+            'errors': {str(row_index): row_errors for row_index, row_errors in errors.items()}
+        }), 202
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error queueing reports: {str(e)}'})
+
+@app.route('/reports/batch/<batch_id>', methods=['GET'])
+def report_batch_status(batch_id):
+    jobs = report_jobs.batch_jobs(batch_id)
+    if not jobs:
+        return jsonify({'success': False, 'message': 'Unknown report batch'}), 404
+    counts = {}
+    for _, _, status, _ in jobs:
+        counts[status] = counts.get(status, 0) + 1
+    return jsonify({'success': True, 'batch_id': batch_id, 'total': len(jobs), 'counts': counts,
+                    'complete': counts.get('done', 0) + counts.get('failed', 0) == len(jobs)})
+
+@app.route('/reports/batch/<batch_id>/download', methods=['GET'])
+def report_batch_download(batch_id):
+    """Zip of every finished report in the batch, one PDF per input row"""
+    jobs = report_jobs.batch_jobs(batch_id)
+    if not jobs:
+        return jsonify({'success': False, 'message': 'Unknown report batch'}), 404
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for row, _, status, path in jobs:
+            if path:
+                zf.write(path, f"student_row_{row}.pdf")
+    archive.seek(0)
+    return send_file(archive, mimetype='application/zip', as_attachment=True,
+                     download_name=f"Student_Reports_{batch_id[:8]}.zip")
+
+def init_worker(managed=False):
+    """Per-process setup after fork: load the model and give each worker its own RNG stream
+
+    managed=True (gunicorn post_fork) lets the memory monitor recycle this worker.
+    """
+    global dnn_model
+    random.seed()
+    memory_diagnostics.recycle_allowed = managed
+    if dnn_model is None:
+        dnn_model = load_inference_backend()
+        print(f"✅ Worker {os.getpid()} loaded {INFERENCE_BACKEND} model")
+    shadow_evaluator.start()
+
 # Health check route for Render
 @app.route('/health')
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'Server is running'})
 
 if __name__ == "__main__":
+    init_worker()
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
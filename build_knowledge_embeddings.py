@@ -0,0 +1,41 @@
+"""
+Embed every help-system and chatbot knowledge base entry for semantic retrieval.
+
+    python build_knowledge_embeddings.py                           # TF-IDF + SVD, no network
+    python build_knowledge_embeddings.py --model all-MiniLM-L6-v2  # sentence-transformers model
+
+Writes knowledge_embeddings.npy/.json(/.encoder.pkl) next to the production model.
+Use it with {"mode": "semantic"} on /search_help or CHAT_RETRIEVAL_MODE=semantic.
+"""
+import argparse
+import time
+
+import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default=app.KNOWLEDGE_EMBEDDINGS_PATH,
+                        help='base path, .npy/.json/.encoder.pkl are appended')
+    parser.add_argument('--model', default=None,
+                        help='sentence-transformers model name (default: TF-IDF + SVD fallback)')
+    parser.add_argument('--components', type=int, default=128, help='SVD dimensions for the fallback encoder')
+    args = parser.parse_args()
+
+    entries = app.collect_knowledge_entries()
+    texts = [entry['text'] for entry in entries]
+
+    start = time.perf_counter()
+    if args.model:
+        encoder = app.SentenceTransformerEncoder(args.model)
+    else:
+        encoder = app.TfidfSvdEncoder.fit(texts, n_components=args.components)
+    embeddings = encoder.encode(texts)
+    app.save_knowledge_embeddings(args.output, encoder, embeddings, entries)
+
+    print(f"✅ Embedded {len(entries)} entries -> {args.output}.npy "
+          f"({embeddings.shape[1]} dims, {time.perf_counter() - start:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
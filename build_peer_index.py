@@ -0,0 +1,97 @@
+"""
+Build the similar-student (k-NN) index behind peer advice from student history.
+
+    python build_peer_index.py                           # from HISTORY_DB_PATH into PEER_INDEX_DIR
+    python build_peer_index.py --benchmark 100000 1000000
+
+Only history terms followed by another term of the same student are indexed, so every
+peer carries what they changed next. Running workers pick up the new build on their
+next lookup (same as POST /admin/peers {"rebuild": "history"}).
+
+--benchmark builds throwaway indexes over random in-range students of the given sizes
+and reports build time, k-NN latency and agreement with a brute-force scan.
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import app
+
+
+def random_students(n_rows, rng):
+    """Random in-range raw feature rows (as in export_onnx.check_parity) and a matching payload"""
+    features = np.column_stack([
+        rng.uniform(0, 10, n_rows),                         # total_cgpa
+        rng.uniform(0, 100, n_rows),                        # attendance
+        rng.choice([5, 15, 25, 35], n_rows),                # study_hours
+        rng.choice([0, 1, 2, 3, 4, 6], n_rows),             # backlogs
+        rng.integers(0, 2, n_rows),                         # competitions
+        rng.integers(0, 2, n_rows),                         # projects_internships
+        rng.uniform(0, 10, n_rows),                         # prevsem_cgpa
+        rng.integers(1, 11, n_rows),                        # confidence_level
+    ])
+    payload = np.hstack([
+        features,
+        rng.integers(0, 4, (n_rows, 1)),
+        rng.integers(-1, 2, (n_rows, 1)),
+        rng.normal(0, 0.5, (n_rows, len(app.SCALER_FEATURES)))
+    ])
+    return features, payload
+
+
+def benchmark(sizes, k, n_queries=1000):
+    rng = np.random.default_rng(0)
+    for n_rows in sizes:
+        features, payload = random_students(n_rows, rng)
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.perf_counter()
+            app.PeerIndex.build(directory, features, payload, app.scaler.mean_, app.scaler.scale_,
+                                leaf_size=app.PEER_LEAF_SIZE, source='benchmark')
+            build_seconds = time.perf_counter() - started
+            index = app.PeerIndex.load(directory)
+
+            queries, _ = random_students(n_queries, rng)
+            index.query(queries[0], k)  # fault the mapped arrays in
+            latencies = []
+            for query in queries:
+                started = time.perf_counter()
+                index.query(query, k)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            points = np.asarray(index.points)
+            exact, brute_latencies = 0, []
+            for query in queries[:50]:
+                started = time.perf_counter()
+                scaled = (query.astype(np.float32) - index.mean) / index.scale
+                distances = np.einsum('ij,ij->i', points - scaled, points - scaled)
+                nearest = np.argpartition(distances, k - 1)[:k]
+                brute_latencies.append((time.perf_counter() - started) * 1000)
+                _, found = index.query(query, k)
+                exact += np.allclose(np.sort(np.sqrt(distances[nearest])), found, atol=1e-5)
+
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"{n_rows:>9,} students: build {build_seconds:.2f}s, {index.meta['leaves']} leaves | "
+              f"k={k} query p50 {p50:.2f} ms, p99 {p99:.2f} ms | "
+              f"brute force {np.median(brute_latencies):.1f} ms | exact {exact}/50")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--benchmark', type=int, nargs='+', metavar='N', help='benchmark random indexes of N students')
+    parser.add_argument('-k', type=int, default=app.PEER_NEIGHBORS, help='neighbours per query')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.k)
+        return
+
+    started = time.perf_counter()
+    index = app.peer_neighbors.rebuild_from_history(app.student_history)
+    print(f"✅ Indexed {len(index)} student terms ({index.meta['leaves']} leaves) from {app.HISTORY_DB_PATH} "
+          f"-> {index.path} ({time.perf_counter() - started:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
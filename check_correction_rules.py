@@ -0,0 +1,155 @@
+"""
+Check the vectorized correction rule stage against the original per-request function.
+
+    python check_correction_rules.py                     # equivalence on 200k rows + benchmark
+    python check_correction_rules.py --rows 1000000 --sizes 1 1000 100000 1000000
+
+The equivalence check runs DEFAULT_CORRECTION_RULES through CorrectionRuleStage.apply
+and the pre-change fix_excellent_good_confusion (kept verbatim below, called the way
+main_app() used to: argmax label, max confidence, a percent probabilities dict divided
+back by 100) on random rows concentrated on every rule threshold, and fails unless the
+final classes are identical. The benchmark times apply() at each batch size against a
+loop over the original function.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import app
+
+
+def original_fix_excellent_good_confusion(predicted_class, confidence, features_dict, probabilities):
+    """
+    Fix ONLY Excellent/Good classification issues
+    """
+    # Rule 1: If predicted as Excellent but CGPA < 8.0, likely should be Good
+    if (predicted_class == 'Excellent' and
+        features_dict['total_cgpa'] < 8.0 and
+        confidence < 0.85):  # Low confidence Excellent prediction
+
+        if probabilities.get('Good', 0) > 0.15:  # Good probability is reasonable
+            return 'Good'
+
+    # Rule 2: If predicted as Good but has Excellent characteristics (CGPA > 8.5, no backlogs)
+    elif (predicted_class == 'Good' and
+          features_dict['total_cgpa'] >= 8.5 and
+          features_dict['backlogs'] == 0 and
+          features_dict['attendance'] >= 85 and
+          confidence < 0.8):  # Low confidence Good prediction
+
+        if probabilities.get('Excellent', 0) > 0.2:  # Excellent probability is reasonable
+            return 'Excellent'
+
+    return predicted_class
+
+
+def original_final_classes(prediction_probs, input_data):
+    """Final class index per row through the original function, as main_app() called it"""
+    final = []
+    for probs, row in zip(prediction_probs, input_data):
+        predicted_class = app.CLASS_LABELS[int(np.argmax(probs))]
+        confidence = np.max(probs)
+        probabilities = {app.CLASS_LABELS[i]: float(probs[i]) * 100 for i in range(len(app.CLASS_LABELS))}
+        features_dict = dict(zip(app.SCALER_FEATURES, row))
+        final_prediction = original_fix_excellent_good_confusion(
+            predicted_class, confidence, features_dict,
+            {k: v / 100 for k, v in probabilities.items()}
+        )
+        final.append(app.CLASS_LABELS.index(final_prediction))
+    return np.array(final)
+
+
+def boundary_rows(n_rows, rng):
+    """Random (float32 probabilities, raw features) with most values on or next to a threshold"""
+    def near(values, n, low, high):
+        """Half threshold neighbours (value, value +/- 1 ulp and +/- 0.01), half uniform in range"""
+        values = np.asarray(values, dtype=np.float64)
+        edges = np.concatenate([values, np.nextafter(values, -np.inf), np.nextafter(values, np.inf),
+                                values - 0.01, values + 0.01])
+        return np.where(rng.random(n) < 0.5, rng.choice(edges, n), rng.uniform(low, high, n))
+
+    n_classes = len(app.CLASS_LABELS)
+    excellent, good = app.CLASS_LABELS.index('Excellent'), app.CLASS_LABELS.index('Good')
+    top = np.where(rng.random(n_rows) < 0.8, rng.choice([excellent, good], n_rows), rng.integers(0, n_classes, n_rows))
+    target = np.where(top == excellent, good, excellent)
+
+    # Top class probability around the confidence thresholds, target around its minimum
+    top_p = np.clip(near([0.8, 0.85], n_rows, 0.3, 1.0), 0.3, 1.0)
+    target_p = np.minimum(near([0.15, 0.2], n_rows, 0.0, 0.5), np.maximum(1 - top_p, 0.0))
+    target_p = np.minimum(target_p, top_p * 0.999)
+    rest = rng.dirichlet(np.ones(n_classes - 2), n_rows) * np.maximum(1 - top_p - target_p, 0.0)[:, None]
+    rest = np.minimum(rest, top_p[:, None] * 0.999)
+    probs = np.zeros((n_rows, n_classes))
+    rows = np.arange(n_rows)
+    probs[rows, top] = top_p
+    probs[rows, target] = target_p
+    others = np.ones((n_rows, n_classes), dtype=bool)
+    others[rows, top] = False
+    others[rows, target] = False
+    probs[others] = rest.ravel()
+
+    features = np.column_stack([
+        near([8.0, 8.5], n_rows, 0, 10),                    # total_cgpa
+        near([85], n_rows, 0, 100),                         # attendance
+        rng.choice([5, 15, 25, 35], n_rows),                # study_hours
+        rng.choice([0, 0, 0, 1, 2, 3, 4, 6], n_rows),       # backlogs
+        rng.integers(0, 2, n_rows),                         # competitions
+        rng.integers(0, 2, n_rows),                         # projects_internships
+        rng.uniform(0, 10, n_rows),                         # prevsem_cgpa
+        rng.integers(1, 11, n_rows),                        # confidence_level
+    ])
+    return probs.astype(np.float32), features  # the model returns float32
+
+
+def check_equivalence(stage, n_rows, seed=0):
+    probs, features = boundary_rows(n_rows, np.random.default_rng(seed))
+    expected = original_final_classes(probs, features)
+    actual, applied = stage.apply(probs, features)
+    mismatches = np.flatnonzero(expected != actual)
+    fired = {name: int(np.sum(applied == i)) for i, name in enumerate(stage.rule_names)}
+    print(f"Equivalence on {n_rows:,} boundary-heavy rows: {len(mismatches)} mismatches; rules fired {fired}")
+    if len(mismatches):
+        row = mismatches[0]
+        print(f"  first mismatch: probs {probs[row].tolist()}, features {features[row].tolist()}, "
+              f"original {app.CLASS_LABELS[expected[row]]}, stage {app.CLASS_LABELS[actual[row]]}")
+        raise SystemExit("❌ CorrectionRuleStage does not match fix_excellent_good_confusion")
+
+
+def benchmark(stage, sizes, seed=1):
+    rng = np.random.default_rng(seed)
+    for n_rows in sizes:
+        probs, features = boundary_rows(n_rows, rng)
+        repeats = max(1, min(1000, 200000 // n_rows))
+        stage.apply(probs, features)
+        started = time.perf_counter()
+        for _ in range(repeats):
+            stage.apply(probs, features)
+        vectorized = (time.perf_counter() - started) / repeats
+
+        loop_rows = min(n_rows, 20000)  # the per-row loop is timed on a slice and scaled
+        started = time.perf_counter()
+        original_final_classes(probs[:loop_rows], features[:loop_rows])
+        original = (time.perf_counter() - started) * n_rows / loop_rows
+        print(f"{n_rows:>9,} rows: stage {vectorized * 1000:9.3f} ms ({n_rows / vectorized:13,.0f} rows/s) | "
+              f"original loop {original * 1000:9.2f} ms ({n_rows / original:11,.0f} rows/s) | "
+              f"{original / vectorized:7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000, help='rows for the equivalence check')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 1000, 100000], metavar='N',
+                        help='batch sizes to benchmark')
+    parser.add_argument('--no-benchmark', action='store_true')
+    args = parser.parse_args()
+
+    # The defaults, not CORRECTION_RULES_PATH: the original function hard-codes them
+    stage = app.CorrectionRuleStage(app.DEFAULT_CORRECTION_RULES, app.CLASS_LABELS, app.SCALER_FEATURES)
+    check_equivalence(stage, args.rows)
+    if not args.no_benchmark:
+        benchmark(stage, args.sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Export the production Keras model to ONNX for the TensorFlow-free serving backend.
+
+    python export_onnx.py                  # model only, app keeps using scaler.pkl
+    python export_onnx.py --include-scaler # fold StandardScaler into the graph
+
+Serve it with: INFERENCE_BACKEND=onnx python app.py
+Requires tensorflow + onnx (+ onnxruntime for the parity check) at export time only.
+"""
+import argparse
+
+import joblib
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+from tensorflow.keras.models import load_model
+
+MODEL_DIR = "student_performance_dnn/production_model"
+KERAS_MODEL_PATH = f"{MODEL_DIR}/student_performance_model.keras"
+SCALER_PATH = f"{MODEL_DIR}/scaler.pkl"
+ONNX_MODEL_PATH = f"{MODEL_DIR}/student_performance_model.onnx"
+
+
+def _collect_affine_blocks(keras_model):
+    """(weights, bias, activation) per Dense layer, with each BatchNormalization folded into the next Dense"""
+    blocks = []
+    pending_scale, pending_shift = None, None
+    for layer in keras_model.layers:
+        layer_type = type(layer).__name__
+        if layer_type == 'Dense':
+            weights, bias = layer.get_weights()
+            if pending_scale is not None:
+                # next(BN(x)) = (x*s + t) @ W + b = x @ (s[:, None] * W) + (t @ W + b)
+                bias = pending_shift @ weights + bias
+                weights = pending_scale[:, None] * weights
+                pending_scale, pending_shift = None, None
+            blocks.append((weights, bias, layer.get_config()['activation']))
+        elif layer_type == 'BatchNormalization':
+            gamma, beta, moving_mean, moving_var = layer.get_weights()
+            scale = gamma / np.sqrt(moving_var + layer.epsilon)
+            shift = beta - moving_mean * scale
+            if pending_scale is not None:
+                shift = pending_shift * scale + shift
+                scale = pending_scale * scale
+            pending_scale, pending_shift = scale, shift
+        elif layer_type == 'Dropout':
+            continue  # identity at inference time
+        else:
+            raise ValueError(f"Unsupported layer for ONNX export: {layer.name} ({layer_type})")
+    if pending_scale is not None:
+        raise ValueError("Model cannot end with BatchNormalization")
+    return blocks
+
+
+def build_onnx_graph(keras_model, scaler=None):
+    """Build an ONNX graph equivalent to keras_model (optionally with scaling in front)"""
+    nodes, initializers = [], []
+    n_features = keras_model.input_shape[1]
+    current = 'features'
+
+    if scaler is not None:
+        initializers.append(numpy_helper.from_array(scaler.mean_.astype(np.float32), 'scaler_mean'))
+        initializers.append(numpy_helper.from_array(scaler.scale_.astype(np.float32), 'scaler_scale'))
+        nodes.append(helper.make_node('Sub', [current, 'scaler_mean'], ['centered']))
+        nodes.append(helper.make_node('Div', ['centered', 'scaler_scale'], ['scaled']))
+        current = 'scaled'
+
+    for i, (weights, bias, activation) in enumerate(_collect_affine_blocks(keras_model)):
+        initializers.append(numpy_helper.from_array(weights.astype(np.float32), f'W{i}'))
+        initializers.append(numpy_helper.from_array(bias.astype(np.float32), f'b{i}'))
+        nodes.append(helper.make_node('Gemm', [current, f'W{i}', f'b{i}'], [f'dense{i}']))
+        current = f'dense{i}'
+        if activation == 'relu':
+            nodes.append(helper.make_node('Relu', [current], [f'relu{i}']))
+            current = f'relu{i}'
+        elif activation == 'softmax':
+            nodes.append(helper.make_node('Softmax', [current], ['probabilities'], axis=1))
+            current = 'probabilities'
+        elif activation != 'linear':
+            raise ValueError(f"Unsupported activation for ONNX export: {activation}")
+
+    if current != 'probabilities':
+        raise ValueError("Model must end with a softmax Dense layer")
+
+    n_classes = keras_model.output_shape[1]
+    graph = helper.make_graph(
+        nodes, 'student_performance_model',
+        [helper.make_tensor_value_info('features', TensorProto.FLOAT, [None, n_features])],
+        [helper.make_tensor_value_info('probabilities', TensorProto.FLOAT, [None, n_classes])],
+        initializer=initializers
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    helper.set_model_props(model, {'includes_scaler': 'true' if scaler is not None else 'false'})
+    onnx.checker.check_model(model)
+    return model
+
+
+def check_parity(keras_model, onnx_path, scaler, include_scaler, n_rows=2000, atol=1e-5):
+    """Compare ONNX Runtime against Keras on random in-range student rows"""
+    import onnxruntime as ort
+
+    rng = np.random.default_rng(0)
+    raw = np.column_stack([
+        rng.uniform(0, 10, n_rows),                         # total_cgpa
+        rng.uniform(0, 100, n_rows),                        # attendance
+        rng.choice([5, 15, 25, 35], n_rows),                # study_hours
+        rng.choice([0, 1, 2, 3, 4, 6], n_rows),             # backlogs
+        rng.integers(0, 2, n_rows),                         # competitions
+        rng.integers(0, 2, n_rows),                         # projects_internships
+        rng.uniform(0, 10, n_rows),                         # prevsem_cgpa
+        rng.integers(1, 11, n_rows),                        # confidence_level
+    ])
+    scaled = scaler.transform(raw)
+    expected = keras_model.predict(scaled, verbose=0)
+
+    session = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+    onnx_input = raw if include_scaler else scaled
+    actual = session.run(None, {'features': onnx_input.astype(np.float32)})[0]
+
+    max_diff = float(np.max(np.abs(expected - actual)))
+    same_class = float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1)))
+    print(f"Parity on {n_rows} rows: max |Δp| = {max_diff:.2e}, argmax agreement = {same_class:.4f}")
+    if max_diff > atol or same_class < 1.0:
+        raise SystemExit("❌ ONNX export does not match the Keras model")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default=ONNX_MODEL_PATH)
+    parser.add_argument('--include-scaler', action='store_true',
+                        help='fold the StandardScaler into the graph so the app can skip scaler.transform')
+    args = parser.parse_args()
+
+    keras_model = load_model(KERAS_MODEL_PATH)
+    scaler = joblib.load(SCALER_PATH)
+
+    onnx_model = build_onnx_graph(keras_model, scaler if args.include_scaler else None)
+    onnx.save(onnx_model, args.output)
+    print(f"✅ Exported {KERAS_MODEL_PATH} -> {args.output}")
+
+    check_parity(keras_model, args.output, scaler, args.include_scaler)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Gunicorn settings for the advisor app (read by `gunicorn -c gunicorn.conf.py wsgi:application`).
+
+All values can be overridden through the environment. Graceful reload:
+    kill -HUP <master>   restart workers with the already preloaded code
+    kill -USR2 <master>  start a new master with new code, then QUIT the old one
+"""
+import gc
+import multiprocessing
+import os
+
+# Load the model per worker, after fork (see MODEL_LOAD_ON_FORK in app.py)
+os.environ.setdefault('MODEL_LOAD_ON_FORK', 'true')
+# Inference is a small MLP: one math thread per worker beats oversubscribed pools
+os.environ.setdefault('TF_INTRA_OP_THREADS', '1')
+os.environ.setdefault('TF_INTER_OP_THREADS', '1')
+os.environ.setdefault('ONNX_INTRA_OP_THREADS', '1')
+os.environ.setdefault('ONNX_INTER_OP_THREADS', '1')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# One process per core for the CPU-bound forward pass; threads overlap request
+# parsing/templating and the GIL-free model call
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# Keep at least one model slot per thread (INFERENCE_MAX_CONCURRENCY in app.py)
+os.environ.setdefault('INFERENCE_MAX_CONCURRENCY', str(threads))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# Recycle workers now and then so slow leaks cannot accumulate
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    # Move everything the preloaded app allocated into the permanent generation so
+    # the garbage collector never writes to (and un-shares) those pages in workers
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app import init_worker
+    init_worker(managed=True)
+
+
+def worker_exit(server, worker):
+    from app import prediction_log, report_jobs, student_history
+    prediction_log.close()
+    student_history.close()
+    report_jobs.close()
@@ -0,0 +1,280 @@
+"""
+Score a large cohort CSV in resumable, checkpointed chunks.
+
+    python score_cohort.py cohort.csv                       # writes cohort.scored/
+    python score_cohort.py cohort.csv --chunk-rows 200000   # bigger chunks
+    python score_cohort.py cohort.csv                       # rerun after a crash: resumes
+    python score_cohort.py cohort.csv --combine             # also join the chunks into scored.csv
+    python score_cohort.py cohort.csv --rankings --cohort-column batch   # percentile cohorts per batch
+
+The input needs a header with the SCALER_FEATURES columns (extra columns such as a
+student id are copied through) and one record per line. Every chunk is scaled,
+predicted and corrected in one batch, written to chunk-NNNNNN.csv through a temp file
++ os.replace, and only then appended to manifest.json (also replaced atomically)
+together with the input byte offset where the next chunk starts. A rerun checks the
+manifest against the input file, model and correction rules, seeks straight to that
+offset and carries on; a chunk that was being written when the process died is
+simply written again.
+
+--rankings rebuilds the cohort percentile rankings the app serves (/rankings) from the
+finished job: one cohort per value of --cohort-column, or a single cohort named after
+the input file.
+"""
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import app
+
+MANIFEST_VERSION = 1
+
+
+def input_fingerprint(path, sample_bytes=1 << 20):
+    """Size + mtime + hash of the first MB: cheap enough for multi-GB inputs"""
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        head = hashlib.sha256(f.read(sample_bytes)).hexdigest()[:16]
+    return f"{stat.st_size}-{int(stat.st_mtime)}-{head}"
+
+
+def rules_fingerprint():
+    rules = json.dumps(app.correction_stage.rules, sort_keys=True)
+    return hashlib.sha256(rules.encode('utf-8')).hexdigest()[:12]
+
+
+def read_header(f):
+    """The CSV header line, without a UTF-8 BOM"""
+    header = f.readline()
+    return header[3:] if header.startswith(b'\xef\xbb\xbf') else header
+
+
+def write_atomic(path, data):
+    """Write bytes to path so readers see either the old file or the complete new one"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ChunkedScoringJob:
+    """One input file -> numbered output chunks + a manifest of the committed ones"""
+    def __init__(self, input_path, output_dir, chunk_rows=100000):
+        self.input_path = input_path
+        self.output_dir = output_dir
+        self.chunk_rows = chunk_rows
+        self.manifest_path = os.path.join(output_dir, 'manifest.json')
+        self.fingerprint = {
+            'input': input_fingerprint(input_path),
+            'chunk_rows': chunk_rows,
+            'model_version': app.MODEL_VERSION,
+            'backend': app.INFERENCE_BACKEND,
+            'correction_rules': rules_fingerprint()
+        }
+
+    def load_manifest(self, restart=False):
+        """The existing manifest if it belongs to this input/model, else a fresh one"""
+        if os.path.exists(self.manifest_path) and not restart:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION and manifest.get('fingerprint') == self.fingerprint:
+                return manifest
+            raise SystemExit(
+                f"❌ {self.manifest_path} was written for a different input, chunk size, model or rule set; "
+                f"rerun with --restart to score from scratch"
+            )
+        return {
+            'version': MANIFEST_VERSION,
+            'input_path': os.path.abspath(self.input_path),
+            'fingerprint': self.fingerprint,
+            'created_at': datetime.now().isoformat(),
+            'completed': False,
+            'chunks': []
+        }
+
+    def save_manifest(self, manifest):
+        manifest['updated_at'] = datetime.now().isoformat()
+        write_atomic(self.manifest_path, json.dumps(manifest, indent=1).encode('utf-8'))
+
+    def score_chunk(self, header, lines, first_row):
+        """Encode, predict and correct one chunk; return (output CSV bytes, stats)"""
+        frame = pd.read_csv(io.BytesIO(header + b''.join(lines)), dtype=str, keep_default_na=False,
+                            skip_blank_lines=False)
+        if len(frame) != len(lines):
+            raise SystemExit(f"❌ Rows {first_row}-{first_row + len(lines)} do not parse one record per line")
+
+        input_data, valid_mask, errors = app.feature_schema.encode_frame(frame)
+        n_classes = len(app.CLASS_LABELS)
+        probabilities = np.full((len(frame), n_classes), np.nan, dtype=np.float32)
+        final_classes = np.full(len(frame), -1, dtype=np.int64)
+        valid_rows = np.flatnonzero(valid_mask)
+        if len(valid_rows):
+            valid_data = input_data[valid_rows]
+            probabilities[valid_rows] = app.predict_probabilities(valid_data)
+            final_classes[valid_rows], _ = app.correction_stage.apply(probabilities[valid_rows], valid_data)
+
+        labels = np.array(app.CLASS_LABELS + [''], dtype=object)
+        output = frame.drop(columns=app.SCALER_FEATURES)
+        output.insert(0, 'row', np.arange(first_row, first_row + len(frame)))
+        output['predicted_class'] = labels[final_classes]
+        output['confidence'] = probabilities.max(axis=1) * 100  # NaN for invalid rows
+        for i, label in enumerate(app.CLASS_LABELS):
+            output[f'p_{label}'] = probabilities[:, i] * 100
+        output['error'] = ''
+        if errors:
+            output.loc[list(errors), 'error'] = ['; '.join(messages) for messages in errors.values()]
+
+        counts = np.bincount(final_classes[valid_rows], minlength=n_classes)
+        stats = {
+            'rows': len(frame),
+            'valid': int(len(valid_rows)),
+            'classes': dict(zip(app.CLASS_LABELS, counts.tolist()))
+        }
+        return output.to_csv(index=False, float_format='%.4f').encode('utf-8'), stats
+
+    def run(self, restart=False, max_chunks=None):
+        os.makedirs(self.output_dir, exist_ok=True)
+        manifest = self.load_manifest(restart)
+        if manifest['completed']:
+            print(f"✅ Already complete: {len(manifest['chunks'])} chunks in {self.output_dir}")
+            return manifest
+
+        done = manifest['chunks']
+        if not done:
+            for filename in os.listdir(self.output_dir):
+                if filename.startswith('chunk-'):
+                    os.remove(os.path.join(self.output_dir, filename))  # left over from an earlier run
+        first_chunk = len(done)
+        next_row = done[-1]['first_row'] + done[-1]['rows'] if done else 0
+        scored_rows, started = 0, time.perf_counter()
+        with open(self.input_path, 'rb') as f:
+            header = read_header(f)
+            if done:
+                f.seek(done[-1]['end_offset'])
+                print(f"↻ Resuming at chunk {len(done)} (row {next_row}, byte {done[-1]['end_offset']})")
+
+            for chunk_index in itertools.count(first_chunk):
+                if max_chunks is not None and chunk_index - first_chunk >= max_chunks:
+                    break
+                start_offset = f.tell()
+                lines = list(itertools.islice(f, self.chunk_rows))
+                if not lines:
+                    manifest['completed'] = True
+                    break
+                chunk_started = time.perf_counter()
+                data, stats = self.score_chunk(header, lines, next_row)
+                filename = f"chunk-{chunk_index:06d}.csv"
+                write_atomic(os.path.join(self.output_dir, filename), data)
+
+                done.append(dict(
+                    index=chunk_index,
+                    file=filename,
+                    first_row=next_row,
+                    start_offset=start_offset,
+                    end_offset=f.tell(),
+                    sha256=hashlib.sha256(data).hexdigest()[:16],
+                    seconds=round(time.perf_counter() - chunk_started, 3),
+                    **stats
+                ))
+                self.save_manifest(manifest)
+                next_row += stats['rows']
+                scored_rows += stats['rows']
+                print(f"  chunk {chunk_index}: {stats['rows']} rows ({stats['valid']} valid) "
+                      f"in {done[-1]['seconds']:.2f}s")
+
+        self.save_manifest(manifest)
+        elapsed = time.perf_counter() - started
+        rate = scored_rows / elapsed if elapsed else 0.0
+        state = 'complete' if manifest['completed'] else 'paused'
+        print(f"✅ Scored {scored_rows} rows this run in {elapsed:.1f}s ({rate:,.0f} rows/s); "
+              f"{next_row} rows in {len(done)} chunks, {state}")
+        return manifest
+
+    def build_rankings(self, manifest, cohort_column=None):
+        """Rebuild percentile cohorts from the valid rows of a completed job; returns {name: rows}
+
+        Features are re-encoded from each chunk's input byte range (the output only keeps
+        the passthrough columns), probabilities come from the chunk's p_<label> columns.
+        """
+        probability_columns = [f'p_{label}' for label in app.CLASS_LABELS]
+        features, probabilities, cohorts = [], [], []
+        with open(self.input_path, 'rb') as f:
+            header = read_header(f)
+            for chunk in manifest['chunks']:
+                f.seek(chunk['start_offset'])
+                data = f.read(chunk['end_offset'] - chunk['start_offset'])
+                frame = pd.read_csv(io.BytesIO(header + data), dtype=str, keep_default_na=False,
+                                    skip_blank_lines=False)
+                if cohort_column and cohort_column not in frame.columns:
+                    raise SystemExit(f"❌ Column '{cohort_column}' is not in {self.input_path}")
+                input_data, valid_mask, _ = app.feature_schema.encode_frame(frame)
+                scored = pd.read_csv(os.path.join(self.output_dir, chunk['file']), usecols=probability_columns)
+                features.append(input_data[valid_mask])
+                probabilities.append(scored[probability_columns].to_numpy(np.float32)[valid_mask] / 100)
+                if cohort_column:
+                    cohorts.append(frame[cohort_column].str.strip().to_numpy()[valid_mask])
+
+        features, probabilities = np.concatenate(features), np.concatenate(probabilities)
+        source = os.path.basename(self.input_path)
+        if not cohort_column:
+            name = os.path.splitext(source)[0]
+            app.cohort_rankings.build(name, features, probabilities, source=source)
+            return {name: len(features)}
+        cohorts = np.concatenate(cohorts)
+        built = {}
+        for name in np.unique(cohorts):
+            rows = cohorts == name
+            app.cohort_rankings.build(name, features[rows], probabilities[rows], source=source)
+            built[name] = int(np.count_nonzero(rows))
+        return built
+
+    def combine(self, manifest, output_path):
+        """Concatenate the committed chunks (one header) into a single CSV"""
+        with open(f"{output_path}.tmp", 'wb') as out:
+            for i, chunk in enumerate(manifest['chunks']):
+                with open(os.path.join(self.output_dir, chunk['file']), 'rb') as f:
+                    if i:
+                        f.readline()
+                    shutil.copyfileobj(f, out, 1 << 20)
+        os.replace(f"{output_path}.tmp", output_path)
+        print(f"✅ Combined {len(manifest['chunks'])} chunks -> {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='CSV with a SCALER_FEATURES header row')
+    parser.add_argument('--output-dir', help='default: <input>.scored/')
+    parser.add_argument('--chunk-rows', type=int, default=100000)
+    parser.add_argument('--restart', action='store_true', help='ignore an existing manifest and start over')
+    parser.add_argument('--max-chunks', type=int, help='stop after scoring this many chunks (resume later)')
+    parser.add_argument('--combine', action='store_true', help='write <output-dir>/scored.csv once complete')
+    parser.add_argument('--rankings', action='store_true', help='rebuild cohort percentile rankings once complete')
+    parser.add_argument('--cohort-column', help='with --rankings: one cohort per value of this column')
+    args = parser.parse_args()
+
+    if app.dnn_model is None:
+        app.init_worker()
+    output_dir = args.output_dir or f"{os.path.splitext(args.input)[0]}.scored"
+    job = ChunkedScoringJob(args.input, output_dir, args.chunk_rows)
+    manifest = job.run(restart=args.restart, max_chunks=args.max_chunks)
+    if args.combine and manifest['completed']:
+        job.combine(manifest, os.path.join(output_dir, 'scored.csv'))
+    if args.rankings and manifest['completed']:
+        started = time.perf_counter()
+        built = job.build_rankings(manifest, args.cohort_column)
+        print(f"✅ Built {len(built)} ranking cohorts ({sum(built.values())} students) in "
+              f"{time.perf_counter() - started:.1f}s -> {app.cohort_rankings.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Tune the correction rule thresholds (CGPA, confidence, probability, attendance...) on a
+labeled dataset.
+
+    python tune_correction_rules.py labeled.csv --label-column performance
+    python tune_correction_rules.py labeled.csv --label-column performance --output tuned_rules.json
+    CORRECTION_RULES_PATH=tuned_rules.json python app.py   # serve the tuned rules
+
+The CSV needs the SCALER_FEATURES columns and a label column holding CLASS_LABELS
+values. It is scored once and the probability matrix is cached next to it
+(<input>.probs.npz; reused until the file or model changes), so reruns with other
+grids or metrics skip the model entirely.
+
+Every threshold of every rule is searched on a grid: max_confidence,
+min_target_probability and the value of each <, <=, >, >= condition (== and != search
+the values seen in the data). For one rule, each row's position in every threshold grid
+is binned into a histogram over (grid cells x true class x class without the rule), and
+cumulative sums along each grid axis then give the rows the rule would move for every
+configuration at once: tens of thousands of configurations cost one bincount. Rules
+are tuned one at a time with the others fixed (coordinate ascent) until no rule
+improves the metric, and the result is re-checked with the serving CorrectionRuleStage.
+
+Rows are split into a search set and a --holdout set (25%) so the report shows whether
+the tuned thresholds generalize.
+"""
+import argparse
+import copy
+import io
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import app
+from score_cohort import input_fingerprint, write_atomic
+
+MONOTONE_OPERATORS = ('<', '<=', '>', '>=')
+
+
+def load_dataset(path, label_column, cache_path):
+    """(features, true class indices, probabilities) for the valid, labeled rows of a CSV"""
+    fingerprint = f"{input_fingerprint(path)}|{label_column}|{app.MODEL_VERSION}|{app.INFERENCE_BACKEND}"
+    if os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        if str(cached['fingerprint']) == fingerprint:
+            print(f"↻ Using cached probabilities from {cache_path}")
+            return cached['features'], cached['labels'], cached['probabilities']
+
+    frame = pd.read_csv(path, dtype=str, keep_default_na=False)
+    if label_column not in frame.columns:
+        raise SystemExit(f"❌ Column '{label_column}' is not in {path}")
+    features, valid_mask, errors = app.feature_schema.encode_frame(frame)
+    label_index = {label.lower(): i for i, label in enumerate(app.CLASS_LABELS)}
+    labels = frame[label_column].str.strip().str.lower().map(label_index).to_numpy(dtype=np.float64, na_value=np.nan)
+    unlabeled = np.isnan(labels) & valid_mask
+    keep = valid_mask & ~np.isnan(labels)
+    print(f"Loaded {len(frame)} rows: {int(keep.sum())} usable, {len(errors)} with invalid features, "
+          f"{int(unlabeled.sum())} with a label outside {app.CLASS_LABELS}")
+
+    started = time.perf_counter()
+    features, labels = features[keep], labels[keep].astype(np.int64)
+    probabilities = np.asarray(app.predict_probabilities(features), dtype=np.float32)
+    print(f"Scored {len(features)} rows in {time.perf_counter() - started:.1f}s")
+
+    buffer = io.BytesIO()
+    np.savez(buffer, fingerprint=np.array(fingerprint), features=features, labels=labels, probabilities=probabilities)
+    write_atomic(cache_path, buffer.getvalue())
+    return features, labels, probabilities
+
+
+def confusion_matrix(labels, predicted, n_classes):
+    return np.bincount(labels * n_classes + predicted, minlength=n_classes * n_classes).reshape(n_classes, n_classes)
+
+
+def classification_scores(confusions):
+    """Accuracy, macro F1 and per-class precision/recall/F1 of (..., K, K) confusion matrices"""
+    confusions = np.asarray(confusions, dtype=np.float64)
+    true_positive = np.diagonal(confusions, axis1=-2, axis2=-1)
+    precision = true_positive / np.maximum(confusions.sum(axis=-2), 1)
+    recall = true_positive / np.maximum(confusions.sum(axis=-1), 1)
+    f1 = np.where(precision + recall > 0, 2 * precision * recall / np.maximum(precision + recall, 1e-12), 0.0)
+    return {
+        'accuracy': true_positive.sum(axis=-1) / np.maximum(confusions.sum(axis=(-2, -1)), 1),
+        'macro_f1': f1.mean(axis=-1),
+        'precision': precision,
+        'recall': recall,
+        'f1': f1
+    }
+
+
+class ThresholdSearch:
+    """Exhaustive per-rule threshold grids over a cached (features, labels, probabilities) set"""
+    def __init__(self, features, labels, probabilities, steps=11):
+        self.features = features
+        self.labels = labels
+        self.probabilities = probabilities
+        self.predicted = np.argmax(probabilities, axis=1)
+        self.confidence = np.max(probabilities, axis=1)
+        self.steps = steps
+        self.n_classes = len(app.CLASS_LABELS)
+        self.evaluated = 0
+
+    def stage(self, rules):
+        return app.CorrectionRuleStage(rules, app.CLASS_LABELS, app.SCALER_FEATURES)
+
+    def confusion(self, rules):
+        final, _ = self.stage(rules).apply(self.probabilities, self.features, self.predicted, self.confidence)
+        return confusion_matrix(self.labels, final, self.n_classes)
+
+    def parameters(self, rule, eligible):
+        """(path in the rule, operator, per-row values, ascending grid) for every threshold of a rule"""
+        to_index = app.CLASS_LABELS.index(rule['to_class'])
+        grid = np.round(np.linspace(0.0, 1.0, 2 * self.steps - 1), 4)
+        parameters = [
+            (('max_confidence',), '<', self.confidence, grid[self.steps - 1:]),  # 0.5 .. 1.0
+            (('min_target_probability',), '>', self.probabilities[:, to_index], grid[:self.steps])  # 0.0 .. 0.5
+        ]
+        for j, (feature, op, _) in enumerate(rule.get('conditions', [])):
+            values = self.features[:, app.SCALER_FEATURES.index(feature)]
+            seen = np.unique(values[eligible]).astype(np.float64)
+            if op in MONOTONE_OPERATORS:
+                candidates = np.round(np.quantile(seen, np.linspace(0.0, 1.0, self.steps)), 2) if len(seen) else seen
+            else:
+                candidates = seen if len(seen) <= 4 * self.steps else np.array([])
+            parameters.append((('conditions', j, 2), op, values, candidates))
+        # The current value is always a candidate, so the search can only match or beat it
+        return [(path, op, values, np.union1d(candidates, [self.get(rule, path)]))
+                for path, op, values, candidates in parameters]
+
+    @staticmethod
+    def get(rule, path):
+        value = rule
+        for key in path:
+            value = value[key]
+        return float(value)
+
+    @staticmethod
+    def set(rule, path, value):
+        target = rule
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = float(value)
+
+    @staticmethod
+    def grid_bins(values, op, grid):
+        """Histogram bin per row along one threshold axis (len(grid) = never satisfied)
+
+        Monotone operators are binned so that a cumulative sum along the axis counts the
+        rows satisfying the condition at each grid value; > and >= run over the grid in
+        reverse and are flipped back afterwards.
+        """
+        # compare in float64, as CorrectionRuleStage does
+        grid, values = grid.astype(np.float64), np.asarray(values, dtype=np.float64)
+        size = len(grid)
+        if op == '<':
+            return np.searchsorted(grid, values, side='right')
+        if op == '<=':
+            return np.searchsorted(grid, values, side='left')
+        if op == '>':
+            return size - np.searchsorted(grid, values, side='left')
+        if op == '>=':
+            return size - np.searchsorted(grid, values, side='right')
+        position = np.minimum(np.searchsorted(grid, values, side='left'), size - 1)
+        return np.where(grid[position] == values, position, size)
+
+    def rule_grid(self, rules, rule_index):
+        """(parameters, confusion matrix per configuration) for every threshold combination of one rule
+
+        The other rules stay as they are: rows claimed by an earlier rule are out of
+        reach, and a row the rule does not take keeps the class the remaining rules give it.
+        """
+        rule = rules[rule_index]
+        from_index = app.CLASS_LABELS.index(rule['from_class'])
+        to_index = app.CLASS_LABELS.index(rule['to_class'])
+        _, applied = self.stage(rules).apply(self.probabilities, self.features, self.predicted, self.confidence)
+        without, _ = self.stage(rules[:rule_index] + rules[rule_index + 1:]).apply(
+            self.probabilities, self.features, self.predicted, self.confidence)
+        claimed = (applied >= 0) & (applied < rule_index)
+        eligible = np.flatnonzero((self.predicted == from_index) & ~claimed)
+
+        parameters = self.parameters(rule, eligible)
+        shape = [len(grid) + 1 for _, _, _, grid in parameters] + [self.n_classes * self.n_classes]
+        bins = [self.grid_bins(values[eligible], op, grid) for _, op, values, grid in parameters]
+        pairs = self.labels[eligible] * self.n_classes + without[eligible]
+        flat = np.ravel_multi_index(bins + [pairs], shape)
+        moved = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+
+        for axis, (_, op, _, grid) in enumerate(parameters):
+            if op in MONOTONE_OPERATORS:
+                moved = np.cumsum(moved, axis=axis).take(np.arange(len(grid)), axis=axis)
+                if op in ('>', '>='):
+                    moved = np.flip(moved, axis=axis)
+            elif op == '==':
+                moved = moved.take(np.arange(len(grid)), axis=axis)
+            else:  # '!=': everything except the rows equal to the grid value
+                moved = moved.sum(axis=axis, keepdims=True) - moved.take(np.arange(len(grid)), axis=axis)
+
+        moved = moved.reshape(-1, self.n_classes, self.n_classes)  # [config, true class, class without rule]
+        confusions = confusion_matrix(self.labels, without, self.n_classes)[None] - moved
+        confusions[:, :, to_index] += moved.sum(axis=2)
+        self.evaluated += len(confusions)
+        return parameters, confusions
+
+    def search(self, rules, metric='macro_f1', max_passes=5):
+        """Coordinate ascent over rules; returns (tuned rules, metric before, metric after)"""
+        rules = copy.deepcopy(rules)
+        start_score = best_score = float(classification_scores(self.confusion(rules))[metric])
+        for _ in range(max_passes):
+            improved = False
+            for rule_index, rule in enumerate(rules):
+                parameters, confusions = self.rule_grid(rules, rule_index)
+                scores = classification_scores(confusions)[metric]
+                if scores.max() <= best_score + 1e-12:
+                    continue
+                # Among equally good configurations take the one closest to the current thresholds
+                grids = [grid for _, _, _, grid in parameters]
+                candidates = np.flatnonzero(scores >= scores.max() - 1e-12)
+                positions = np.unravel_index(candidates, [len(grid) for grid in grids])
+                distance = sum(
+                    np.abs(grid[position] - self.get(rule, path)) / max(np.ptp(grid), 1e-12)
+                    for (path, _, _, grid), position in zip(parameters, positions)
+                )
+                choice = int(np.argmin(distance))
+                for (path, _, _, grid), position in zip(parameters, positions):
+                    self.set(rule, path, grid[position[choice]])
+                # The histogram arithmetic must agree with the serving path row for row
+                if not np.array_equal(self.confusion(rules), confusions[candidates[choice]]):
+                    raise SystemExit(f"❌ Grid evaluation of {rule['name']} disagrees with CorrectionRuleStage")
+                best_score = float(scores[candidates[choice]])
+                improved = True
+            if not improved:
+                break
+        return rules, start_score, best_score
+
+
+def print_report(title, confusion):
+    scores = classification_scores(confusion)
+    print(f"\n{title}: accuracy {scores['accuracy']:.4f}, macro F1 {scores['macro_f1']:.4f}")
+    width = max(len(label) for label in app.CLASS_LABELS) + 2
+    print(" " * width + "".join(f"{label[:10]:>11}" for label in app.CLASS_LABELS) + "   precision  recall      F1")
+    for i, label in enumerate(app.CLASS_LABELS):
+        print(f"{label:<{width}}" + "".join(f"{count:>11}" for count in confusion[i])
+              + f"   {scores['precision'][i]:>9.4f} {scores['recall'][i]:>7.4f} {scores['f1'][i]:>7.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='CSV with SCALER_FEATURES columns and a label column')
+    parser.add_argument('--label-column', default='performance', help='column holding the true class')
+    parser.add_argument('--cache', help='probability cache (default: <input>.probs.npz)')
+    parser.add_argument('--steps', type=int, default=11, help='grid values per threshold')
+    parser.add_argument('--metric', choices=['macro_f1', 'accuracy'], default='macro_f1')
+    parser.add_argument('--holdout', type=float, default=0.25, help='share of rows kept out of the search')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the tuned rules here (JSON for CORRECTION_RULES_PATH)')
+    args = parser.parse_args()
+
+    if app.dnn_model is None:
+        app.init_worker()
+    features, labels, probabilities = load_dataset(
+        args.input, args.label_column, args.cache or f"{os.path.splitext(args.input)[0]}.probs.npz")
+    order = np.random.default_rng(args.seed).permutation(len(labels))
+    n_holdout = int(len(labels) * args.holdout)
+    search_rows, holdout_rows = np.sort(order[n_holdout:]), np.sort(order[:n_holdout])
+
+    rules = app.correction_stage.rules
+    search = ThresholdSearch(features[search_rows], labels[search_rows], probabilities[search_rows], args.steps)
+    started = time.perf_counter()
+    tuned, before, after = search.search(rules, args.metric)
+    elapsed = time.perf_counter() - started
+    print(f"\nSearched {search.evaluated:,} rule configurations on {len(search_rows)} rows in {elapsed:.2f}s "
+          f"({search.evaluated / max(elapsed, 1e-9):,.0f}/s): {args.metric} {before:.4f} -> {after:.4f}")
+
+    for rule, tuned_rule in zip(rules, tuned):
+        for path, *_ in search.parameters(rule, np.arange(0)):
+            old, new = ThresholdSearch.get(rule, path), ThresholdSearch.get(tuned_rule, path)
+            if old != new:
+                name = path[0] if len(path) == 1 else f"{rule['conditions'][path[1]][0]} {rule['conditions'][path[1]][1]}"
+                print(f"  {rule['name']}: {name} {old:g} -> {new:g}")
+
+    evaluations = [('search', search_rows)] + ([('holdout', holdout_rows)] if len(holdout_rows) else [])
+    for split, rows in evaluations:
+        subset = ThresholdSearch(features[rows], labels[rows], probabilities[rows])
+        for title, rule_set in (('no rules', []), ('current rules', rules), ('tuned rules', tuned)):
+            print_report(f"[{split}] {title}", subset.confusion(rule_set))
+
+    if args.output:
+        write_atomic(args.output, json.dumps(tuned, indent=2).encode('utf-8'))
+        print(f"\n✅ Tuned rules -> {args.output} (serve with CORRECTION_RULES_PATH={args.output})")
+
+
+if __name__ == "__main__":
+    main()
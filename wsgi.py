@@ -0,0 +1,19 @@
+"""
+WSGI entry point for production serving.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+Importing app builds the scaler, schema, knowledge bases and semantic index once.
+With preload_app the gunicorn master does this before forking, and each worker
+calls init_worker() from the post_fork hook to open its own model session.
+"""
+from app import app, init_worker
+
+
+def create_app():
+    """Return the Flask app, loading the model in this process if it was deferred"""
+    init_worker()
+    return app
+
+
+application = app